@@ -0,0 +1,354 @@
+import numpy as np # Mathmatical library
+import asyncio
+import inspect
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from Jiggler_funcs_V1_02_with_temp import FixedRateSchedule
+
+"""
+Runs several Jigglers (one per COM port) from a single process and event loop,
+instead of one notebook kernel running Jiggler_loop per instrument.
+
+The serial I/O of every instrument is done on the event loop without blocking,
+by only reading what is already waiting on the port and sleeping otherwise, so
+the instruments sweep at the same time. Formatting, fitting and plotting of a
+finished sweep run on an executor (a thread pool by default) and each sweep
+result is handed to a single shared sink.
+
+Usage:
+    driver = JigglerDriver(sink = JsonLinesSink("rack_resonances.jsonl"))
+    driver.add(Jiggler(com_port = "COM3"), name = "rig_1", period = 240)
+    driver.add(Jiggler(com_port = "COM4"), name = "rig_2", period = 300, offset = 60)
+    driver.run(duration = 24*3600)
+
+Each Jiggler still writes its own figures and data files, so give every
+instrument its own options_dict["output_directory"].
+
+The driver sweeps every frequency of the interval (or of the tracking window)
+in turn, options which change how a sweep is acquired ("adaptive_sweep", 
+"pipelined_sweep" and "adaptive_dwell") are not supported and add() refuses 
+Jigglers which set them.
+"""
+
+# Options of Jiggler_sweep the driver's own acquisition does not implement
+UNSUPPORTED_OPTIONS = ["adaptive_sweep", "pipelined_sweep", "adaptive_dwell"]
+
+class Instrument():
+    """
+    A Jiggler managed by a JigglerDriver and its schedule.
+
+        jig = the Jiggler
+        name = name used in messages and sink records, defaults to the port
+        period = seconds between sweep starts (fixed rate, see
+                 Jiggler.fixed_rate_loop)
+        duration = seconds this instrument runs for, None runs until the
+                   driver's duration or stop()
+        offset = delay of the first sweep in seconds, to stagger instruments
+
+    The schedule of each sweep is kept in jig.schedule_log in the
+    fixed_rate_loop format, failed sweeps are counted in self.failures.
+    """
+    def __init__(self, jig, name = None, period = 240, duration = None, offset = 0):
+        self.jig = jig
+        self.name = name if name != None else jig.serial_dict["port"]
+        self.period = period
+        self.duration = duration
+        self.offset = offset
+        self.sweeps = 0
+        self.failures = 0
+
+
+    def __repr__(self):
+        return (f"Instrument({self.name!r}, period={self.period}, sweeps={self.sweeps}, "
+                f"failures={self.failures})")
+
+
+class JsonLinesSink():
+    """
+    Shared sink writing one json line per sweep of any instrument to path:
+    instrument, loop_count, start/mid/end time, resonant frequencies, mean
+    temperatures, number of frequencies and of rejected rows.
+    """
+    def __init__(self, path):
+        self.path = path
+
+
+    def __call__(self, instrument, loop_count, summary):
+        temp1 = summary.A_sol_list[4]
+        temp2 = summary.A_sol_list[5]
+        record = {"instrument" : instrument.name, "loop_count" : loop_count,
+                  "start_time" : summary.start_time.isoformat(timespec = "seconds"),
+                  "mid_time" : summary.mid_time,
+                  "end_time" : summary.end_time.isoformat(timespec = "seconds"),
+                  "parabolic_res_freq" : _to_float(summary.parabolic_res_freq),
+                  "lorentz_res_freq" : _to_float(summary.lorentz_res_freq),
+                  "temp1" : float(np.mean(temp1)) if len(temp1) > 0 else None,
+                  "temp2" : float(np.mean(temp2)) if len(temp2) > 0 else None,
+                  "n_records" : summary.n_records, "bad_count" : summary.bad_count}
+        with open(self.path, "a") as f:
+            f.write(json.dumps(record) + "\n")
+
+
+def _to_float(value):
+    return None if value == None else float(value)
+
+
+class JigglerDriver():
+    """
+    Runs the sweeps of many instruments concurrently on one asyncio event
+    loop, each on its own fixed rate schedule.
+
+    Parameters:
+        sink = callable or coroutine function called as
+               sink(instrument, loop_count, summary) with a SweepSummary after
+               every successful sweep. Calls are made one at a time, in the
+               order the sweeps finish, so the sink needs no locking.
+        executor = concurrent.futures executor for the processing of finished
+                   sweeps (and for connecting and sync sinks). Defaults to a
+                   thread pool of `workers` threads. The processing calls
+                   Jiggler methods, so a process pool can not be used.
+        workers = size of the default thread pool, defaults to the number of
+                  instruments
+        poll_interval = sleep in seconds when no data is waiting on a port
+        skip_missed = True skips the slots a sweep overran into (as
+                      options_dict["skip_missed_slots"] in fixed_rate_loop)
+    """
+    def __init__(self, sink = None, executor = None, workers = None, poll_interval = 0.005,
+                 skip_missed = True):
+        self.instruments = []
+        self.sink = sink
+        self.executor = executor
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.skip_missed = skip_missed
+        self.sink_errors = []
+
+        self._loop = None
+        self._stop = None
+        self._results = None
+
+
+    def add(self, jig, name = None, period = 240, duration = None, offset = 0):
+        """Adds a Jiggler to the driver, see Instrument for the parameters.
+        Returns the Instrument. Raises a ValueError if the Jiggler sets any
+        of UNSUPPORTED_OPTIONS."""
+        unsupported = [option for option in UNSUPPORTED_OPTIONS if jig.options_dict.get(option) == True]
+        if len(unsupported) > 0:
+            raise ValueError(f"JigglerDriver does not support the options {unsupported}, "
+                             f"turn them off or run this Jiggler with Jiggler_loop")
+        instrument = Instrument(jig, name, period, duration, offset)
+        self.instruments.append(instrument)
+        return instrument
+
+
+    def run(self, duration = None):
+        """Blocking entry point, runs all instruments for duration seconds
+        (None runs until every instrument's own duration is over or stop())"""
+        asyncio.run(self.run_async(duration))
+
+
+    def stop(self):
+        """Ends the run after the sweeps in progress, can be called from any
+        thread"""
+        if self._loop != None:
+            self._loop.call_soon_threadsafe(self._stop.set)
+
+
+    """Event loop"""
+    #---------------------------------------------------------------------------
+    async def run_async(self, duration = None):
+        """Coroutine version of run(), for use inside a running event loop"""
+        self._loop = asyncio.get_running_loop()
+        self._stop = asyncio.Event()
+        self._results = asyncio.Queue()
+
+        executor = self.executor
+        if executor == None:
+            workers = self.workers if self.workers != None else max(1, len(self.instruments))
+            executor = ThreadPoolExecutor(workers, thread_name_prefix = "Jiggler driver")
+
+        sink_task = asyncio.create_task(self._sink_loop(executor))
+        tasks = [asyncio.create_task(self._instrument_loop(instrument, executor, duration))
+                 for instrument in self.instruments]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await self._results.put(None)
+            await sink_task
+
+            for instrument in self.instruments:
+                await self._loop.run_in_executor(executor, instrument.jig.stop_render_service)
+            if self.executor == None:
+                executor.shutdown()
+            self._loop = None
+        print(f"Driver Complete at {time.time()}")
+
+
+    async def _sink_loop(self, executor):
+        """Hands the sweep results to the sink one at a time"""
+        while True:
+            item = await self._results.get()
+            if item == None:
+                break
+            if self.sink == None:
+                continue
+            try:
+                if inspect.iscoroutinefunction(self.sink):
+                    await self.sink(*item)
+                else:
+                    await self._loop.run_in_executor(executor, self.sink, *item)
+            except Exception as e:
+                error = f"SINK FAILED for {item[0].name} sweep {item[1]} ({e!r})"
+                print(error)
+                self.sink_errors.append(error)
+
+
+    async def _instrument_loop(self, instrument, executor, duration):
+        """Fixed rate schedule of one instrument, as Jiggler.fixed_rate_loop"""
+        jig = instrument.jig
+        period = instrument.period
+        if instrument.duration != None:
+            duration = instrument.duration if duration == None else min(duration, instrument.duration)
+
+        schedule = FixedRateSchedule(period, self.skip_missed, offset = instrument.offset)
+        jig.midsample_times = []
+        jig.schedule_log = []
+        while schedule.due(duration):
+            try:
+                await asyncio.wait_for(self._stop.wait(), schedule.wait())
+                break
+            except asyncio.TimeoutError:
+                pass
+
+            jig.loop_count += 1
+            schedule.start()
+            try:
+                summary = await self.sweep(instrument, executor)
+            except Exception as e:
+                # One failing instrument must not stop the others, the port is
+                # closed so the next sweep reconnects
+                error = f"{instrument.name} SWEEP {jig.loop_count} FAILED ({e!r})"
+                print(error)
+                jig.error_log.append(error)
+                jig.metrics.count("sweep_failures")
+                instrument.failures += 1
+                await self._loop.run_in_executor(executor, jig.close)
+            else:
+                instrument.sweeps += 1
+                await self._results.put((instrument, jig.loop_count, summary))
+
+            jig.finish_slot(schedule, instrument.name)
+
+
+    """Sweeps"""
+    #---------------------------------------------------------------------------
+    async def sweep(self, instrument, executor):
+        """
+        Non-blocking equivalent of Jiggler_sweep for one instrument. The
+        frequencies are written and read on the event loop, the finished
+        sweep is processed on the executor by process_sweep(). Returns the
+        SweepSummary.
+        """
+        jig = instrument.jig
+
+        # Opening the port waits for the Arduino to boot, so it is done on the
+        # executor
+        await self._loop.run_in_executor(executor, jig.connect)
+
+        if jig.options_dict["tracking_sweep"] == True:
+            freq_byte_list = jig.tracking_byte_list()
+        else:
+            freq_byte_list = jig.frequency_byte_list
+
+        start_time = datetime.today()
+        sweep_data = []
+        try:
+            for freq_byte in freq_byte_list:
+                await self.write_frequency(jig, freq_byte)
+                sweep_data.append(await self.read_block(jig))
+        finally:
+            jig.reset_instrument()
+        end_time = datetime.today()
+
+        return await self._loop.run_in_executor(executor, self.process_sweep, jig, sweep_data,
+                                                start_time, end_time)
+
+
+    async def write_frequency(self, jig, freq_byte, buffer = 100/1E6):
+        """Async version of Jiggler.write_data"""
+        await asyncio.sleep(buffer)
+        jig.serial.reset_input_buffer()
+        output = jig.serial.write(freq_byte)
+        if output == 0:
+            jig.metrics.count("write_failures")
+            if jig.options_dict["silent"] == False:
+                error = f"WRITING FREQUENCY {freq_byte} FAILED"
+                print(error)
+                jig.error_log.append(error)
+
+
+    async def read_block(self, jig):
+        """
+        Async version of Jiggler.read_data_buffered. Only the bytes already
+        waiting on the port are read, so the read never blocks, and the loop
+        sleeps poll_interval when nothing is waiting. Stops after sample_size
+        records or once the port has been quiet for the serial timeout.
+        """
+        chunk_size = jig.options_dict["read_chunk_size"]
+        timeout = jig.serial.timeout
+
+        read_start = time.perf_counter()
+        last_data = read_start
+        n_bytes = 0
+        data_list = []
+        partial = b""
+        while len(data_list) < jig.sample_size:
+            waiting = jig.serial.in_waiting
+            if waiting == 0:
+                if timeout != None and time.perf_counter() - last_data > timeout:
+                    break
+                await asyncio.sleep(self.poll_interval)
+                continue
+
+            chunk = jig.serial.read(min(waiting, chunk_size))
+            last_data = time.perf_counter()
+            n_bytes += len(chunk)
+
+            complete, newline, partial = (partial + chunk).rpartition(b"\n")
+            if newline:
+                decoded = complete.decode("ascii", errors = "replace")
+                data_list.extend(line + "\n" for line in decoded.split("\n"))
+
+            # Letting the other instruments run between chunks
+            await asyncio.sleep(0)
+
+        del data_list[jig.sample_size:]
+        jig.record_read(len(data_list), n_bytes, time.perf_counter() - read_start)
+
+        return data_list
+
+
+    def process_sweep(self, jig, sweep_data, start_time, end_time):
+        """
+        Formats, fits, plots and exports a sweep read by sweep() with the same
+        Jiggler methods as Jiggler_sweep and Jiggler_loop. Runs on the 
+        executor, only one sweep of a given Jiggler is processed at a time.
+        """
+        jig.sweep_data = sweep_data
+        jig.settling_times = []
+        formatted_data, bad_count = jig.data_formatter(sweep_data, return_bad_count = True)
+        jig.formatted_data = formatted_data
+
+        A_sol_list = jig.Amplitude_solver(formatted_data)
+        jig.finish_sweep(A_sol_list, start_time, end_time)
+        jig.finish_loop_sweep()
+        return jig.sweep_summary(len(formatted_data), bad_count)
+
+
+    def __repr__(self):
+        return f"JigglerDriver(instruments={self.instruments})"
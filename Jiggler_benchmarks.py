@@ -0,0 +1,476 @@
+import numpy as np # Mathmatical library
+import matplotlib.pyplot as plt
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+from Jiggler_funcs_V1_02_with_temp import Jiggler, options_defaults, serial_defaults
+from Jiggler_simulator import SimulatedSerial, attach_simulator
+
+"""
+Benchmarks for the Jiggler data processing functions. Everything here runs on
+synthetic data, so no instrument needs to be connected.
+
+Run from the command line with:
+    python Jiggler_benchmarks.py
+    python Jiggler_benchmarks.py --n-freq 81 --sample-size 3000 --n-sweeps 10
+    python Jiggler_benchmarks.py --compare old_results.json new_results.json
+    python Jiggler_benchmarks.py --cold-start
+    python Jiggler_benchmarks.py --check-tracking
+"""
+
+"""Synthetic Data"""
+#-------------------------------------------------------------------------------
+def synthetic_formatted_data(f_interval = [110,118], step_size = 0.2, sample_size = 1500,
+                             res_freq = 114, gamma = 0.8, peak_amplitude = 10,
+                             noise = 1.0, sample_period = 700/1E6, seed = 0):
+    """
+    Builds a sweep in the format returned by Jiggler.data_formatter(), ie. a
+    list of [freq, time_vals, angle_vals, temp1_vals, temp2_vals] per frequency.
+
+    The angle follows a Lorentzian amplitude response around res_freq, in
+    tenths of a degree and rounded to integers like the Arduino output.
+
+    Parameters:
+        f_interval, step_size, sample_size = same meaning as for Jiggler()
+        res_freq = resonant frequency of the synthetic response in Hz
+        gamma = half width at half max of the response in Hz
+        peak_amplitude = amplitude at res_freq in tenths of a degree
+        noise = standard deviation of the added angle noise (tenths of a degree)
+        sample_period = mean time between samples in seconds
+        seed = seed for the random generator
+    """
+    rng = np.random.default_rng(seed)
+    frequencies = np.linspace(f_interval[0], f_interval[-1],
+                              int(np.abs(f_interval[-1] - f_interval[0])/step_size) + 1)
+
+    formatted_data = []
+    for freq in frequencies:
+        # Sample times with some jitter, starting near zero like the Arduino micros
+        time_vals = np.cumsum(rng.uniform(0.8, 1.2, sample_size)*sample_period)
+        amplitude = peak_amplitude*gamma**2/((freq - res_freq)**2 + gamma**2)
+        angle_vals = np.round(amplitude*np.cos(2*np.pi*freq*time_vals + rng.uniform(0, 2*np.pi))
+                              + rng.normal(0, noise, sample_size))
+        temp1_vals = 25 + rng.normal(0, 0.05, sample_size)
+        temp2_vals = 24 + rng.normal(0, 0.05, sample_size)
+        formatted_data.append([float(freq), time_vals, angle_vals, temp1_vals, temp2_vals])
+
+    return formatted_data
+
+
+def synthetic_sweep_data(n_freq = 41, f_interval = [110,118], sample_size = 1500,
+                         seed = 0, **sim_params):
+    """
+    Builds the raw data of one sweep in the format returned by 
+    Jiggler.sample_frequencies(), ie. one list of "freq,micros,angle,temp1,temp2\r\n"
+    strings per frequency, generated by SimulatedSerial.
+
+    n_freq frequencies are spread evenly across f_interval. sim_params are 
+    passed on to SimulatedSerial (eg. res_freq, noise, garble_prob).
+    """
+    sim = SimulatedSerial(sample_size = sample_size, realtime = False, seed = seed, **sim_params)
+    frequencies = np.linspace(f_interval[0], f_interval[-1], n_freq)
+
+    return [sim.generate_block(freq).decode("ascii").splitlines(keepends = True)
+            for freq in frequencies]
+
+
+"""Stage Measurement"""
+#-------------------------------------------------------------------------------
+class StageRecorder():
+    """
+    Collects the wall time of every call of each named stage. With 
+    trace_memory = True the peak memory allocated during each stage is also
+    recorded with tracemalloc. Tracing slows Python code down considerably, 
+    so times and memory should come from separate runs.
+    """
+    def __init__(self, trace_memory = False):
+        self.trace_memory = trace_memory
+        self.times = {}
+        self.peak_memory = {}
+
+
+    @contextmanager
+    def stage(self, name):
+        if self.trace_memory == True:
+            tracemalloc.start()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.times.setdefault(name, []).append(elapsed)
+            if self.trace_memory == True:
+                current, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+                self.peak_memory[name] = max(peak, self.peak_memory.get(name, 0))
+
+
+"""Benchmarks"""
+#-------------------------------------------------------------------------------
+def benchmark_sin_fit(f_interval = [110,118], step_size = 0.2, sample_size = 1500,
+                      n_sweeps = 1, repeats = 20):
+    """
+    Compares the per-frequency Nicks_Sin_fit loop against Batched_Sin_fit. 
+    With n_sweeps > 1 the frequencies of all sweeps are fit in a single 
+    Batched_Sin_fit call, as when re-fitting archived data.
+
+    Prints and returns the mean time per sweep of each method and the largest
+    amplitude difference between them.
+    """
+    jig = Jiggler(f_interval = f_interval, step_size = step_size, sample_size = sample_size,
+                  serial_dict = dict(serial_defaults), options_dict = dict(options_defaults))
+    formatted_data = []
+    for seed in range(n_sweeps):
+        formatted_data += synthetic_formatted_data(f_interval, step_size, sample_size, seed = seed)
+    frequency = [data[0] for data in formatted_data]
+    time_list = [data[1] for data in formatted_data]
+    angle_list = [data[2] for data in formatted_data]
+
+    # Per-frequency loop, as used by Amplitude_solver before batching
+    start = time.perf_counter()
+    for i in range(repeats):
+        A_loop = np.array([jig.Nicks_Sin_fit(data[1], data[2], data[0])
+                           for data in formatted_data])
+    loop_time = (time.perf_counter() - start)/(repeats*n_sweeps)
+
+    # All frequencies in one call
+    start = time.perf_counter()
+    for i in range(repeats):
+        A_batched, phase, rms = jig.Batched_Sin_fit(time_list, angle_list, frequency)
+    batched_time = (time.perf_counter() - start)/(repeats*n_sweeps)
+
+    results = {"n_freq" : len(formatted_data)//n_sweeps, "n_sweeps" : n_sweeps,
+               "sample_size" : sample_size,
+               "loop_s" : loop_time, "batched_s" : batched_time,
+               "speedup" : loop_time/batched_time,
+               "max_abs_diff" : float(np.max(np.abs(A_loop - A_batched)))}
+
+    print(f"Sin fit of {n_sweeps} sweep(s) of {results['n_freq']} frequencies x {sample_size} samples")
+    print(f"    per-frequency loop: {loop_time*1E3:.2f} ms per sweep")
+    print(f"    batched:            {batched_time*1E3:.2f} ms per sweep "
+          f"({results['speedup']:.1f}x)")
+    print(f"    max amplitude difference: {results['max_abs_diff']:.2e}")
+
+    return results
+
+
+def _run_pipeline(recorder, sweeps, f_interval, sample_size, output_directory, plot = True):
+    """Runs every processing stage of a sweep on each of the raw sweeps in
+    sweeps, then exports the resonance history of all of them"""
+    n_freq = len(sweeps[0])
+    step_size = (f_interval[-1] - f_interval[0])/(n_freq - 1)
+    jig = Jiggler(f_interval = f_interval, step_size = step_size, sample_size = sample_size,
+                  serial_dict = dict(serial_defaults), options_dict = dict(options_defaults))
+    jig.options_dict.update({"silent" : True, "output_directory" : output_directory,
+                             "export_figure" : plot, "export_data" : plot})
+
+    start_time = datetime(2024, 1, 1)
+    for i, sweep_data in enumerate(sweeps):
+        # Named like data_importer() names imported sweeps
+        name = (start_time + timedelta(minutes = 10*i)).strftime('%Y_%m_%d %H_%M_%S')
+        jig.import_times.append([None, name, None])
+        jig.midsample_times.append(name)
+
+        with recorder.stage("data_filter"):
+            for data_list in sweep_data:
+                jig.data_filter(data_list)
+
+        with recorder.stage("data_formatter"):
+            formatted_data = jig.data_formatter(sweep_data)
+
+        with recorder.stage("Nicks_Sin_fit"):
+            for data in formatted_data:
+                jig.Nicks_Sin_fit(data[1], data[2], data[0])
+
+        with recorder.stage("Average_Amplitude"):
+            for data in formatted_data:
+                jig.Average_Amplitude(data[2])
+
+        with recorder.stage("Amplitude_max"):
+            for data in formatted_data:
+                jig.Amplitude_max(data[2])
+
+        with recorder.stage("Amplitude_solver"):
+            A_sol_list = jig.Amplitude_solver(formatted_data)
+
+        with recorder.stage("parabolic_fit"):
+            jig.parabolic_fit_params = jig.parabolic_fit(A_sol_list, step_size = step_size)
+        jig.parabolic_res_freq.append(jig.parabolic_fit_params[0])
+
+        with recorder.stage("lorentz_fit"):
+            jig.lorentz_fit_params = jig.lorentz_fit(A_sol_list)
+        jig.lorentz_res_freq.append(jig.lorentz_fit_params[0])
+
+        if plot == True:
+            with recorder.stage("quick_plot"):
+                jig.quick_plot(A_sol_list = A_sol_list, time_list = jig.import_times[-1],
+                               x_lims = f_interval)
+
+        jig.temp1.append(jig.Average_Temp(A_sol_list[4]))
+        jig.temp2.append(jig.Average_Temp(A_sol_list[5]))
+
+    if plot == True:
+        with recorder.stage("resonance_exporter"):
+            jig.resonance_exporter()
+        plt.close("all")
+
+
+def _git_commit():
+    """Commit hash of the working tree, None outside a git checkout"""
+    try:
+        result = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output = True,
+                                text = True, cwd = os.path.dirname(os.path.abspath(__file__)))
+    except OSError:
+        return None
+    return result.stdout.strip() if result.returncode == 0 else None
+
+
+def benchmark_pipeline(n_freq = 41, sample_size = 1500, n_sweeps = 5, f_interval = [110,118],
+                       plot = True, memory = True, output = None, label = None, seed = 0,
+                       **sim_params):
+    """
+    End to end benchmark of the processing of n_sweeps sweeps of n_freq 
+    frequencies x sample_size samples, from the raw serial lines to the 
+    exported resonance history. Stages are timed as the sweeps are processed;
+    with memory = True the peak memory of each stage is then measured on a 
+    separate pass over the first sweep, as tracemalloc distorts the times.
+
+    plot = False skips quick_plot and resonance_exporter, which write their 
+    figures and csv files to a temporary directory that is removed afterwards.
+    sim_params are passed on to SimulatedSerial (eg. garble_prob = 0.01).
+
+    Returns a results dict, which is also written to output as json when 
+    given. label is stored in the results to tell versions apart.
+    """
+    sweeps = [synthetic_sweep_data(n_freq, f_interval, sample_size, seed = seed + i, **sim_params)
+              for i in range(n_sweeps)]
+
+    timing = StageRecorder()
+    tracing = StageRecorder(trace_memory = True)
+
+    # The exporters build Windows style paths and resonance_exporter saves one
+    # figure to the working directory, so everything runs inside a scratch
+    # directory which catches all of it
+    scratch = tempfile.mkdtemp(prefix = "jiggler_benchmark_")
+    cwd = os.getcwd()
+    try:
+        os.chdir(scratch)
+        output_directory = os.path.join(scratch, "output")
+        _run_pipeline(timing, sweeps, f_interval, sample_size, output_directory, plot)
+        if memory == True:
+            _run_pipeline(tracing, sweeps[:1], f_interval, sample_size, output_directory, plot)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(scratch, ignore_errors = True)
+
+    stages = {}
+    for name, times in timing.times.items():
+        stages[name] = {"calls" : len(times),
+                        "total_s" : float(np.sum(times)),
+                        "mean_s" : float(np.mean(times)),
+                        "min_s" : float(np.min(times)),
+                        "max_s" : float(np.max(times)),
+                        "peak_memory_bytes" : tracing.peak_memory.get(name)}
+
+    results = {"label" : label,
+               "timestamp" : datetime.now().isoformat(timespec = "seconds"),
+               "git_commit" : _git_commit(),
+               "python" : platform.python_version(),
+               "numpy" : np.__version__,
+               "platform" : platform.platform(),
+               "parameters" : {"n_freq" : n_freq, "sample_size" : sample_size,
+                               "n_sweeps" : n_sweeps, "f_interval" : list(f_interval),
+                               "plot" : plot, "seed" : seed, "sim_params" : sim_params},
+               "stages" : stages}
+
+    print(f"Pipeline of {n_sweeps} sweep(s) of {n_freq} frequencies x {sample_size} samples")
+    print(f"    {'stage':<20}{'calls':>6}{'mean (ms)':>12}{'total (ms)':>12}{'peak (KiB)':>12}")
+    for name, stats in stages.items():
+        peak = stats["peak_memory_bytes"]
+        peak = f"{peak/1024:.0f}" if peak != None else "-"
+        print(f"    {name:<20}{stats['calls']:>6}{stats['mean_s']*1E3:>12.2f}"
+              f"{stats['total_s']*1E3:>12.2f}{peak:>12}")
+
+    if output != None:
+        with open(output, "w") as f:
+            json.dump(results, f, indent = 2)
+        print(f"Results written to {output}")
+
+    return results
+
+
+# Run in a fresh interpreter by benchmark_cold_start, the path a
+# "Jiggler_cli.py acquire" run takes before its first command to the instrument
+_COLD_START_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import Jiggler_cli
+Jig = Jiggler_cli.build_jiggler(Jiggler_cli.build_parser().parse_args(["acquire", "--quiet"]))
+ready = time.perf_counter() - start
+heavy = ["pandas", "matplotlib", "scipy", "serial"]
+print(json.dumps({"ready_s" : ready, "imported" : [name for name in heavy if name in sys.modules]}))
+"""
+
+
+def benchmark_cold_start(repeats = 5):
+    """
+    Measures the cold start of an acquisition run: the wall time of a fresh 
+    python process which imports Jiggler_cli and builds the Jiggler of an 
+    "acquire" subcommand, ie. everything up to the first frequency being sent.
+    Also reports which of the heavy optional imports were loaded on the way,
+    which should be none of them.
+
+    Returns a dict of the best of repeats process and ready (in process) 
+    times, and the heavy modules imported.
+    """
+    directory = os.path.dirname(os.path.abspath(__file__))
+    process_times = []
+    ready_times = []
+    for i in range(repeats):
+        start = time.perf_counter()
+        result = subprocess.run([sys.executable, "-c", _COLD_START_SCRIPT], capture_output = True,
+                                text = True, cwd = directory, check = True)
+        process_times.append(time.perf_counter() - start)
+        report = json.loads(result.stdout.strip().splitlines()[-1])
+        ready_times.append(report["ready_s"])
+
+    results = {"process_s" : min(process_times), "ready_s" : min(ready_times),
+               "imported" : report["imported"]}
+    print(f"Cold start of an acquisition (best of {repeats})")
+    print(f"    process launch to Jiggler ready: {results['process_s']*1E3:.0f} ms")
+    print(f"    of which imports and setup:      {results['ready_s']*1E3:.0f} ms")
+    print(f"    heavy modules imported: {', '.join(results['imported']) or 'none'}")
+    return results
+
+
+def check_tracking(n_sweeps = 8, tolerance = 0.01, f_interval = [110,118], step_size = 0.2,
+                   **sim_params):
+    """
+    Checks that resonance tracking measures the same resonance as full 
+    sweeps. Runs n_sweeps simulated sweeps with and without 
+    options_dict["tracking_sweep"] and compares the mean parabolic and 
+    Lorentz resonant frequencies of the full sweeps with those of the 
+    tracked sweeps (every sweep after the first). sim_params are passed on 
+    to SimulatedSerial.
+
+    Returns a dict of the offset (tracked - full, in Hz) and the scatter of
+    the tracked sweeps per fit, raises an AssertionError when an offset 
+    exceeds tolerance.
+    """
+    sim_params.setdefault("res_freq", 114.0)
+    scratch = tempfile.mkdtemp(prefix = "jiggler_tracking_")
+
+    def resonances(tracking):
+        options = dict(options_defaults)
+        options.update(output_directory = scratch, silent = True, export_data = False, 
+                       export_figure = False, tracking_sweep = tracking)
+        jig = Jiggler(f_interval = f_interval, step_size = step_size, 
+                      serial_dict = dict(serial_defaults), options_dict = options)
+        attach_simulator(jig, realtime = False, **sim_params)
+        for i in range(n_sweeps):
+            jig.Jiggler_sweep()
+        jig.close()
+        return {"parabolic" : np.array(jig.parabolic_res_freq, dtype = float),
+                "lorentz" : np.array(jig.lorentz_res_freq, dtype = float)}
+
+    try:
+        full = resonances(False)
+        tracked = resonances(True)
+    finally:
+        shutil.rmtree(scratch, ignore_errors = True)
+
+    results = {}
+    print(f"Tracked vs full sweep resonances over {n_sweeps} sweeps")
+    for fit in ["parabolic", "lorentz"]:
+        offset = float(np.nanmean(tracked[fit][1:]) - np.nanmean(full[fit]))
+        scatter = float(np.nanstd(tracked[fit][1:]))
+        results[fit] = {"offset" : offset, "scatter" : scatter}
+        print(f"    {fit:<10} offset {offset*1E3:8.2f} mHz, scatter {scatter*1E3:6.2f} mHz")
+
+    for fit, stats in results.items():
+        assert abs(stats["offset"]) <= tolerance, \
+            f"tracked {fit} resonance is {stats['offset']*1E3:.1f} mHz off the full sweeps"
+    return results
+
+
+def compare_results(baseline, current, threshold = 1.1):
+    """
+    Compares two benchmark_pipeline() results, given as dicts or json file 
+    paths. Prints the ratio current/baseline of the mean time and peak memory
+    of every stage, and returns a dict of the stages where either ratio 
+    exceeds threshold.
+    """
+    if isinstance(baseline, str):
+        with open(baseline) as f:
+            baseline = json.load(f)
+    if isinstance(current, str):
+        with open(current) as f:
+            current = json.load(f)
+
+    if baseline["parameters"] != current["parameters"]:
+        print("Warning: the results were measured with different parameters")
+
+    print(f"{baseline['label'] or baseline['git_commit']} -> {current['label'] or current['git_commit']}")
+    print(f"    {'stage':<20}{'time':>10}{'memory':>10}")
+    regressions = {}
+    for name, stats in current["stages"].items():
+        if name not in baseline["stages"]:
+            continue
+        old = baseline["stages"][name]
+        time_ratio = stats["mean_s"]/old["mean_s"]
+        memory_ratio = None
+        if stats["peak_memory_bytes"] and old["peak_memory_bytes"]:
+            memory_ratio = stats["peak_memory_bytes"]/old["peak_memory_bytes"]
+
+        memory_text = f"{memory_ratio:.2f}x" if memory_ratio != None else "-"
+        print(f"    {name:<20}{time_ratio:>9.2f}x{memory_text:>10}")
+        if time_ratio > threshold or (memory_ratio != None and memory_ratio > threshold):
+            regressions[name] = {"time_ratio" : time_ratio, "memory_ratio" : memory_ratio}
+
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Benchmarks the Jiggler data processing")
+    parser.add_argument("--n-freq", type = int, default = 41)
+    parser.add_argument("--sample-size", type = int, default = 1500)
+    parser.add_argument("--n-sweeps", type = int, default = 5)
+    parser.add_argument("--no-plot", action = "store_true",
+                        help = "skip quick_plot and resonance_exporter")
+    parser.add_argument("--no-memory", action = "store_true",
+                        help = "skip the tracemalloc pass")
+    parser.add_argument("--output", default = "jiggler_benchmark.json")
+    parser.add_argument("--label", default = None)
+    parser.add_argument("--sin-fit", action = "store_true",
+                        help = "also compare Nicks_Sin_fit against Batched_Sin_fit")
+    parser.add_argument("--compare", nargs = 2, metavar = ("BASELINE", "CURRENT"),
+                        help = "compare two result files instead of benchmarking")
+    parser.add_argument("--cold-start", action = "store_true",
+                        help = "measure the start up time of an acquisition instead of benchmarking")
+    parser.add_argument("--check-tracking", action = "store_true",
+                        help = "check that tracked and full sweeps find the same resonance")
+    args = parser.parse_args()
+
+    if args.compare != None:
+        compare_results(*args.compare)
+    elif args.cold_start == True:
+        benchmark_cold_start()
+    elif args.check_tracking == True:
+        check_tracking()
+    else:
+        benchmark_pipeline(n_freq = args.n_freq, sample_size = args.sample_size,
+                           n_sweeps = args.n_sweeps, plot = not args.no_plot,
+                           memory = not args.no_memory, output = args.output, label = args.label)
+        if args.sin_fit == True:
+            benchmark_sin_fit(sample_size = args.sample_size)
+            benchmark_sin_fit(sample_size = args.sample_size, n_sweeps = 50, repeats = 2)
@@ -0,0 +1,277 @@
+import argparse
+import json
+import os
+import signal
+import sys
+
+"""
+Command line entry point of the Jiggler, so acquisitions can run as a service
+without a notebook kernel.
+
+Run from the command line with:
+    python Jiggler_cli.py acquire --port COM4 --range 110 118 --step 0.2
+    python Jiggler_cli.py loop --port COM4 --duration 86400 --interval 240
+    python Jiggler_cli.py import "C:\\Jiggler Data\\run_1"
+    python Jiggler_cli.py refit "C:\\Jiggler Data\\run_1" --workers 4
+    python Jiggler_cli.py export "C:\\Jiggler Data\\jiggler_output\\run_store" --output history.csv
+
+Only argparse and the standard library are imported up front. The Jiggler
+module is imported once the arguments have been parsed, and it in turn only
+imports pandas, matplotlib, scipy and pyserial when a sweep is exported,
+plotted, Lorentz fit or sent to a real port. An acquisition therefore starts
+talking to the instrument a fraction of a second after launch, see
+Jiggler_benchmarks.py --cold-start.
+
+Every subcommand accepts --option KEY=VALUE (repeatable) to set any entry of
+options_defaults. VALUE is read as json where possible (true, 0.5, [0, 1.2],
+null) and as a plain string otherwise.
+"""
+
+"""Argument helpers"""
+#-------------------------------------------------------------------------------
+def parse_option(text):
+    """argparse type of --option, returns (KEY, VALUE)"""
+    key, separator, value = text.partition("=")
+    if separator == "" or key.strip() == "":
+        raise argparse.ArgumentTypeError(f"expected KEY=VALUE, got {text!r}")
+    try:
+        value = json.loads(value)
+    except ValueError:
+        pass
+    return key.strip(), value
+
+
+def _stop_on_sigterm():
+    """Turns SIGTERM (eg. a service manager stopping the process) into a
+    KeyboardInterrupt, so it stops the instrument the same way Ctrl+C does"""
+    def handler(signum, frame):
+        raise KeyboardInterrupt
+    signal.signal(signal.SIGTERM, handler)
+
+
+def build_jiggler(args):
+    """
+    Creates the Jiggler described by the common arguments, with its own copies
+    of serial_defaults and options_defaults. With args.simulate the Jiggler is
+    attached to a SimulatedSerial instead of args.port.
+    """
+    from Jiggler_funcs_V1_02_with_temp import Jiggler, options_defaults, serial_defaults
+
+    options = dict(options_defaults)
+    if args.output_dir != None:
+        options["output_directory"] = args.output_dir
+    options["silent"] = args.quiet
+    options["verbose"] = args.verbose
+    for key, value in args.option:
+        if key not in options_defaults:
+            raise SystemExit(f"jiggler: unknown option {key!r}")
+        options[key] = value
+
+    serial_dict = dict(serial_defaults)
+    kwargs = {}
+    if getattr(args, "baudrate", None) != None:
+        serial_dict["baudrate"] = args.baudrate
+    if getattr(args, "timeout", None) != None:
+        serial_dict["timeout"] = args.timeout
+    if getattr(args, "range", None) != None:
+        kwargs["f_interval"] = args.range
+    if getattr(args, "step", None) != None:
+        kwargs["step_size"] = args.step
+    if getattr(args, "sample_size", None) != None:
+        kwargs["sample_size"] = args.sample_size
+
+    Jig = Jiggler(com_port = getattr(args, "port", None), serial_dict = serial_dict,
+                  options_dict = options, **kwargs)
+
+    if getattr(args, "simulate", False) == True:
+        from Jiggler_simulator import attach_simulator
+        attach_simulator(Jig, realtime = False)
+    return Jig
+
+
+def load_sweeps(Jig, args):
+    """Imports the sweeps of args.source, a folder of sweep csv files or a
+    RunStore directory (read between args.start and args.end)"""
+    if os.path.exists(os.path.join(args.source, "sweeps.bin")):
+        return Jig.store_importer(args.start, args.end, path = args.source)
+    if args.start != None or args.end != None:
+        raise SystemExit("jiggler: --start and --end only apply to a run store")
+    return Jig.data_importer(args.source, workers = args.workers)
+
+
+"""Subcommands"""
+#-------------------------------------------------------------------------------
+def run_acquire(args):
+    """One sweep, exported and plotted like Jiggler_sweep() + quick_plot()"""
+    Jig = build_jiggler(args)
+    try:
+        Jig.Jiggler_sweep()
+        Jig.quick_plot()
+        Jig.stop_render_service()
+        Jig.dump_metrics()
+    finally:
+        Jig.close()
+
+    fits = {"parabolic_res_freq" : Jig.parabolic_res_freq, "lorentz_res_freq" : Jig.lorentz_res_freq}
+    for name, values in fits.items():
+        if len(values) > 0:
+            print(f"{name}: {values[-1]}")
+    return 0
+
+
+def run_loop(args):
+    """Jiggler_loop() for args.duration seconds, stopping the instrument on
+    Ctrl+C or SIGTERM"""
+    from Jiggler_funcs_V1_02_with_temp import serial
+
+    _stop_on_sigterm()
+    Jig = build_jiggler(args)
+    try:
+        Jig.Jiggler_loop(args.duration, args.interval)
+    except KeyboardInterrupt:
+        # Jiggler_loop has already stopped the render service. The port is
+        # not open yet if the loop was stopped while connecting, and may 
+        # have died, neither should hide the interrupt.
+        print(f"Loop stopped after {Jig.loop_count} sweeps")
+        if Jig.serial != None:
+            try:
+                Jig.reset_instrument()
+            except (serial.SerialException, OSError) as e:
+                print(f"Could not send the stop byte ({e})")
+    finally:
+        Jig.close()
+    return 0
+
+
+def run_import(args):
+    """Imports sweeps and plots them with import_plotter(), which also exports
+    the resonance history"""
+    Jig = build_jiggler(args)
+    A_sol_lists, names = load_sweeps(Jig, args)
+    if len(A_sol_lists) == 0:
+        print(f"No sweeps found in {args.source}")
+        return 1
+    Jig.import_plotter()
+    Jig.stop_render_service()
+    return 0
+
+
+def run_refit(args):
+    """
+    Refits every sweep of args.source from scratch with the batch fits,
+    replacing the fit cache in the output directory, and exports the new
+    resonance history. Sweep figures are only redrawn with --figures.
+    """
+    Jig = build_jiggler(args)
+    Jig.options_dict["fit_cache"] = True
+    Jig.options_dict["export_figure"] = args.figures
+    if args.workers != None:
+        Jig.options_dict["fit_workers"] = args.workers
+
+    A_sol_lists, names = load_sweeps(Jig, args)
+    if len(A_sol_lists) == 0:
+        print(f"No sweeps found in {args.source}")
+        return 1
+    Jig.fit_cache = {}
+    Jig.import_plotter()
+    Jig.stop_render_service()
+    return 0
+
+
+def run_export(args):
+    """
+    Writes the resonance history of a RunStore to args.output as csv, and with
+    --sweeps every sweep as a csv file in the format quick_plot() exports, so
+    it can be read back by data_importer()
+    """
+    from Jiggler_funcs_V1_02_with_temp import RunStore, midsample_names, pd
+
+    if os.path.exists(os.path.join(args.store, "sweeps.bin")) == False:
+        raise SystemExit(f"jiggler: {args.store} is not a run store")
+    store = RunStore(args.store)
+
+    history = store.to_frame(args.start, args.end)
+    history.to_csv(args.output)
+    print(f"Exported {len(history)} sweeps to {args.output}")
+
+    if args.sweeps != None:
+        os.makedirs(args.sweeps, exist_ok = True)
+        times, A_sol_lists = store.read(args.start, args.end)
+        for name, A_sol_list in zip(midsample_names(times), A_sol_lists):
+            pd.DataFrame(A_sol_list).to_csv(os.path.join(args.sweeps, f"{name}.csv"))
+        print(f"Exported {len(A_sol_lists)} sweep files to {args.sweeps}")
+    return 0
+
+
+"""Parser"""
+#-------------------------------------------------------------------------------
+def build_parser():
+    common = argparse.ArgumentParser(add_help = False)
+    common.add_argument("--output-dir", default = None,
+                        help = "output_directory, defaults to cwd\\jiggler_output")
+    common.add_argument("--option", type = parse_option, action = "append", default = [],
+                        metavar = "KEY=VALUE", help = "sets options_dict[KEY], repeatable")
+    common.add_argument("--quiet", action = "store_true", help = "sets the silent option")
+    common.add_argument("--verbose", action = "store_true")
+
+    # Defaults of Jiggler() when not given
+    instrument = argparse.ArgumentParser(add_help = False)
+    instrument.add_argument("--port", default = None, help = "serial port, eg. COM4")
+    instrument.add_argument("--range", type = float, nargs = 2, metavar = ("LOW", "HIGH"),
+                            default = None, help = "frequency interval in Hz")
+    instrument.add_argument("--step", type = float, default = None, help = "frequency step in Hz")
+    instrument.add_argument("--sample-size", type = int, default = None,
+                            help = "samples per frequency, must match the Arduino")
+    instrument.add_argument("--baudrate", type = int, default = None)
+    instrument.add_argument("--timeout", type = float, default = None, help = "serial read timeout")
+    instrument.add_argument("--simulate", action = "store_true",
+                            help = "sweep a SimulatedSerial instead of the instrument")
+
+    source = argparse.ArgumentParser(add_help = False)
+    source.add_argument("source", help = "folder of sweep csv files or a run store")
+    source.add_argument("--start", default = None, help = "'%%Y_%%m_%%d %%H_%%M_%%S', run stores only")
+    source.add_argument("--end", default = None, help = "'%%Y_%%m_%%d %%H_%%M_%%S', run stores only")
+    source.add_argument("--workers", type = int, default = None, help = "worker processes")
+
+    parser = argparse.ArgumentParser(prog = "jiggler", description = "Runs the Jiggler without a notebook")
+    subparsers = parser.add_subparsers(dest = "command", required = True)
+
+    acquire = subparsers.add_parser("acquire", parents = [common, instrument],
+                                    help = "run one sweep and export it")
+    acquire.set_defaults(func = run_acquire)
+
+    loop = subparsers.add_parser("loop", parents = [common, instrument],
+                                 help = "sweep periodically, see Jiggler_loop")
+    loop.add_argument("--duration", type = float, required = True, help = "run time in seconds")
+    loop.add_argument("--interval", type = float, default = 240, help = "time between sweeps in seconds")
+    loop.set_defaults(func = run_loop)
+
+    import_ = subparsers.add_parser("import", parents = [common, source],
+                                    help = "import sweeps and plot them")
+    import_.set_defaults(func = run_import)
+
+    refit = subparsers.add_parser("refit", parents = [common, source],
+                                  help = "refit imported sweeps, ignoring cached fits")
+    refit.add_argument("--figures", action = "store_true", help = "also redraw the sweep figures")
+    refit.set_defaults(func = run_refit)
+
+    export = subparsers.add_parser("export",
+                                   help = "export a run store to csv")
+    export.add_argument("store", help = "run store directory")
+    export.add_argument("--output", default = "resonance_history.csv")
+    export.add_argument("--sweeps", default = None, metavar = "DIR",
+                        help = "also write every sweep as a csv file to DIR")
+    export.add_argument("--start", default = None)
+    export.add_argument("--end", default = None)
+    export.set_defaults(func = run_export)
+
+    return parser
+
+
+def main(argv = None):
+    args = build_parser().parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,14 +1,49 @@
 import numpy as np # Mathmatical library
-import pandas as pd # data management library
-import matplotlib.pyplot as plt
-import matplotlib.dates as mdates
-from matplotlib.dates import DateFormatter, AutoDateLocator
+import functools
+from collections import deque, namedtuple
 import glob
-import serial
+import hashlib
+import importlib
+import json
+import math
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 import time
 import os
+import queue
+import re
+import threading
 from datetime import datetime
-from scipy.optimize import curve_fit
+
+
+class _LazyModule():
+    """
+    Stands in for a module which is only imported the first time one of its 
+    attributes is used. pandas, matplotlib and pyserial take most of a second
+    to import, while an acquisition run needs none of them until it exports,
+    plots or opens the port, so they are bound to these instead.
+    """
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if attr in ("_name", "_module"):
+            raise AttributeError(attr)
+        if self._module == None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+    def __repr__(self):
+        state = "imported" if self._module != None else "not imported"
+        return f"<lazy module {self._name!r} ({state})>"
+
+
+pd = _LazyModule("pandas") # data management library
+matplotlib = _LazyModule("matplotlib")
+plt = _LazyModule("matplotlib.pyplot")
+mdates = _LazyModule("matplotlib.dates")
+serial = _LazyModule("serial")
 
 """
 TO UPDATE
@@ -44,8 +79,35 @@ WARNINGS
 # GLOBAL DEFAULTS
 ARDUINO_MICROS_OVERFLOW_VAL = 4294967295
 
-serial_defaults = {"port" : None, "baudrate" : 9600, "bytesize" : serial.EIGHTBITS, 
-                    "parity" : serial.PARITY_NONE, "stopbits" : serial.STOPBITS_ONE, 
+# Number of samples between convergence checks of the adaptive dwell
+DWELL_CHECK_INTERVAL = 50
+
+# Part of every fit_cache key. Bump it whenever parabolic_fit, lorentz_fit or
+# their batch versions change, so fits cached by the old code are not reused
+FIT_CACHE_VERSION = 2
+
+# Row format sent by the Arduino: "freq,micros,angle,temp1,temp2"
+ROW_DTYPE = np.dtype([("freq", np.float64), ("micros", np.int64), 
+                      ("angle", np.int64), ("temp1", np.float64), 
+                      ("temp2", np.float64)])
+
+# Matches one line of a data block. A row is accepted when the frequency is a 
+# float that is not also an int, micros and angle are ints and both 
+# temperatures are floats (the rules of the old data_filter). Accepted rows are
+# captured whole, rows that fail fall through to the ".*" branch and give an 
+# empty match. Possessive quantifiers keep the regex from backtracking.
+_INT = r"[ \t]*+[+-]?\d++[ \t\r]*+"
+_FLOAT = (r"[ \t]*+[+-]?(?:\d++\.\d*+(?:[eE][+-]?\d++)?|\.\d++(?:[eE][+-]?\d++)?"
+          r"|\d++[eE][+-]?\d++|(?i:nan|inf(?:inity)?))[ \t\r]*+")
+_ANY_FLOAT = (r"[ \t]*+[+-]?(?:\d++(?:\.\d*+)?(?:[eE][+-]?\d++)?|\.\d++(?:[eE][+-]?\d++)?"
+              r"|(?i:nan|inf(?:inity)?))[ \t\r]*+")
+ROW_PATTERN = re.compile(rf"^(?:({_FLOAT},{_INT},{_INT},{_ANY_FLOAT},{_ANY_FLOAT})$|.*)$", re.M)
+
+# bytesize, parity and stopbits are the values of serial.EIGHTBITS, 
+# serial.PARITY_NONE and serial.STOPBITS_ONE, spelled out so pyserial is not
+# imported before a port is opened
+serial_defaults = {"port" : None, "baudrate" : 9600, "bytesize" : 8, 
+                    "parity" : "N", "stopbits" : 1, 
                     "timeout" : 2 , "xonxoff" : False, "rtscts" : False,
                     "write_timeout" : 4, "dsrdtr" : False, "inter_byte_timeout" : None,
                     "exclusive" : None}
@@ -56,7 +118,1785 @@ options_defaults = {"lorentz_fit" : True, "parabolic_fit" : True,
                         "export_data" : True, "export_figure" : True,
                         "verbose" : False, "silent" : False,
                         "x_lims" : None, "y_lims" : None, "warnings" : True,
-                        "Sweep_Column_DF_export" : False}
+                        "Sweep_Column_DF_export" : False,
+                        "buffered_read" : False, "read_chunk_size" : 4096,
+                        "streaming_sin_fit" : False,
+                        "adaptive_dwell" : False, "dwell_min_samples" : 300,
+                        "dwell_target_error" : 0.02,
+                        "trim_settling" : False, "settling_window" : 100,
+                        "settling_tolerance" : 0.02,
+                        "history_window" : None, "compact_raw_blocks" : False,
+                        "adaptive_sweep" : False, "coarse_step" : 1.0, "refine_width" : 2.0,
+                        "tracking_sweep" : False, "tracking_width" : 2.0,
+                        "pipelined_sweep" : False, "pipeline_queue_size" : 4,
+                        "background_render" : False, "render_queue_size" : 2,
+                        "export_format" : "csv",
+                        "import_cache" : True, "import_workers" : None,
+                        "fit_cache" : True, "lorentz_warm_start" : True,
+                        "fit_workers" : None, "parabolic_peak_width" : 10,
+                        "lorentz_start_tail" : 5, "lorentz_end_tail" : 5,
+                        "fixed_rate_loop" : False, "skip_missed_slots" : True,
+                        "align_loop_to_clock" : False,
+                        "metrics_file" : None, "metrics_file_max_bytes" : 10_000_000,
+                        "metrics_file_backups" : 3}
+
+
+class Histogram():
+    """
+    Distribution of a latency (or any positive value) in fixed logarithmic 
+    buckets, 4 per decade from 10 us to 1000 s, so it takes the same memory
+    however long a run is. Quantiles are estimated as the upper edge of the
+    bucket they fall in.
+    """
+    edges = np.logspace(-5, 3, 33)
+
+    def __init__(self):
+        self.buckets = np.zeros(len(self.edges) + 1, dtype = np.int64)
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+
+    def add(self, value):
+        self.buckets[np.searchsorted(self.edges, value)] += 1
+        self.count += 1
+        self.total += value
+        self.min = value if self.min == None else min(self.min, value)
+        self.max = value if self.max == None else max(self.max, value)
+
+
+    def quantile(self, q):
+        if self.count == 0:
+            return None
+        bucket = int(np.searchsorted(np.cumsum(self.buckets), q*self.count))
+        if bucket >= len(self.edges):
+            return self.max
+        return min(float(self.edges[bucket]), self.max)
+
+
+    def summary(self):
+        return {"count" : self.count, "total" : self.total,
+                "mean" : self.total/self.count if self.count > 0 else None,
+                "min" : self.min, "p50" : self.quantile(0.5), "p90" : self.quantile(0.9),
+                "p99" : self.quantile(0.99), "max" : self.max}
+
+
+class MetricsRegistry():
+    """
+    Run time metrics of a Jiggler, self.metrics:
+        histograms = per-stage latency in seconds (see the @timed methods)
+        counters = running totals (eg. bad_rows, write_failures, 
+                   lorentz_fit_failures, bytes_read)
+        gauges = latest values (eg. serial_bytes_per_s)
+
+    Updates are locked, as the pipelined sweep records from two threads.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+
+    def reset(self):
+        with self.lock:
+            self.histograms = {}
+            self.counters = {}
+            self.gauges = {}
+
+
+    def observe(self, name, value):
+        with self.lock:
+            if name not in self.histograms:
+                self.histograms[name] = Histogram()
+            self.histograms[name].add(value)
+
+
+    def count(self, name, n = 1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+
+    def gauge(self, name, value):
+        with self.lock:
+            self.gauges[name] = value
+
+
+    def summary(self):
+        """Snapshot of all metrics as a dictionary"""
+        with self.lock:
+            return {"histograms" : {name : histogram.summary() for name, histogram in self.histograms.items()},
+                    "counters" : dict(self.counters), "gauges" : dict(self.gauges)}
+
+
+    def dump(self, path, max_bytes = 10_000_000, backups = 3, **extra):
+        """
+        Appends summary() (plus the extra keyword entries and a timestamp) as
+        one json line to path. Once path reaches max_bytes it is rotated to 
+        path.1, path.1 to path.2 and so on, keeping backups old files.
+        """
+        if os.path.exists(path) and os.path.getsize(path) >= max_bytes:
+            for i in range(backups - 1, 0, -1):
+                if os.path.exists(f"{path}.{i}"):
+                    os.replace(f"{path}.{i}", f"{path}.{i + 1}")
+            if backups > 0:
+                os.replace(path, f"{path}.1")
+            else:
+                os.remove(path)
+
+        record = {"time" : datetime.today().isoformat(timespec = "seconds"), **extra, **self.summary()}
+        with open(path, "a") as f:
+            f.write(json.dumps(record) + "\n")
+
+
+    def __repr__(self):
+        return (f"MetricsRegistry(histograms={list(self.histograms)}, "
+                f"counters={self.counters}, gauges={self.gauges})")
+
+
+def timed(name):
+    """Decorator recording the run time of a Jiggler method in the histogram
+    name of self.metrics"""
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return method(self, *args, **kwargs)
+            finally:
+                self.metrics.observe(name, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+class ThroughputCounter():
+    """
+    Running record and byte counter for the serial link. Used by read_data to
+    check whether the host keeps up with the Arduino at a given baud rate.
+
+    records_per_s and bytes_per_s are averaged over every block added since 
+    the last reset(), last_records_per_s and last_bytes_per_s only cover the
+    most recent block.
+    """
+    def __init__(self):
+        self.reset()
+
+
+    def reset(self):
+        self.records = 0
+        self.bytes = 0
+        self.elapsed = 0.0
+        self.last_records_per_s = 0.0
+        self.last_bytes_per_s = 0.0
+
+
+    def add(self, records, n_bytes, elapsed):
+        """Adds one read block of records/n_bytes which took elapsed seconds"""
+        self.records += records
+        self.bytes += n_bytes
+        self.elapsed += elapsed
+        if elapsed > 0:
+            self.last_records_per_s = records/elapsed
+            self.last_bytes_per_s = n_bytes/elapsed
+
+
+    @property
+    def records_per_s(self):
+        if self.elapsed == 0:
+            return 0.0
+        return self.records/self.elapsed
+
+
+    @property
+    def bytes_per_s(self):
+        if self.elapsed == 0:
+            return 0.0
+        return self.bytes/self.elapsed
+
+
+    def __repr__(self):
+        return (f"ThroughputCounter({self.records} records, {self.bytes} bytes, "
+                f"{self.records_per_s:.1f} records/s, {self.bytes_per_s:.1f} bytes/s)")
+
+class SerialSession():
+    """
+    Managed serial connection to the Jiggler. The port is opened once and 
+    reused for every sweep instead of being re-created by each Jiggler_sweep.
+
+    Opening the port resets the Arduino. Rather than sleeping a fixed time, 
+    handshake() sends a probe frequency every probe_interval seconds until the
+    board starts answering with data (or ready_timeout runs out), then stops 
+    it again. connect() health-checks the port and reopens it after a failure.
+
+    Can be used as a context manager:
+        with SerialSession(serial_defaults) as session:
+            Jig.session = session
+            Jig.Jiggler_sweep()
+
+    Parameters:
+        serial_dict = dictionary of serial.Serial keyword arguments
+        port_factory = callable taking the serial_dict entries as keyword 
+            arguments and returning an open port, defaults to serial.Serial
+        ready_timeout = longest time in seconds to wait for the Arduino to boot
+        probe_interval = time in seconds to wait for an answer to each probe
+    """
+    def __init__(self, serial_dict, port_factory = None, ready_timeout = 5, 
+                 probe_interval = 0.25):
+        self.serial_dict = serial_dict
+        self.port_factory = port_factory
+        self.ready_timeout = ready_timeout
+        self.probe_interval = probe_interval
+
+        self.port = None
+        self.ready = False
+        self.open_count = 0
+        self.reconnect_count = 0
+        self.last_handshake_time = None
+
+
+    def open(self):
+        """Opens the port, closing any previous handle first"""
+        self.close()
+        factory = self.port_factory if self.port_factory != None else serial.Serial
+        self.port = factory(**self.serial_dict)
+        self.ready = False
+        self.open_count += 1
+        return self.port
+
+
+    def close(self):
+        if self.port != None:
+            try:
+                self.port.close()
+            except (serial.SerialException, OSError):
+                pass
+        self.port = None
+        self.ready = False
+
+
+    def is_healthy(self):
+        """True if the port is open and still responds to an in_waiting query
+        (this raises once a USB adapter has been unplugged)"""
+        if self.port == None or self.port.is_open == False:
+            return False
+        try:
+            self.port.in_waiting
+        except (serial.SerialException, OSError):
+            return False
+        return True
+
+
+    def handshake(self, probe_byte = b"110.0"):
+        """
+        Waits for the Arduino to finish booting. The probe frequency is resent
+        every probe_interval seconds until the first bytes come back, then the 
+        stop command is sent and the input buffer cleared.
+
+        Returns True if the Arduino answered within ready_timeout.
+        """
+        start = time.perf_counter()
+        deadline = start + self.ready_timeout
+        while time.perf_counter() < deadline:
+            self.port.reset_input_buffer()
+            self.port.write(probe_byte)
+            probe_deadline = min(time.perf_counter() + self.probe_interval, deadline)
+            while time.perf_counter() < probe_deadline:
+                if self.port.in_waiting > 0:
+                    self.ready = True
+                    break
+                time.sleep(0.005)
+            if self.ready == True:
+                break
+
+        # Stopping the probe and discarding its data
+        self.port.write(str(1).encode())
+        self.port.reset_input_buffer()
+        self.last_handshake_time = time.perf_counter() - start
+        return self.ready
+
+
+    def connect(self, probe_byte = b"110.0"):
+        """
+        Returns an open, ready port. The port is only (re)opened when it is not
+        open yet or has failed the health check.
+        """
+        if self.is_healthy() == False:
+            if self.open_count > 0:
+                self.reconnect_count += 1
+            self.open()
+            if self.handshake(probe_byte) == False:
+                print(f"No answer from {self.serial_dict['port']} after {self.ready_timeout} s, continuing anyway")
+        return self.port
+
+
+    def reconnect(self, probe_byte = b"110.0"):
+        """Forces the port closed and reopens it"""
+        self.close()
+        return self.connect(probe_byte)
+
+
+    def __enter__(self):
+        self.connect()
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+
+class PipelineStats():
+    """
+    Queue depth and per-stage latency of the last pipelined_sweep, all times
+    in seconds and one list entry per frequency block.
+
+        read_latency = write_data + read_data time in the reader thread
+        queue_wait = time a block waited in the queue before the worker took it
+        process_latency = parse + amplitude fit time in the worker
+        queue_depth = number of blocks queued right after each put
+        tail_latency = time from the last block being read to the sweep result
+                       being ready
+    """
+    def __init__(self, queue_size):
+        self.queue_size = queue_size
+        self.read_latency = []
+        self.queue_wait = []
+        self.process_latency = []
+        self.queue_depth = []
+        self.tail_latency = None
+
+
+    def summary(self):
+        """Returns the mean and max of each stage as a dictionary"""
+        summary = {"blocks" : len(self.read_latency), "queue_size" : self.queue_size,
+                   "max_queue_depth" : max(self.queue_depth, default = 0),
+                   "tail_latency" : self.tail_latency}
+        for name in ["read_latency", "queue_wait", "process_latency"]:
+            values = getattr(self, name)
+            summary[name + "_mean"] = float(np.mean(values)) if values else None
+            summary[name + "_max"] = max(values, default = None)
+        return summary
+
+
+class FrequencyBlock():
+    """
+    Formatted data of one frequency, as returned by block_formatter
+        freq = drive frequency in Hz
+        time = sample times in seconds
+        angle = angles in tenths of a degree
+        temp1, temp2 = temperatures (views of the parsed rows, not copies)
+
+    Also behaves as the old [freq, time_vals, angle_vals, temp1, temp2] list,
+    so block[1] and unpacking still work.
+    """
+    __slots__ = ("freq", "time", "angle", "temp1", "temp2")
+
+    def __init__(self, freq, time, angle, temp1, temp2):
+        self.freq = freq
+        self.time = time
+        self.angle = angle
+        self.temp1 = temp1
+        self.temp2 = temp2
+
+
+    def __getitem__(self, index):
+        return (self.freq, self.time, self.angle, self.temp1, self.temp2)[index]
+
+
+    def __len__(self):
+        return 5
+
+
+    def __iter__(self):
+        return iter((self.freq, self.time, self.angle, self.temp1, self.temp2))
+
+
+    def trimmed(self, start):
+        """The block without its first start samples (views, no copies)"""
+        return FrequencyBlock(self.freq, self.time[start:], self.angle[start:],
+                              self.temp1[start:], self.temp2[start:])
+
+
+    def __repr__(self):
+        return f"FrequencyBlock(freq={self.freq}, n={len(self.time)})"
+
+
+class SweepResult():
+    """
+    Amplitudes of a sweep, as returned by Amplitude_solver, held as one 
+    (6, n_freq) array whose rows are POINT_DTYPE's columns
+        freq, A_fit, A_avg, A_max (degrees), temp1, temp2
+    The attributes are views of the rows, and values may itself be a view 
+    into a larger buffer (see from_points and set_imported_data), so no data
+    is copied. phase and rms of the sin fits are kept when known.
+
+    Also behaves as the old [freq, A_fit, A_avg, A_max, temp1, temp2] list 
+    (A_sol_list), so A_sol_list[1] and unpacking still work.
+    """
+    __slots__ = ("values", "phase", "rms")
+
+    def __init__(self, values, phase = None, rms = None):
+        self.values = values
+        self.phase = phase
+        self.rms = rms
+
+
+    @classmethod
+    def from_block_solutions(cls, solutions):
+        """From an (n_freq, 8) array of block_amplitudes results"""
+        solutions = np.asarray(solutions, dtype = float).reshape(-1, 8)
+        values = solutions[:, :6].T.copy()
+        values[1:4] /= 10
+        return cls(values, solutions[:, 6], solutions[:, 7])
+
+
+    @classmethod
+    def from_points(cls, points):
+        """Zero-copy view of POINT_DTYPE records (eg. a RunStore memory map)"""
+        return cls(points.view(np.float64).reshape(-1, len(POINT_DTYPE.names)).T)
+
+
+    freq = property(lambda self: self.values[0])
+    A_fit = property(lambda self: self.values[1])
+    A_avg = property(lambda self: self.values[2])
+    A_max = property(lambda self: self.values[3])
+    temp1 = property(lambda self: self.values[4])
+    temp2 = property(lambda self: self.values[5])
+
+    @property
+    def n_freq(self):
+        return self.values.shape[1]
+
+
+    def __getitem__(self, index):
+        return self.values[index]
+
+
+    def __len__(self):
+        return self.values.shape[0]
+
+
+    def __iter__(self):
+        return iter(self.values)
+
+
+    def __array__(self, dtype = None, copy = None):
+        return np.asarray(self.values, dtype = dtype)
+
+
+    def to_frame(self):
+        return pd.DataFrame(self.values.T, columns = POINT_DTYPE.names)
+
+
+    def __repr__(self):
+        return f"SweepResult(n_freq={self.n_freq})"
+
+
+class FitResult():
+    """
+    Result of parabolic_fit or lorentz_fit
+        method = "parabolic" or "lorentz"
+        res_freq = resonant frequency in Hz (0 for a failed lorentz fit)
+        x, y = the fitted curve
+        res_amp = amplitude at res_freq (parabolic)
+        FWHM, height_FWHM = peak width and the height it is taken at (lorentz)
+
+    Also behaves as the old lists, [res_freq, x, y] for parabolic fits and 
+    [res_freq, x, y, FWHM, height_FWHM] for lorentz fits.
+    """
+    __slots__ = ("method", "res_freq", "x", "y", "res_amp", "FWHM", "height_FWHM")
+
+    def __init__(self, method, res_freq, x, y, res_amp = None, FWHM = None, height_FWHM = None):
+        self.method = method
+        self.res_freq = res_freq
+        self.x = x
+        self.y = y
+        self.res_amp = res_amp
+        self.FWHM = FWHM
+        self.height_FWHM = height_FWHM
+
+
+    def _sequence(self):
+        if self.method == "lorentz":
+            return (self.res_freq, self.x, self.y, self.FWHM, self.height_FWHM)
+        return (self.res_freq, self.x, self.y)
+
+
+    def __getitem__(self, index):
+        return self._sequence()[index]
+
+
+    def __len__(self):
+        return len(self._sequence())
+
+
+    def __iter__(self):
+        return iter(self._sequence())
+
+
+    def __repr__(self):
+        return f"FitResult(method={self.method!r}, res_freq={self.res_freq})"
+
+
+class SinFitAccumulator():
+    """
+    Streaming form of the least squares fit of Nicks_Sin_fit/Batched_Sin_fit
+    for one frequency block. The fit of offset + a*cos(wt) + b*sin(wt) only 
+    depends on the sums of 1, cos, sin, their products and their products 
+    with the angle, so those are accumulated as samples arrive (O(1) per 
+    sample) and solve() gives the same A, phase and rms as Batched_Sin_fit 
+    (to rounding) without keeping the sample arrays.
+
+    The angle is accumulated relative to the first sample, which keeps the
+    sums of squares accurate like the mean centering of Batched_Sin_fit.
+
+    Parameters:
+        frequency = drive frequency in Hz, if None it is taken from the first
+                    row passed to add_line/extend_lines
+    """
+    def __init__(self, frequency = None):
+        self.frequency = frequency
+        self.n = 0
+        self.shift = None
+        # Sums of c, s, cc, cs, ss, y, yc, ys, yy
+        self.sums = [0.0]*9
+
+
+    def add(self, t, y):
+        """Adds one sample, t in seconds and y the angle"""
+        if self.shift == None:
+            self.shift = y
+        y -= self.shift
+        wt = 2*math.pi*self.frequency*t
+        c = math.cos(wt)
+        s = math.sin(wt)
+        sums = self.sums
+        sums[0] += c
+        sums[1] += s
+        sums[2] += c*c
+        sums[3] += c*s
+        sums[4] += s*s
+        sums[5] += y
+        sums[6] += y*c
+        sums[7] += y*s
+        sums[8] += y*y
+        self.n += 1
+
+
+    def extend(self, t, y):
+        """Adds arrays of samples in one vectorized update"""
+        t = np.asarray(t, dtype = float)
+        y = np.asarray(y, dtype = float)
+        if len(y) == 0:
+            return
+        if self.shift == None:
+            self.shift = float(y[0])
+        y = y - self.shift
+        wt = 2*np.pi*self.frequency*t
+        c = np.cos(wt)
+        s = np.sin(wt)
+        for i, value in enumerate([c.sum(), s.sum(), c @ c, c @ s, s @ s, 
+                                   y.sum(), y @ c, y @ s, y @ y]):
+            self.sums[i] += float(value)
+        self.n += len(y)
+
+
+    def add_line(self, line):
+        """Adds one "freq,micros,angle,temp1,temp2" row as read from the 
+        Arduino, rows failing the data_parser checks are ignored"""
+        row = ROW_PATTERN.match(line.rstrip()).group(1)
+        if row == None:
+            return
+        freq, micros, angle = row.split(",", 3)[:3]
+        if self.frequency == None:
+            self.frequency = float(freq)
+        self.add(int(micros)/1E6, float(angle))
+
+
+    def extend_lines(self, lines):
+        """Vectorized add_line for a list of rows"""
+        rows = ROW_PATTERN.findall("\n".join(map(str.rstrip, lines)))
+        values = np.fromstring(",".join(filter(None, rows)), sep = ",").reshape(-1, 5)
+        if len(values) == 0:
+            return
+        if self.frequency == None:
+            self.frequency = float(values[0, 0])
+        self.extend(values[:, 1]/1E6, values[:, 2])
+
+
+    def _normal_equations(self):
+        """Returns XT_X, the coefficients a, and the residual sum of squares"""
+        n = self.n
+        S_c, S_s, S_cc, S_cs, S_ss, S_y, S_yc, S_ys, S_yy = self.sums
+
+        XT_X = np.array([[n, S_c, S_s], [S_c, S_cc, S_cs], [S_s, S_cs, S_ss]])
+        mean = S_y/n
+        XT_b = np.array([0, S_yc - mean*S_c, S_ys - mean*S_s])
+        b_b = S_yy - n*mean**2
+        try:
+            a = np.linalg.solve(XT_X, XT_b)
+        except np.linalg.LinAlgError:
+            a = np.linalg.pinv(XT_X) @ XT_b
+
+        return XT_X, a, max(b_b - a @ XT_b, 0)
+
+
+    def solve(self):
+        """Returns A, phase and rms as Batched_Sin_fit does for the samples 
+        added so far, NaN for less than 3 samples"""
+        if self.n < 3:
+            return np.nan, np.nan, np.nan
+        XT_X, a, SSR = self._normal_equations()
+
+        A = float(np.sqrt(a[1]**2 + a[2]**2))
+        phase = float(np.arctan2(-a[2], a[1]))
+        rms = float(np.sqrt(SSR/self.n))
+        return A, phase, rms
+
+
+    def amplitude_error(self):
+        """Standard error of A (same units as the angle), propagated from the
+        least squares covariance sigma^2*inv(XT_X) of the cos and sin 
+        coefficients. Inf for less than 4 samples."""
+        if self.n < 4:
+            return np.inf
+        XT_X, a, SSR = self._normal_equations()
+        try:
+            covariance = SSR/(self.n - 3)*np.linalg.inv(XT_X)
+        except np.linalg.LinAlgError:
+            return np.inf
+
+        A_squared = a[1]**2 + a[2]**2
+        if A_squared == 0:
+            return float(np.sqrt(covariance[1, 1] + covariance[2, 2]))
+        variance = (a[1]**2*covariance[1, 1] + a[2]**2*covariance[2, 2] 
+                    + 2*a[1]*a[2]*covariance[1, 2])/A_squared
+        return float(np.sqrt(max(variance, 0)))
+
+
+    def converged(self, min_samples, target_error):
+        """True once at least min_samples are in and amplitude_error() is at
+        most target_error"""
+        return self.n >= min_samples and self.amplitude_error() <= target_error
+
+
+    def __repr__(self):
+        return f"SinFitAccumulator(frequency={self.frequency}, n={self.n})"
+
+
+class FrequencyRecord(namedtuple("FrequencyRecord", 
+        ["index", "freq", "A_fit", "A_avg", "A_max", "temp1", "temp2", "phase", 
+         "rms", "n_rows", "bad_count", "start_time", "end_time"])):
+    """
+    Immutable result of one frequency block, as yielded by Jiggler.iter_sweep
+        index = position of the block in the sweep
+        freq = frequency in Hz
+        A_fit, A_avg, A_max = amplitudes in degrees (see Amplitude_solver)
+        temp1, temp2 = average temperatures of the block
+        phase, rms = sin fit phase and residual rms
+        n_rows = number of rows accepted by data_parser
+        bad_count = number of rows rejected by data_parser
+        start_time, end_time = datetimes of the frequency write and of the 
+                               block being fitted
+    """
+    __slots__ = ()
+
+
+class SweepSummary(namedtuple("SweepSummary", 
+        ["A_sol_list", "start_time", "mid_time", "end_time", "parabolic_res_freq",
+         "lorentz_res_freq", "n_records", "bad_count"])):
+    """
+    Final item yielded by Jiggler.iter_sweep
+        A_sol_list = the sweep in the Amplitude_solver() format
+        start_time, mid_time, end_time = as stored in Jiggler.time_list
+        parabolic_res_freq, lorentz_res_freq = resonant frequencies of the 
+            curve fits, None when the fit is disabled or failed
+        n_records = number of FrequencyRecords yielded
+        bad_count = total rows rejected by data_parser
+    """
+    __slots__ = ()
+
+
+def _pad_ragged(arrays):
+    """Stacks a list of 1d arrays of different lengths into a 2d array padded
+    with NaN. 2d arrays are returned unchanged (as float)."""
+    if isinstance(arrays, np.ndarray) and arrays.ndim == 2:
+        return arrays.astype(float, copy = False)
+
+    lengths = np.array([len(array) for array in arrays], dtype = int)
+    if len(lengths) > 0 and (lengths == lengths[0]).all():
+        return np.stack(arrays).astype(float, copy = False)
+
+    padded = np.full((len(lengths), lengths.max(initial = 0)), np.nan)
+    if padded.size > 0:
+        padded[np.arange(padded.shape[1]) < lengths[:, np.newaxis]] = np.concatenate(arrays)
+    return padded
+
+
+def render_sweep_figure(A_sol_list, title, fig_file, x_lims = None, y_lims = None,
+                        A_fit = True, A_avg = False, A_max = False):
+    """
+    Draws the amplitude vs frequency graph of quick_plot() and saves it to 
+    fig_file. The figure is a bare matplotlib Figure rather than a pyplot one,
+    so it needs no GUI backend and nothing is kept alive after it is saved.
+    Only the first four entries of A_sol_list (freq, A_fit, A_avg, A_max) are
+    used.
+    """
+    from matplotlib.figure import Figure
+
+    fig = Figure()
+    ax = fig.subplots()
+
+    # Plotting Amplitude data
+    if A_fit == True:
+        ax.plot(A_sol_list[0], A_sol_list[1], '.b', label = "Sin Fit")
+    if A_avg == True:
+        ax.plot(A_sol_list[0], A_sol_list[2], '.k', label = "Adjusted Average")
+    if A_max == True:
+        ax.plot(A_sol_list[0], A_sol_list[3], '.g', label = "Amax")
+
+    # Configuring dynamic Labels
+    ax.set_xlabel("Frequency (Hz)")
+    ax.set_ylabel("Amplitude (degrees)")
+    ax.set_title(f"{title}")
+    ax.grid(True)
+    ax.legend(loc="upper left")
+
+    if x_lims != None:
+        ax.set_xlim(x_lims[0], x_lims[1])
+    if y_lims != None:
+        ax.set_ylim(y_lims[0], y_lims[1])
+
+    fig.savefig(fig_file)
+
+
+def _render_worker(jobs, results, coalesce):
+    """
+    Main loop of the RenderService process. Takes figure jobs (keyword 
+    arguments of render_sweep_figure) from jobs until the None sentinel 
+    arrives and reports each one on results. With coalesce = True the jobs 
+    which queued up while a figure was rendering are skipped, except for the
+    newest one.
+    """
+    matplotlib.use("Agg")
+    stopping = False
+    while stopping == False:
+        job = jobs.get()
+        if job == None:
+            break
+
+        if coalesce == True:
+            while True:
+                try:
+                    newer = jobs.get_nowait()
+                except queue.Empty:
+                    break
+                if newer == None:
+                    stopping = True
+                    break
+                results.put({"title" : job["title"], "status" : "coalesced",
+                             "elapsed" : 0.0, "error" : None})
+                job = newer
+
+        start = time.perf_counter()
+        try:
+            render_sweep_figure(**job)
+            status, error = "rendered", None
+        except Exception as e:
+            status, error = "failed", repr(e)
+        results.put({"title" : job["title"], "status" : status, 
+                     "elapsed" : time.perf_counter() - start, "error" : error})
+
+
+class RenderService():
+    """
+    Renders quick_plot figures in a separate worker process, so writing the
+    pdfs never holds up acquisition.
+
+    submit() never blocks: when queue_size figures are already waiting the 
+    oldest one is dropped to make room. With coalesce = True the worker also
+    skips any figures that queued up while it was busy and only renders the
+    newest. poll() collects the worker's reports into the counters below.
+
+        submitted, rendered, dropped, coalesced, failed = figure counts
+        render_time = render time of every rendered figure in seconds
+        errors = [title, error] of each failed figure
+    """
+    def __init__(self, queue_size = 2, coalesce = True):
+        self.queue_size = queue_size
+        self.coalesce = coalesce
+        self.process = None
+        self.jobs = None
+        self.results = None
+
+        self.submitted = 0
+        self.rendered = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.failed = 0
+        self.render_time = []
+        self.errors = []
+
+
+    def start(self):
+        if self.is_alive():
+            return
+        self.jobs = multiprocessing.Queue(self.queue_size)
+        self.results = multiprocessing.Queue()
+        self.process = multiprocessing.Process(target = _render_worker, name = "jiggler-render",
+                                               args = (self.jobs, self.results, self.coalesce),
+                                               daemon = True)
+        self.process.start()
+
+
+    def is_alive(self):
+        return self.process != None and self.process.is_alive()
+
+
+    def submit(self, A_sol_list, title, fig_file, x_lims = None, y_lims = None,
+               A_fit = True, A_avg = False, A_max = False):
+        """Queues a figure for rendering, arguments as for render_sweep_figure()"""
+        self.start()
+        job = {"A_sol_list" : [np.asarray(values, dtype = float) for values in A_sol_list[:4]],
+               "title" : title, "fig_file" : fig_file, "x_lims" : x_lims, "y_lims" : y_lims,
+               "A_fit" : A_fit, "A_avg" : A_avg, "A_max" : A_max}
+        self.submitted += 1
+
+        while True:
+            try:
+                self.jobs.put_nowait(job)
+                break
+            except queue.Full:
+                # Falling behind, the oldest waiting figure makes room
+                try:
+                    self.jobs.get_nowait()
+                    self.dropped += 1
+                except queue.Empty:
+                    pass
+        self.poll()
+
+
+    def poll(self):
+        """Collects the reports of finished figures, returns how many arrived"""
+        count = 0
+        while self.results != None:
+            try:
+                report = self.results.get_nowait()
+            except queue.Empty:
+                break
+            count += 1
+            if report["status"] == "rendered":
+                self.rendered += 1
+                self.render_time.append(report["elapsed"])
+            elif report["status"] == "coalesced":
+                self.coalesced += 1
+            else:
+                self.failed += 1
+                self.errors.append([report["title"], report["error"]])
+        return count
+
+
+    def pending(self):
+        """Number of submitted figures not yet reported on"""
+        return self.submitted - self.dropped - self.rendered - self.coalesced - self.failed
+
+
+    def stop(self, timeout = 30):
+        """Lets the worker finish the figures already queued (for up to timeout
+        seconds) and shuts it down"""
+        if self.process == None:
+            return
+        if self.process.is_alive():
+            try:
+                self.jobs.put(None, timeout = timeout)
+            except queue.Full:
+                pass
+            self.process.join(timeout)
+            if self.process.is_alive():
+                self.process.terminate()
+                self.process.join()
+
+        # Reports still in the pipe after the worker has exited
+        deadline = time.perf_counter() + 1
+        while self.pending() > 0 and time.perf_counter() < deadline:
+            if self.poll() == 0:
+                time.sleep(0.01)
+        self.process = None
+
+
+    def __repr__(self):
+        return (f"RenderService(submitted={self.submitted}, rendered={self.rendered}, "
+                f"dropped={self.dropped}, coalesced={self.coalesced}, failed={self.failed})")
+
+
+SWEEP_DTYPE = np.dtype([("time", "M8[ms]"), ("offset", "i8"), ("count", "i8"),
+                        ("parabolic_res_freq", "f8"), ("lorentz_res_freq", "f8"),
+                        ("res_amp", "f8"), ("temp1", "f8"), ("temp2", "f8")])
+POINT_DTYPE = np.dtype([("freq", "f8"), ("A_fit", "f8"), ("A_avg", "f8"), ("A_max", "f8"),
+                        ("temp1", "f8"), ("temp2", "f8")])
+# Version 1 stores (no version file) kept the sweep times in whole seconds
+RUN_STORE_VERSION = 2
+
+
+HISTORY_DTYPE = np.dtype([("loop_count", "i8"), ("start_time", "M8[ms]"), ("mid_time", "M8[ms]"),
+                          ("end_time", "M8[ms]"), ("parabolic_res_freq", "f8"),
+                          ("lorentz_res_freq", "f8"), ("res_amp", "f8"), ("temp1", "f8"),
+                          ("temp2", "f8")])
+# Version 1 history spill files (no version file) kept mid_time in whole seconds
+HISTORY_VERSION = 2
+
+
+class RingBuffer():
+    """
+    Typed ring buffer of numpy records for series which grow for the whole of
+    a run. It starts with room for `initial` records and doubles up to 
+    `capacity`, after that the oldest half is spilled to spill_file (raw 
+    records appended to the end, see to_array) or dropped if spill_file is 
+    None whenever it fills up. Memory is bounded by capacity records for any
+    run length and appends are amortized O(1).
+
+    Indexing (ring[-1], ring[-10:]) covers the records still in memory, 
+    to_array() also reads the spilled ones back.
+    """
+    def __init__(self, dtype, capacity = 4096, spill_file = None, initial = 64):
+        self.dtype = np.dtype(dtype)
+        self.capacity = max(int(capacity), 2)
+        self.spill_file = spill_file
+        self.data = np.zeros(max(min(initial, self.capacity), 2), dtype = self.dtype)
+        self.start = 0
+        self.count = 0
+        self.n_spilled = 0
+        self.n_dropped = 0
+
+        # Continuing a spill file from an earlier run
+        if spill_file != None:
+            os.makedirs(os.path.dirname(spill_file) or ".", exist_ok = True)
+            if os.path.exists(spill_file):
+                self.n_spilled = os.path.getsize(spill_file)//self.dtype.itemsize
+
+
+    def __len__(self):
+        return self.count
+
+
+    @property
+    def total(self):
+        """Number of records appended over the life of the buffer"""
+        return self.n_spilled + self.n_dropped + self.count
+
+
+    def _ordered(self):
+        """Records in memory, oldest first"""
+        end = self.start + self.count
+        if end <= len(self.data):
+            return self.data[self.start:end]
+        return np.concatenate([self.data[self.start:], self.data[:end - len(self.data)]])
+
+
+    def _grow(self):
+        ordered = self._ordered()
+        self.data = np.zeros(min(2*len(self.data), self.capacity), dtype = self.dtype)
+        self.data[:self.count] = ordered
+        self.start = 0
+
+
+    def spill(self, n = None):
+        """Moves the oldest n records (default half) out of memory"""
+        n = min(max(self.count//2, 1) if n == None else n, self.count)
+        if self.spill_file != None:
+            with open(self.spill_file, "ab") as f:
+                self._ordered()[:n].tofile(f)
+            self.n_spilled += n
+        else:
+            self.n_dropped += n
+        self.start = (self.start + n) % len(self.data)
+        self.count -= n
+
+
+    def append(self, record):
+        """Appends one record, a tuple in dtype field order"""
+        if self.count == len(self.data):
+            if len(self.data) < self.capacity:
+                self._grow()
+            else:
+                self.spill()
+        self.data[(self.start + self.count) % len(self.data)] = record
+        self.count += 1
+
+
+    def __getitem__(self, index):
+        if isinstance(index, (int, np.integer)):
+            if index < 0:
+                index += self.count
+            if index < 0 or index >= self.count:
+                raise IndexError("RingBuffer index out of range")
+            return self.data[(self.start + index) % len(self.data)]
+        return self._ordered()[index]
+
+
+    def to_array(self, include_spilled = True):
+        """All records as one array, reading the spilled records back from 
+        spill_file (dropped records are gone)"""
+        arrays = []
+        if include_spilled == True and self.spill_file != None and os.path.exists(self.spill_file):
+            arrays.append(np.fromfile(self.spill_file, dtype = self.dtype))
+        arrays.append(self._ordered())
+        return np.concatenate(arrays)
+
+
+    def __repr__(self):
+        return (f"RingBuffer(count={self.count}, capacity={self.capacity}, "
+                f"spilled={self.n_spilled}, dropped={self.n_dropped})")
+
+
+def _to_datetime64(value):
+    """Converts a datetime, numpy datetime64 or mid-sample time string (see
+    parse_midsample_time) to a datetime64 in milliseconds"""
+    if isinstance(value, str):
+        value = parse_midsample_time(value)
+    return np.datetime64(value, "ms")
+
+
+def parse_midsample_time(text):
+    """Datetime of a mid-sample time string, '%Y_%m_%d %H_%M_%S' optionally
+    followed by the .milliseconds (and _counter) midsample_names() adds"""
+    seconds, separator, rest = text.partition(".")
+    value = datetime.strptime(seconds, '%Y_%m_%d %H_%M_%S')
+    millis = rest.partition("_")[0]
+    if millis != "":
+        value = value.replace(microsecond = int(millis)*1000)
+    return value
+
+
+def midsample_names(times):
+    """
+    Mid-sample time strings of sweeps at times (datetime64), the names their
+    files and figures are saved under. Sweeps within the same second get the
+    milliseconds appended, and a counter if those match too, so no file is
+    overwritten. data_importer() reads the name back from the file name.
+    """
+    stamps = [np.datetime64(time_stamp, "ms").tolist() for time_stamp in times]
+    seconds = [stamp.strftime('%Y_%m_%d %H_%M_%S') for stamp in stamps]
+    repeats = {}
+    for name in seconds:
+        repeats[name] = repeats.get(name, 0) + 1
+
+    names = []
+    used = {}
+    for stamp, name in zip(stamps, seconds):
+        if repeats[name] > 1:
+            name = f"{name}.{stamp.microsecond//1000:03d}"
+        count = used.get(name, 0)
+        used[name] = count + 1
+        names.append(name if count == 0 else f"{name}_{count}")
+    return names
+
+
+def _upgrade_time_records(fname, dtype, fields, version_file, version):
+    """
+    Brings the dtype records of fname up to version. Files without a 
+    version_file are version 1, which kept the datetime fields in whole 
+    seconds, these are converted in place to the units of dtype. Raises 
+    ValueError for a file of a newer version.
+    """
+    if os.path.exists(version_file):
+        with open(version_file) as f:
+            found = int(f.read())
+        if found > version:
+            raise ValueError(f"{fname} is version {found}, only up to version {version} can be read")
+        return
+
+    if os.path.exists(fname):
+        legacy_dtype = np.dtype([(name, "M8[s]" if name in fields else dtype[name])
+                                 for name in dtype.names])
+        records = np.fromfile(fname, legacy_dtype, os.path.getsize(fname)//dtype.itemsize)
+        temp_path = fname + ".tmp"
+        with open(temp_path, "wb") as f:
+            f.write(records.astype(dtype).tobytes())
+        os.replace(temp_path, fname)
+
+    os.makedirs(os.path.dirname(version_file) or ".", exist_ok = True)
+    with open(version_file, "w") as f:
+        f.write(f"{version}\n")
+
+
+class RunStore():
+    """
+    Append-only store of the amplitudes and resonance fits of every sweep of
+    a run, in place of one csv file per sweep. The store is a directory with 
+    two files of fixed size binary records:
+
+        sweeps.bin = one SWEEP_DTYPE record per sweep, its mid-sample time, 
+                     where its points are in points.bin, the resonant 
+                     frequencies and amplitude found by the fits (NaN if not
+                     fit) and the average temperatures
+        points.bin = one POINT_DTYPE record per frequency of each sweep, ie. 
+                     the columns of A_sol_list
+        version    = RUN_STORE_VERSION of the files, stores written before 
+                     the sweep times had milliseconds have none and are 
+                     converted when opened
+
+    Appends only write to the end of both files, so they cost the same at any
+    run length. Reads memory map the files and look up a time range with a 
+    binary search of the sweep times. Points are written before their sweep
+    record, so a sweep interrupted halfway through an append is discarded 
+    the next time the store is opened.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.sweep_file = os.path.join(path, "sweeps.bin")
+        self.point_file = os.path.join(path, "points.bin")
+        self.version_file = os.path.join(path, "version")
+        os.makedirs(path, exist_ok = True)
+        self._upgrade()
+        self._recover()
+
+
+    def _upgrade(self):
+        """Converts the sweep times of a version 1 store to milliseconds and
+        writes the version file"""
+        _upgrade_time_records(self.sweep_file, SWEEP_DTYPE, ["time"], self.version_file,
+                              RUN_STORE_VERSION)
+
+
+    def _recover(self):
+        """Truncates both files to the last complete sweep"""
+        self.n_sweeps = self._truncate(self.sweep_file, SWEEP_DTYPE, None)
+        sweeps = self.sweeps()
+        self.n_points = int(sweeps["offset"][-1] + sweeps["count"][-1]) if self.n_sweeps > 0 else 0
+        self._truncate(self.point_file, POINT_DTYPE, self.n_points)
+
+        times = sweeps["time"]
+        self.ordered = bool(np.all(times[1:] >= times[:-1]))
+        self.last_time = times[-1] if self.n_sweeps > 0 else None
+
+
+    @staticmethod
+    def _truncate(fname, dtype, n_records):
+        """Cuts fname down to n_records records (or its last whole record when
+        n_records is None), returns the number of records kept"""
+        with open(fname, "ab") as f:
+            size = f.seek(0, os.SEEK_END)
+            if n_records == None:
+                n_records = size//dtype.itemsize
+            if size != n_records*dtype.itemsize:
+                f.truncate(n_records*dtype.itemsize)
+        return n_records
+
+
+    @staticmethod
+    def _map(fname, dtype, n_records):
+        if n_records == 0:
+            return np.empty(0, dtype)
+        return np.memmap(fname, dtype = dtype, mode = "r", shape = (n_records,))
+
+
+    def __len__(self):
+        return self.n_sweeps
+
+
+    def append(self, time, A_sol_list, parabolic_res_freq = None, lorentz_res_freq = None,
+               res_amp = None):
+        """
+        Adds one sweep. time is its mid-sample time (datetime, kept to the 
+        millisecond, or the '%Y_%m_%d %H_%M_%S' string), A_sol_list the return of 
+        Amplitude_solver() and the fit results are None when not available.
+        Returns the index of the sweep.
+        """
+        points = np.empty(len(A_sol_list[0]), POINT_DTYPE)
+        for name, values in zip(POINT_DTYPE.names, A_sol_list):
+            points[name] = values
+
+        sweep = np.zeros(1, SWEEP_DTYPE)
+        sweep["time"] = _to_datetime64(time)
+        sweep["offset"] = self.n_points
+        sweep["count"] = len(points)
+        for name, value in [("parabolic_res_freq", parabolic_res_freq),
+                            ("lorentz_res_freq", lorentz_res_freq), ("res_amp", res_amp)]:
+            sweep[name] = np.nan if value == None else value
+        sweep["temp1"] = np.mean(points["temp1"]) if len(points) > 0 else np.nan
+        sweep["temp2"] = np.mean(points["temp2"]) if len(points) > 0 else np.nan
+
+        with open(self.point_file, "ab") as f:
+            f.write(points.tobytes())
+        with open(self.sweep_file, "ab") as f:
+            f.write(sweep.tobytes())
+
+        if self.last_time != None and sweep["time"][0] < self.last_time:
+            self.ordered = False
+        self.last_time = sweep["time"][0]
+        self.n_points += len(points)
+        self.n_sweeps += 1
+        return self.n_sweeps - 1
+
+
+    def _selection(self, times, start, end):
+        """Indices of times within [start, end], either end may be None"""
+        if self.ordered == True:
+            first = 0 if start == None else np.searchsorted(times, _to_datetime64(start), "left")
+            last = len(times) if end == None else np.searchsorted(times, _to_datetime64(end), "right")
+            return np.arange(first, last)
+
+        # Out of order appends (eg. a clock change), falling back on a scan
+        mask = np.ones(len(times), dtype = bool)
+        if start != None:
+            mask &= times >= _to_datetime64(start)
+        if end != None:
+            mask &= times <= _to_datetime64(end)
+        return np.flatnonzero(mask)
+
+
+    def sweeps(self, start = None, end = None):
+        """Sweep records with start <= time <= end as a structured array"""
+        sweeps = self._map(self.sweep_file, SWEEP_DTYPE, self.n_sweeps)
+        if start == None and end == None:
+            return np.array(sweeps)
+        return np.array(sweeps[self._selection(sweeps["time"], start, end)])
+
+
+    def read(self, start = None, end = None):
+        """
+        Returns the sweeps with start <= time <= end as (times, A_sol_lists)
+        where times are datetime64 and each A_sol_list is a SweepResult (as 
+        returned by Amplitude_solver()) viewing the memory mapped points, 
+        nothing is read until it is used
+        """
+        sweeps = self.sweeps(start, end)
+        points = self._map(self.point_file, POINT_DTYPE, self.n_points)
+
+        A_sol_lists = [SweepResult.from_points(points[offset:offset + count])
+                       for offset, count in zip(sweeps["offset"], sweeps["count"])]
+        return sweeps["time"], A_sol_lists
+
+
+    def to_frame(self, start = None, end = None):
+        """The sweep records with start <= time <= end as a DataFrame indexed 
+        by time, ie. the resonance history of the run"""
+        sweeps = self.sweeps(start, end)
+        df = pd.DataFrame({name : sweeps[name] for name in SWEEP_DTYPE.names if name != "time"},
+                          index = pd.Index(sweeps["time"], name = "time"))
+        return df
+
+
+    def __repr__(self):
+        return f"RunStore({self.path!r}, sweeps={self.n_sweeps}, points={self.n_points})"
+
+
+IMPORT_COLUMNS = ["Frequency", "A_fit", "A_avg", "A_max", "Temp1_avg", "Temp2_avg"]
+
+
+def read_sweep_csv(fname):
+    """Reads a csv exported by quick_plot (frequencies as columns) into a 
+    DataFrame with one row per frequency"""
+    df = pd.read_csv(fname, index_col = 0)
+    df_T = df.T
+    return df_T.rename(columns = dict(enumerate(IMPORT_COLUMNS)))
+
+
+def _read_sweep_array(fname):
+    """data_importer worker, returns a sweep csv as a (6, n_freq) float array
+    with the rows of A_sol_list"""
+    # The csv files are plain numeric tables which loadtxt reads far faster
+    # than pandas
+    try:
+        array = np.loadtxt(fname, delimiter = ",", skiprows = 1, ndmin = 2)[:, 1:]
+        if array.shape[0] == len(IMPORT_COLUMNS):
+            return array
+    except ValueError:
+        pass
+
+    # Empty cells or extra rows, selecting the rows by label with pandas
+    return read_sweep_csv(fname)[IMPORT_COLUMNS].to_numpy(dtype = float).T
+
+
+def _stack_sweeps(arrays):
+    """Stacks (6, n_freq) sweep arrays into a (n_sweeps, 6, max n_freq) array,
+    shorter sweeps are padded with NaN. Returns the array and the n_freq of
+    each sweep."""
+    counts = np.array([array.shape[1] for array in arrays], dtype = int)
+    if len(arrays) == 0:
+        return np.empty((0, len(IMPORT_COLUMNS), 0)), counts
+    if (counts == counts[0]).all():
+        return np.stack(arrays), counts
+
+    stacked = np.full((len(arrays), len(IMPORT_COLUMNS), counts.max()), np.nan)
+    for i, array in enumerate(arrays):
+        stacked[i, :, :counts[i]] = array
+    return stacked, counts
+
+
+def lorentz_curve(x, x0, gamma, z):
+    """
+    x0 = location parameter, specifies location of the peak of the distribution
+    gamma/y = scale parameter, specifies the half-width at half-max
+                2y would be FWHM
+    z = height of the peak
+    """
+    return z*(gamma**2/((x - x0)**2 + gamma**2))
+
+
+def _lorentz_jacobian(x, x0, gamma, z):
+    """Derivatives of lorentz_curve with respect to x0, gamma and z"""
+    dx = x - x0
+    denominator = dx**2 + gamma**2
+    shape = gamma**2/denominator
+    return np.column_stack([2*z*shape*dx/denominator,
+                            2*z*gamma*dx**2/denominator**2,
+                            shape])
+
+
+def lorentz_initial_guess(xdata, ydata):
+    """
+    Estimates [x0, gamma, z] of lorentz_curve from background subtracted data:
+    x0 from the vertex of a parabola through the largest point and its 
+    neighbours, z from the largest value and gamma from where the data 
+    crosses half of it on either side of the peak (linearly interpolated).
+    """
+    xdata = np.asarray(xdata, dtype = float)
+    ydata = np.asarray(ydata, dtype = float)
+    peak = int(np.nanargmax(ydata))
+    x0 = xdata[peak]
+    z = ydata[peak]
+
+    # Sub-step peak location from the three points around the maximum
+    if 0 < peak < len(ydata) - 1:
+        y_left, y_right = ydata[peak - 1], ydata[peak + 1]
+        curvature = y_left - 2*z + y_right
+        if curvature < 0:
+            x0 += 0.5*(y_left - y_right)/curvature*(xdata[peak + 1] - xdata[peak])
+
+    # Half max crossings on each side of the peak
+    half = z/2
+    widths = []
+    below = np.flatnonzero(ydata[:peak] < half)
+    if len(below) > 0:
+        i = below[-1]
+        crossing = np.interp(half, [ydata[i], ydata[i + 1]], [xdata[i], xdata[i + 1]])
+        widths.append(x0 - crossing)
+    below = np.flatnonzero(ydata[peak + 1:] < half)
+    if len(below) > 0:
+        i = peak + 1 + below[0]
+        crossing = np.interp(half, [ydata[i], ydata[i - 1]], [xdata[i], xdata[i - 1]])
+        widths.append(crossing - x0)
+
+    span = xdata[-1] - xdata[0]
+    gamma = np.mean(widths) if len(widths) > 0 else span/4
+    gamma = max(gamma, np.abs(span)/(4*len(xdata)))
+    return [x0, gamma, z]
+
+
+def fit_lorentz_peak(xdata, ydata, start_tail = 5, end_tail = 5, p0 = None, background = None):
+    """
+    Bounded least squares fit of lorentz_curve to the amplitudes ydata minus
+    their background, used by Jiggler.lorentz_fit() and batch_lorentz_fit().
+
+    The background nf is the mean of the start_tail first and end_tail last
+    points, or background when given (eg. for a sweep too narrow to have 
+    tails off the peak). The fit starts from p0 when it is given and its peak lies within
+    the data, otherwise (or if that fails) from lorentz_initial_guess(). The
+    bounds keep the peak inside the sweep with a width between a tenth of a
+    step and the span and a positive height, fits ending on the edge of the
+    sweep are failures.
+
+    Returns (popt, nf, info) with popt = [x0, gamma, z] or None if the fit 
+    failed and info = {"nfev", "rms", "warm"} where warm is True if the fit
+    started from p0.
+    """
+    xfit = np.asarray(xdata, dtype = float)
+    yfit = np.asarray(ydata, dtype = float)
+
+    """Estimating background noise"""
+    if background is None:
+        avg_start_noise = np.mean(yfit[0:start_tail])
+        avg_end_noise = np.mean(yfit[-end_tail: -1])
+        nf = (avg_start_noise+avg_end_noise)/2 # noise factor
+    else:
+        nf = background
+
+    # Physical bounds, the peak has to be inside the sweep
+    x_min, x_max = np.min(xfit), np.max(xfit)
+    span = x_max - x_min
+    step = span/max(len(xfit) - 1, 1)
+    height = np.max(yfit - nf)
+    bounds = ([x_min, step/10, 0], [x_max, span, max(10*height, 1E-9)])
+
+    guesses = [np.clip(lorentz_initial_guess(xfit, yfit - nf), bounds[0], bounds[1])]
+    if p0 is not None and x_min < p0[0] < x_max:
+        guesses.insert(0, np.clip(p0, bounds[0], bounds[1]))
+
+    # Calculating least squares fitting of an optimized lorentz curve, 
+    # subtracting background noise from the amplitude values. scipy is only
+    # imported once a lorentz fit is actually run.
+    from scipy.optimize import curve_fit
+    for i, guess in enumerate(guesses):
+        try:
+            popt, pcov, info, message, flag = curve_fit(lorentz_curve, xfit, yfit-nf, p0 = guess,
+                                                        bounds = bounds, jac = _lorentz_jacobian,
+                                                        full_output = True)
+        except (RuntimeError, ValueError):
+            continue
+
+        # A peak pinned to the edge of the sweep is not a resonance
+        if x_min + step/100 < popt[0] < x_max - step/100:
+            return popt, nf, {"nfev" : info["nfev"], "rms" : float(np.sqrt(np.mean(info["fvec"]**2))),
+                              "warm" : len(guesses) == 2 and i == 0}
+
+    return None, nf, {"nfev" : None, "rms" : None, "warm" : False}
+
+
+def batch_parabolic_fit(frequency, amplitudes, peak_width = 10):
+    """
+    Jiggler.parabolic_fit() of many sweeps at once. frequency is a 
+    (N_sweeps, N_freq) array or one (N_freq,) row shared by all sweeps, 
+    amplitudes is (N_sweeps, N_freq), sweeps with fewer frequencies are 
+    padded with NaN at the end.
+
+    Each sweep's points above its full width half max level are selected 
+    with a mask and the quadratics of all sweeps are solved as one stack of
+    3x3 normal equations (in frequencies centered on each peak, for 
+    conditioning).
+
+    Returns a dictionary of (N_sweeps,) arrays:
+        res_freq = vertex of the parabola
+        res_amp = amplitude at the vertex
+        FWHM = distance between the parabola's crossings of the half max level
+    Sweeps with fewer than 3 points above the half max level are NaN.
+    """
+    amplitudes = np.atleast_2d(np.asarray(amplitudes, dtype = float))
+    frequency = np.broadcast_to(np.asarray(frequency, dtype = float), amplitudes.shape)
+    n_sweeps = amplitudes.shape[0]
+    rows = np.arange(n_sweeps)
+    valid = np.isfinite(amplitudes)
+    n_valid = valid.sum(axis = 1)
+    filled = np.where(valid, amplitudes, -np.inf)
+
+    # Calculating number of index values for half the width of the peak
+    step_size = frequency[:, 1] - frequency[:, 0]
+    half_width_in_steps = (peak_width/(2*step_size)).astype(int)
+
+    # Getting indices of the maximum amplitude value
+    Amax_ind = np.argmax(filled, axis = 1)
+    Amax = filled[rows, Amax_ind]
+    steps_A_to_start = Amax_ind
+    steps_A_to_end = n_valid - Amax_ind
+    sample_size_10_percent = n_valid//10
+
+    """Noise Finder, as in parabolic_fit: the amplitude half_width either side
+    of the peak, or the mean of the first/last 10% of the sweep if the peak 
+    is too close to that end"""
+    cumulative = np.concatenate([np.zeros((n_sweeps, 1)),
+                                 np.cumsum(np.where(valid, amplitudes, 0), axis = 1)], axis = 1)
+    with np.errstate(invalid = "ignore", divide = "ignore"):
+        tail_end = (cumulative[rows, n_valid] - cumulative[rows, n_valid - sample_size_10_percent])/sample_size_10_percent
+        tail_start = (cumulative[rows, sample_size_10_percent + 1] - cumulative[rows, 1])/sample_size_10_percent
+
+    last = amplitudes.shape[1] - 1
+    b = np.where(half_width_in_steps > steps_A_to_end, tail_end,
+                 amplitudes[rows, np.clip(Amax_ind + half_width_in_steps - 1, -last - 1, last)])
+    a = np.where(half_width_in_steps > steps_A_to_start, tail_start,
+                 amplitudes[rows, np.clip(Amax_ind - half_width_in_steps, -last - 1, last)])
+    offset = (b+a)/2
+    A_fw_hm = (0.5)*Amax + (0.5)*offset
+
+    # Points above the full width half max level of each sweep
+    with np.errstate(invalid = "ignore"):
+        mask = valid & (amplitudes >= A_fw_hm[:, np.newaxis])
+    weights = mask.astype(float)
+
+    # Stacked normal equations of y = c0*u**2 + c1*u + c2, u = x - x_peak
+    center = frequency[rows, Amax_ind]
+    u = np.where(mask, frequency - center[:, np.newaxis], 0)
+    y = np.where(mask, amplitudes, 0)
+    power_sums = np.stack([np.sum(weights*u**k, axis = 1) for k in range(5)], axis = 1)
+    moments = np.stack([np.sum(y*u**k, axis = 1) for k in (2, 1, 0)], axis = 1)
+    normal = power_sums[:, [[4, 3, 2], [3, 2, 1], [2, 1, 0]]]
+
+    enough = mask.sum(axis = 1) >= 3
+    coefficients = np.full((n_sweeps, 3), np.nan)
+    if enough.any():
+        try:
+            coefficients[enough] = np.linalg.solve(normal[enough], moments[enough][..., np.newaxis])[..., 0]
+        except np.linalg.LinAlgError:
+            coefficients[enough] = (np.linalg.pinv(normal[enough]) @ moments[enough][..., np.newaxis])[..., 0]
+
+    c0, c1, c2 = coefficients.T
+    with np.errstate(invalid = "ignore", divide = "ignore"):
+        vertex = -c1/(2*c0)
+        res_amp = c2 - c1**2/(4*c0)
+        FWHM = np.sqrt(c1**2 - 4*c0*(c2 - A_fw_hm))/np.abs(c0)
+
+    return {"res_freq" : center + vertex, "res_amp" : res_amp, "FWHM" : FWHM}
+
+
+def _lorentz_chunk(frequency, amplitudes, start_tail, end_tail):
+    """batch_lorentz_fit worker, fits each row of a chunk of sweeps"""
+    results = np.full((len(amplitudes), 4), np.nan)
+    for i, (x, y) in enumerate(zip(frequency, amplitudes)):
+        keep = np.isfinite(x) & np.isfinite(y)
+        if keep.sum() < 4:
+            continue
+        popt, nf, info = fit_lorentz_peak(x[keep], y[keep], start_tail, end_tail)
+        if popt is not None:
+            results[i] = [popt[0], popt[2] + nf, 2*popt[1], info["nfev"]]
+    return results
+
+
+def batch_lorentz_fit(frequency, amplitudes, workers = None, chunk_size = None,
+                      start_tail = 5, end_tail = 5):
+    """
+    fit_lorentz_peak() of many sweeps, in chunks spread over a pool of 
+    workers processes (None = one per CPU). frequency and amplitudes are as 
+    for batch_parabolic_fit().
+
+    Returns a dictionary of (N_sweeps,) arrays, NaN where the fit failed:
+        res_freq = peak location x0
+        res_amp = peak height including the background
+        FWHM = 2*gamma
+        nfev = function evaluations of the fit
+    """
+    amplitudes = np.atleast_2d(np.asarray(amplitudes, dtype = float))
+    frequency = np.broadcast_to(np.asarray(frequency, dtype = float), amplitudes.shape)
+    n_sweeps = len(amplitudes)
+
+    if workers == None:
+        workers = os.cpu_count() or 1
+    if chunk_size == None:
+        chunk_size = max(1, -(-n_sweeps//(4*workers)))
+    chunks = [slice(i, i + chunk_size) for i in range(0, n_sweeps, chunk_size)]
+
+    # The pool is only worth starting when every worker gets some chunks
+    if workers > 1 and len(chunks) >= 2*workers:
+        with ProcessPoolExecutor(workers) as pool:
+            futures = [pool.submit(_lorentz_chunk, frequency[chunk], amplitudes[chunk],
+                                   start_tail, end_tail) for chunk in chunks]
+            results = [future.result() for future in futures]
+    else:
+        results = [_lorentz_chunk(frequency[chunk], amplitudes[chunk], start_tail, end_tail)
+                   for chunk in chunks]
+
+    results = np.concatenate(results) if results else np.empty((0, 4))
+    return {"res_freq" : results[:, 0], "res_amp" : results[:, 1], "FWHM" : results[:, 2],
+            "nfev" : results[:, 3]}
+
+
+class FitStats():
+    """
+    Convergence statistics of the Lorentz fits since the last reset()
+        calls, failures = number of fits and how many of them failed
+        warm_starts = fits started from the previous sweep's parameters
+        nfev = function evaluations of each successful fit
+        elapsed = time in seconds of each fit
+        rms = rms residual of each successful fit
+    The per-fit values are kept for the last max_samples fits only.
+    """
+    max_samples = 4096
+
+    def __init__(self):
+        self.reset()
+
+
+    def reset(self):
+        self.calls = 0
+        self.failures = 0
+        self.warm_starts = 0
+        self.nfev = deque(maxlen = self.max_samples)
+        self.elapsed = deque(maxlen = self.max_samples)
+        self.rms = deque(maxlen = self.max_samples)
+
+
+    def summary(self):
+        return {"calls" : self.calls, "failures" : self.failures, 
+                "warm_starts" : self.warm_starts,
+                "mean_nfev" : float(np.mean(self.nfev)) if self.nfev else None,
+                "mean_time" : float(np.mean(self.elapsed)) if self.elapsed else None,
+                "mean_rms" : float(np.mean(self.rms)) if self.rms else None}
+
+
+    def __repr__(self):
+        return f"FitStats({self.summary()})"
+
+
+def sweep_hash(A_sol_list):
+    """Content hash of a sweep (the rows of its A_sol_list as float64)"""
+    digest = hashlib.sha1()
+    for row in A_sol_list:
+        digest.update(np.ascontiguousarray(row, dtype = np.float64).tobytes())
+        digest.update(b"|")
+    return digest.hexdigest()
+
+
+class ImportCache():
+    """
+    On-disk cache of the sweep csv files of one folder parsed by 
+    data_importer, saved as a single npz file at path (see 
+    Jiggler.import_cache_file). Entries are keyed by file name, size and 
+    modification time, so files which are edited or replaced are parsed 
+    again and entries of deleted files are dropped on save().
+    """
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        self.changed = False
+
+        if os.path.exists(path):
+            try:
+                with np.load(path, allow_pickle = False) as cache:
+                    arrays = np.split(cache["data"], np.cumsum(cache["counts"])[:-1], axis = 1)
+                    for name, size, mtime, array in zip(cache["names"].tolist(), cache["sizes"].tolist(),
+                                                        cache["mtimes"].tolist(), arrays):
+                        self.entries[name] = ((size, mtime), array)
+            except (OSError, KeyError, ValueError) as e:
+                print(f"Ignoring unreadable import cache {path} ({e})")
+                self.entries = {}
+
+
+    @staticmethod
+    def key(fname):
+        stat = os.stat(fname)
+        return (stat.st_size, stat.st_mtime_ns)
+
+
+    def get(self, fname, key):
+        """The cached array of fname, None if missing or out of date"""
+        entry = self.entries.get(os.path.basename(fname))
+        if entry == None or entry[0] != key:
+            return None
+        return entry[1]
+
+
+    def put(self, fname, key, array):
+        self.entries[os.path.basename(fname)] = (key, array)
+        self.changed = True
+
+
+    def save(self, fnames):
+        """Writes the entries of fnames to disk, dropping all others"""
+        names = [os.path.basename(fname) for fname in fnames]
+        if self.changed == False and set(names) == set(self.entries):
+            return
+        names = [name for name in names if name in self.entries]
+        arrays = [self.entries[name][1] for name in names]
+
+        temp_path = self.path + ".tmp"
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok = True)
+            with open(temp_path, "wb") as f:
+                np.savez(f, names = np.array(names, dtype = str),
+                         sizes = np.array([self.entries[name][0][0] for name in names], dtype = np.int64),
+                         mtimes = np.array([self.entries[name][0][1] for name in names], dtype = np.int64),
+                         counts = np.array([array.shape[1] for array in arrays], dtype = np.int64),
+                         data = np.concatenate(arrays, axis = 1) if arrays else np.empty((len(IMPORT_COLUMNS), 0)))
+            os.replace(temp_path, self.path)
+            self.changed = False
+        except OSError as e:
+            print(f"Could not save import cache {self.path} ({e})")
+
+
+def migrate_csv_folder(input_directory, store):
+    """
+    Appends the sweep csv files of input_directory to store (a RunStore or a 
+    path to one) in time order. Files whose name is not a mid-sample time, 
+    like the _DF_FORMAT exports, are skipped, as are sweeps already in the
+    store, so a folder can be migrated again after more files have been 
+    added. Returns the number of sweeps migrated.
+    """
+    if isinstance(store, RunStore) == False:
+        store = RunStore(store)
+
+    # Parsing the mid-sample time out of each filename
+    files = []
+    for fname in glob.glob(os.path.join(input_directory, "*.csv")):
+        base_name = os.path.basename(fname)
+        try:
+            files.append((_to_datetime64(os.path.splitext(base_name)[0]), fname))
+        except ValueError:
+            print(f"Skipping {base_name}, not a sweep file")
+
+    # File names only have whole seconds
+    existing = set(store.sweeps()["time"].astype("M8[s]").tolist())
+    count = 0
+    for time_stamp, fname in sorted(files):
+        if time_stamp.astype("M8[s]").tolist() in existing:
+            continue
+        df = read_sweep_csv(fname)
+        A_sol_list = [df[column].values for column in IMPORT_COLUMNS]
+        store.append(time_stamp, A_sol_list)
+        count += 1
+
+    print(f"Migrated {count} sweeps from {input_directory} to {store.path}")
+    return count
+
+
+class FixedRateSchedule():
+    """
+    Slots of a fixed rate loop, shared by Jiggler.fixed_rate_loop and the
+    JigglerDriver of Jiggler_async. Slot n is due period*n seconds after the
+    origin, which is offset seconds from now (or with align = True the next
+    multiple of period of the wall clock after that). Slots are timed with 
+    the monotonic clock, the wall clock is only used to report them.
+
+    Usage:
+        schedule = FixedRateSchedule(period, skip_missed)
+        while schedule.due(duration):
+            time.sleep(schedule.wait())
+            schedule.start()
+            ...sweep...
+            record = schedule.finish()
+    """
+    def __init__(self, period, skip_missed = True, align = False, offset = 0):
+        self.period = period
+        self.skip_missed = skip_missed
+        self.wall_origin = time.time() + offset
+        self.origin = time.monotonic() + offset
+        if align == True:
+            aligned = np.ceil(self.wall_origin/period)*period
+            self.origin += aligned - self.wall_origin
+            self.wall_origin = aligned
+        self.slot = 0
+        self.started = None
+
+
+    def scheduled(self):
+        """Monotonic time the current slot is due"""
+        return self.origin + self.slot*self.period
+
+
+    def due(self, duration):
+        """True while the current slot starts within duration seconds of the
+        origin, duration = None never ends"""
+        return duration == None or self.slot*self.period <= duration
+
+
+    def wait(self):
+        """Seconds until the current slot is due, 0 if it already is"""
+        return max(0, self.scheduled() - time.monotonic())
+
+
+    def start(self):
+        self.started = time.monotonic()
+
+
+    def finish(self):
+        """
+        Ends the current slot and moves on to the next one, or with 
+        skip_missed = True after an overrun to the first slot which has not
+        started yet. Returns the slot's record in the format of 
+        Jiggler.schedule_log.
+        """
+        finished = time.monotonic()
+        scheduled = self.scheduled()
+        record = {"slot" : self.slot,
+                  "scheduled" : datetime.fromtimestamp(self.wall_origin + self.slot*self.period),
+                  "started" : datetime.fromtimestamp(self.wall_origin + self.started - self.origin),
+                  "late" : self.started - scheduled, "work" : finished - self.started,
+                  "overrun" : finished > scheduled + self.period, "skipped" : 0}
+
+        next_slot = self.slot + 1
+        if record["overrun"] == True and self.skip_missed == True:
+            next_slot = int(np.floor((finished - self.origin)/self.period)) + 1
+            record["skipped"] = next_slot - self.slot - 1
+        self.slot = next_slot
+        return record
+
 
 """                            DEFININING CLASS                              """
 
@@ -103,6 +1943,152 @@ class Jiggler():
                 Exports a data file with the import plotter where the data 
                 exported is in columns with a label. Only exports the frequency
                 and Sin-fit amplitude. 
+
+            "buffered_read" : False
+                Reads each frequency block in whole chunks (in_waiting/read(n))
+                instead of one read_until call per sample, see read_data_buffered
+
+            "read_chunk_size" : 4096
+                Maximum number of bytes requested per read in buffered mode
+
+            "streaming_sin_fit" : False
+                The sin fit amplitude of each block is accumulated while it is
+                read (see SinFitAccumulator) and used by pipelined_sweep and 
+                iter_sweep in place of the fit of the finished block
+
+            "adaptive_dwell" : False
+                Stops reading a frequency (and sends the stop command) once 
+                the standard error of its sin fit amplitude is below 
+                dwell_target_error, instead of always reading sample_size rows
+
+            "dwell_min_samples" : 300
+                Rows read at every frequency before the adaptive dwell may stop
+
+            "dwell_target_error" : 0.02
+                Standard error of the sin fit amplitude in degrees at which 
+                the adaptive dwell moves on to the next frequency
+
+            "trim_settling" : False
+                Drops the settling transient at the start of every frequency
+                block before the amplitudes are calculated, see 
+                settling_index. [freq, settling time (s), samples trimmed] of
+                each frequency of the last sweep is kept in self.settling_times.
+                Blocks still settling at half their length are trimmed by 
+                half, counted in the unsettled_blocks metric, and keep the 
+                extrapolated settling time.
+
+            "settling_window" : 100
+                Window length in samples used to follow the envelope
+
+            "settling_tolerance" : 0.02
+                Relative amplitude deviation from steady state still counted
+                as settled
+
+            "history_window" : None
+                Number of sweeps the loops keep in memory. When set, each sweep
+                is recorded in self.history (a RingBuffer spilling to 
+                output_directory/history) and time_list, midsample_times, the
+                resonance lists, res_freq_amp, schedule_log and error_log are 
+                cut to the last history_window entries, so memory stays flat
+                over runs of any length. None keeps everything in the lists.
+
+            "compact_raw_blocks" : False
+                Keeps each raw block of self.sweep_data as one bytes object 
+                instead of a list of sample_size strings
+
+            "adaptive_sweep" : False
+                Jiggler_sweep does a coarse pass followed by a fine pass around
+                the peak instead of a linear sweep, see adaptive_sweep
+
+            "coarse_step" : 1.0
+                Frequency step in Hz of the adaptive sweep's coarse pass
+
+            "refine_width" : 2.0
+                Width in Hz of the window around the coarse peak which the 
+                adaptive sweep samples at step_size
+
+            "tracking_sweep" : False
+                Each Jiggler_sweep only samples a window centered on the last
+                accepted resonant frequency, see tracking_sweep
+
+            "tracking_width" : 2.0
+                Width in Hz of the tracking window. The window is doubled (up
+                to the full interval) whenever the peak is lost. Windows 
+                narrower than the interval are Lorentz fit against the 
+                background of the last full sweep
+
+            "pipelined_sweep" : False
+                Parses and fits each frequency while the next one is being 
+                acquired, see pipelined_sweep. Not used with "adaptive_sweep"
+
+            "pipeline_queue_size" : 4
+                Number of raw frequency blocks the pipeline buffers between the
+                reader thread and the worker
+
+            "background_render" : False
+                quick_plot hands its figure to a RenderService worker process
+                instead of rendering the pdf itself, so Jiggler_loop never
+                waits on matplotlib
+
+            "render_queue_size" : 2
+                Number of figures waiting for the render process before the 
+                oldest waiting figure is dropped
+
+            "export_format" : "csv"
+                "csv" exports the amplitudes of each sweep to its own csv file,
+                "store" appends them to the RunStore in output_directory/run_store
+
+            "import_cache" : True
+                data_importer keeps the parsed csv files in a cache file in 
+                output_directory/import_cache (one per input directory) and 
+                only parses new or modified files
+
+            "import_workers" : None
+                Number of processes data_importer parses files with, None uses
+                one per CPU
+
+            "fit_cache" : True
+                import_plotter keeps the fit results of each sweep in 
+                output_directory/.jiggler_fit_cache.json and only refits and
+                replots sweeps which are new or have changed
+
+            "lorentz_warm_start" : True
+                Each Jiggler_sweep starts its Lorentz fit from the previous 
+                sweep's fit, falling back on the estimate from the data
+
+            "fit_workers" : None
+                Number of processes import_plotter spreads the Lorentz fits of
+                new sweeps over, None uses one per CPU
+
+            "parabolic_peak_width" : 10
+                peak_width in Hz of the parabolic fits
+
+            "lorentz_start_tail", "lorentz_end_tail" : 5, 5
+                Number of points at each end of a sweep the Lorentz fits take 
+                the background from
+
+            "fixed_rate_loop" : False
+                Jiggler_loop starts a sweep every time_between_samples seconds
+                (start to start) instead of resting time_between_samples 
+                between sweeps, see fixed_rate_loop
+
+            "skip_missed_slots" : True
+                When a fixed rate sweep overruns its slot, the loop waits for
+                the next free slot instead of starting the next sweep late
+
+            "align_loop_to_clock" : False
+                Fixed rate slots start on multiples of time_between_samples 
+                of the wall clock (eg. on the minute for 60 s)
+
+            "metrics_file" : None
+                Path of a json lines file the loops append a snapshot of 
+                self.metrics to after every sweep, see MetricsRegistry.dump
+
+            "metrics_file_max_bytes" : 10_000_000
+                Size at which the metrics file is rotated to metrics_file.1
+
+            "metrics_file_backups" : 3
+                Number of rotated metrics files kept
         }
 
         """
@@ -131,9 +2117,20 @@ class Jiggler():
         self.lorentz_fit_params = []
         self.parabolic_fit_params = []
         self.serial = None
+        self.session = None
+        self.tracking_center = None
+        self.tracking_width = None
+        self.pipeline_stats = None
+        self.render_service = None
+        self.run_store = None
         self.solution_list = []
         self.sweep_data = []
         self.midsample_times = []
+        self.throughput = ThroughputCounter()
+        self.stream_fit = None
+        self.settling_times = []
+        self.sin_fit_phase = []
+        self.sin_fit_rms = []
 
         """
         ---Recursive Attributes---
@@ -147,6 +2144,15 @@ class Jiggler():
         self.error_log = []
         self.import_times = []
         self.imported_data = []
+        self.imported_array = None
+        self.imported_counts = None
+        self.fit_cache = None
+        self.history = None
+        self.lorentz_stats = FitStats()
+        self.schedule_log = []
+        self.metrics = MetricsRegistry()
+        self.lorentz_warm_params = None
+        self.lorentz_background = None
         self.export_df_jig = []
         self.export_df_final = []
         self.parabolic_res_freq = []
@@ -167,6 +2173,7 @@ class Jiggler():
     """Serial read/write and Data management functions"""
     #---------------------------------------------------------------------------
     # Basic Functions (Simple functions)
+    @timed("write_data")
     def write_data(self, freq, buffer = 100/1E6):
         """
         Writes frequency values to the serial port with a default time buffer
@@ -183,6 +2190,8 @@ class Jiggler():
         time.sleep(buffer)
 
         output = self.serial.write(freq)
+        if output == 0:
+            self.metrics.count("write_failures")
         if self.options_dict["silent"] == False:
             if output == 0:
                 error = f"WRITING FREQUENCY {freq} FAILED with buffer {buffer}"
@@ -190,6 +2199,7 @@ class Jiggler():
                 self.error_log.append(error)
 
 
+    @timed("read_data")
     def read_data(self):
         """Reads in sample_size (usually 1500) data points from the Jiggler and 
         decodes them. The code also includes a safety where if a string is 
@@ -198,6 +2208,14 @@ class Jiggler():
         
         Data from the Jiggler is recieved with ascii encoding.
 
+        If options_dict["buffered_read"] is True the block is read with
+        read_data_buffered() instead. Both modes update self.throughput.
+
+        With options_dict["streaming_sin_fit"] or options_dict["adaptive_dwell"]
+        = True both modes also leave a SinFitAccumulator of the block in 
+        self.stream_fit (None otherwise). The adaptive dwell stops reading as
+        soon as the amplitude has converged, see dwell_converged().
+
         Parameters:
             self.serial = given during class initialization
             self.sample_size = given during class initialization
@@ -209,9 +2227,17 @@ class Jiggler():
                 Where the first value is the frequency, the second is the time 
                 in microseconds, and the third is the angle in tenths of a degree
         """
+        if self.options_dict["buffered_read"] == True:
+            return self.read_data_buffered()
+
+        accumulator = self.block_accumulator()
+
+        read_start = time.perf_counter()
+        n_bytes = 0
         data_list = []
         for i in range(self.sample_size):
             data = self.serial.read_until() # EXPERIMENTAL CHECK ON THIS
+            n_bytes += len(data)
             # data = self.serial.readline()
             # print(data)
             data_decoded = data.decode("ascii")
@@ -230,6 +2256,104 @@ class Jiggler():
 
             # print(f"value number {i} with data {type(data)} {data}")
             data_list.append(data_decoded)
+            if accumulator != None:
+                accumulator.add_line(data_decoded)
+                if len(data_list) % DWELL_CHECK_INTERVAL == 0 and self.dwell_converged(accumulator, len(data_list)):
+                    break
+
+        self.stream_fit = accumulator
+        self.record_read(len(data_list), n_bytes, time.perf_counter() - read_start)
+
+        return data_list
+
+
+    def block_accumulator(self):
+        """Returns a new SinFitAccumulator for the block about to be read when
+        the streaming sin fit or the adaptive dwell is on, otherwise None"""
+        if self.options_dict["streaming_sin_fit"] == True or self.options_dict["adaptive_dwell"] == True:
+            return SinFitAccumulator()
+        return None
+
+
+    def dwell_converged(self, accumulator, rows_read):
+        """
+        Adaptive dwell check, True once the block in accumulator has at least
+        options_dict["dwell_min_samples"] rows and the standard error of its 
+        amplitude is at most options_dict["dwell_target_error"] degrees. The
+        stop command is then sent so the Arduino ends the block early, the 
+        rows it already sent are dropped by the next write_data.
+
+        The rows skipped are counted in self.metrics ("dwell_samples_saved").
+        """
+        if self.options_dict["adaptive_dwell"] == False:
+            return False
+        if accumulator.converged(self.options_dict["dwell_min_samples"],
+                                 10*self.options_dict["dwell_target_error"]) == False:
+            return False
+
+        self.reset_instrument()
+        self.metrics.count("dwell_early_stops")
+        self.metrics.count("dwell_samples_saved", max(self.sample_size - rows_read, 0))
+        return True
+
+
+    def record_read(self, records, n_bytes, elapsed):
+        """Adds a read block to self.throughput and self.metrics"""
+        self.throughput.add(records, n_bytes, elapsed)
+        self.metrics.count("bytes_read", n_bytes)
+        self.metrics.gauge("serial_bytes_per_s", self.throughput.last_bytes_per_s)
+        self.metrics.gauge("serial_records_per_s", self.throughput.last_records_per_s)
+
+
+    def read_data_buffered(self):
+        """Buffered version of read_data. Pulls whatever is waiting on the port
+        in chunks of up to options_dict["read_chunk_size"] bytes and splits the
+        chunks into records in one pass, rather than calling read_until once 
+        per sample.
+
+        Reading stops once sample_size records have been collected, or when a
+        read returns nothing within the serial timeout (the Arduino has 
+        stopped sending). A partial line left when the port goes quiet is 
+        dropped, data_filter would reject it anyway.
+
+        Returns:
+            data_list: a list of comma delimited strings in the same format as
+                read_data, including the line terminator
+                ["113,12030548658,163,24.1,23.9\r\n", ...]
+        """
+        chunk_size = self.options_dict["read_chunk_size"]
+        accumulator = self.block_accumulator()
+
+        read_start = time.perf_counter()
+        n_bytes = 0
+        data_list = []
+        partial = b""
+        while len(data_list) < self.sample_size:
+            # Blocks for up to the read timeout when nothing is waiting
+            waiting = self.serial.in_waiting
+            chunk = self.serial.read(min(max(waiting, 1), chunk_size))
+            if len(chunk) == 0:
+                break
+            n_bytes += len(chunk)
+
+            # Splitting complete lines off the buffer, the remainder is kept
+            # until the next chunk completes it
+            complete, newline, partial = (partial + chunk).rpartition(b"\n")
+            if newline:
+                decoded = complete.decode("ascii", errors = "replace")
+                lines = decoded.split("\n")
+                if accumulator != None:
+                    accumulator.extend_lines(lines[:self.sample_size - len(data_list)])
+                data_list.extend(line + "\n" for line in lines)
+                if accumulator != None and self.dwell_converged(accumulator, len(data_list)):
+                    break
+
+        # Arduino may have sent more than a block, extra lines are discarded
+        # (write_data resets the input buffer before the next frequency)
+        del data_list[self.sample_size:]
+        self.stream_fit = accumulator
+
+        self.record_read(len(data_list), n_bytes, time.perf_counter() - read_start)
 
         return data_list
 
@@ -246,14 +2370,7 @@ class Jiggler():
         """Sends a frequency value of 1, the Arduino firmware uses all frequency 
         values less than 50 as stop commands"""
 
-        self.serial = serial.Serial(
-            self.serial_dict["port"], self.serial_dict["baudrate"],
-            self.serial_dict["bytesize"], self.serial_dict["parity"], 
-            self.serial_dict["stopbits"], self.serial_dict["timeout"],
-            self.serial_dict["xonxoff"], self.serial_dict["rtscts"],
-            self.serial_dict["write_timeout"], self.serial_dict["dsrdtr"],
-            self.serial_dict["inter_byte_timeout"], self.serial_dict["exclusive"]
-                            )
+        self.connect()
 
         stop_byte = str(2).encode()
         self.serial.write(stop_byte)
@@ -261,6 +2378,46 @@ class Jiggler():
         self.reset_instrument()
 
 
+    def connect(self):
+        """Returns the open port of self.session, creating the session the first
+        time it is needed. Also stores the port as self.serial."""
+        if self.session == None:
+            self.session = SerialSession(self.serial_dict)
+        self.serial = self.session.connect(self.frequency_byte_list[0])
+        return self.serial
+
+
+    def close(self):
+        """Closes the serial session, the next sweep will reopen it"""
+        if self.session != None:
+            self.session.close()
+        self.serial = None
+
+
+    def dump_metrics(self):
+        """Appends a snapshot of self.metrics to options_dict["metrics_file"],
+        if one is set"""
+        if self.options_dict["metrics_file"] == None:
+            return
+        try:
+            self.metrics.dump(self.options_dict["metrics_file"], self.options_dict["metrics_file_max_bytes"],
+                              self.options_dict["metrics_file_backups"], loop_count = self.loop_count)
+        except OSError as e:
+            error = f"WRITING METRICS to {self.options_dict['metrics_file']} FAILED ({e})"
+            print(error)
+            self.error_log.append(error)
+
+
+    def stop_render_service(self, timeout = 30):
+        """Waits for the background render process to finish its queued
+        figures and shuts it down, see RenderService.stop()"""
+        if self.render_service != None:
+            self.render_service.stop(timeout)
+            for title, error in self.render_service.errors:
+                self.error_log.append(f"RENDERING FIGURE {title} FAILED: {error}")
+            self.render_service.errors = []
+
+
     def frequency_steps(self):
         """Uses numpy.linspace to create a linear spacing of frequency values the
         instrument will sample"""\
@@ -298,188 +2455,518 @@ class Jiggler():
         return freq_byte_list
 
 
+    @timed("data_parser")
+    def data_parser(self, data_block):
+        """
+        Vectorized replacement for the per-row checks of data_filter. Parses a
+        whole frequency block in one regex pass and converts the accepted rows
+        with NumPy.
+
+        A row is accepted IF
+        1.) It has exactly 5 comma delimited entries
+        2.) The first entry (freq) is a float, and not an int, in str format
+        3.) The 2nd and 3rd entries (micros, angle) are integers in str format
+        4.) The 4th and 5th entries (temp1, temp2) are floats in str format
+
+        Parameters:
+            data_block: either the raw bytes of a block (as read from the serial
+                port) or a list of strings as returned by read_data
+
+        Returns:
+            data: structured array of dtype ROW_DTYPE holding the accepted rows
+                with fields "freq", "micros", "angle", "temp1", "temp2"
+            rejected: boolean array, one entry per row of data_block, True for
+                rows which failed filtering
+            bad_count: number of rejected rows
+        """
+        if len(data_block) == 0:
+            return np.empty(0, dtype = ROW_DTYPE), np.zeros(0, dtype = bool), 0
+
+        # Joining the block into a single string with one row per line
+        if isinstance(data_block, (bytes, bytearray)):
+            text = bytes(data_block).decode("ascii", errors = "replace")
+            if text.endswith("\n"):
+                text = text[:-1]
+        elif isinstance(data_block, str):
+            text = data_block[:-1] if data_block.endswith("\n") else data_block
+        else:
+            text = "\n".join(map(str.rstrip, data_block))
+
+        # One entry per row, empty strings for rejected rows
+        rows = ROW_PATTERN.findall(text)
+        rejected = np.fromiter(map(len, rows), dtype = np.int64, count = len(rows)) == 0
+        bad_count = int(rejected.sum())
+        self.metrics.count("rows", len(rows))
+        self.metrics.count("bad_rows", bad_count)
+
+        # Converting all accepted rows in a single call
+        values = np.fromstring(",".join(filter(None, rows)), sep = ",").reshape(-1, 5)
+        data = np.empty(len(values), dtype = ROW_DTYPE)
+        for i, name in enumerate(ROW_DTYPE.names):
+            data[name] = values[:, i]
+
+        # Provides printed warning for bad rows.
+        if bad_count > 0:
+            freq = data["freq"][0] if len(data) > 0 else "(no valid rows)"
+            print(f"For loop {self.loop_count} Frequency {freq} had {bad_count} rows removed for failing data filtering")
+
+        return data, rejected, bad_count
+
+
     def data_filter(self, data_string_list):
         """
         Stupid Over the top data logic filter. Only allows data rows through IF
-        1.) They have exactly 3 comma delimited entries
+        1.) They have exactly 5 comma delimited entries
         2.) The first entry is a float in str format
         3.) the 2nd and 3rd entries are integers in str format
+        4.) the 4th and 5th entries are floats in str format
+
+        The checks are done by data_parser(), this function keeps the old list
+        output for code that still uses it.
         
         Parameters:
         -sweep_data: list of comma delimited strings of the form 
-                    ["freq(float), time(int), deflection(int)"]
+                    ["freq(float), time(int), deflection(int), temp1(float), temp2(float)"]
 
         Returns:
-        -sweep_data_clean: Returns a split list of length 3 of the form
-                    [freq, time, deflection] where the entries are in the format 
-                    [float, int, int] Also removes all entries which fail to fit the
-                    desired format.
+        -sweep_data_clean: Returns a split list of length 5 of the form
+                    [freq, time, deflection, temp1, temp2] where the entries are
+                    in the format [float, int, int, float, float] Also removes 
+                    all entries which fail to fit the desired format.
+        -bad_count: number of rows removed
         """
+        data, rejected, bad_count = self.data_parser(data_string_list)
+        data_clean = [list(row) for row in data.tolist()]
 
-        # bad data counter, counts the number of bad samples
-        bad_count = 0
-        data_clean = []
-        for i, data in enumerate(data_string_list):
-            split_row = data.split(',')
-
-            # Checks if the row split into a list with 3 components
-            if len(split_row) != 5: #changed from 3 to 5 to allow for the temperature data
-                # print(f"for row {i} we have {split_row} which is not of length 3")
-                bad_count += 1
-                continue
+        return data_clean, bad_count
 
-            # Checks if the first component of the list is a string representation of a float
-            try:
-                int(split_row[0])
-                bad_count += 1
-                continue
-                # print(f"Error Frequency value in row {i} of {data} is not a float")
-            except:
-                pass
-            try:
-                split_row[0] = float(split_row[0])
-            except:
-                # print(f"Error Frequency value in row {i} of {data} is not an float")
-                bad_count +=1
-                continue
 
-            # Checks if the time component of the list is a string representation of an int
-            try:
-                split_row[1] = int(split_row[1])
-            except:
-                # print(f"Error Time value in row {i} of {data} is not an int!")
-                bad_count += 1
+    #---------------------------------------------------------------------------
+    # Composite Functions (Functions composed of basic functions or of greater
+    #                       complexity)
+    def linear_sweep(self):
+        """Samples the frequency values at the points determined by the start,
+        stop, and step values.
+        
+        The function writes the values to the Jiggler, reads the returned samples
+        storing them as lists of strings, then stores each list of strings as a
+        list of lists of data
+        
+        I.E [sample_1_data, sample_2_data, sample_3_data,...] where each sample
+        is a list of strings of the length of the sample size"""
+
+        sweep_data = self.sample_frequencies(self.frequency_byte_list)
+
+        return sweep_data
+
+
+    def raw_block(self, data_list):
+        """Returns data_list as it is kept in self.sweep_data, joined into one
+        ascii bytes object when options_dict["compact_raw_blocks"] is True 
+        (data_parser reads either form)"""
+        if self.options_dict["compact_raw_blocks"] == True:
+            return "".join(data_list).encode("ascii", errors = "replace")
+        return data_list
+
+
+    def sample_frequencies(self, freq_byte_list):
+        """Writes each frequency in freq_byte_list to the Jiggler and reads back
+        its samples. Returns a list with one list of strings per frequency."""
+
+        # Initializing the list of data lists
+        sweep_data = []
+
+        # Iterating through each frequency we wish to sample for
+        for freq_byte in freq_byte_list:
+            self.write_data(freq_byte)
+            data_list = self.read_data()
+
+            # When data_list == none then there was a float conversion error,
+            # Currently the code skips to the next frequency and logs an error.
+            if data_list == None:
                 continue
             
-            # Checks if the angular deflection value is a string representation of an int
-            try:
-                split_row[2] = int(split_row[2])
-            except:
-                # print(f"Error Ang Deflection value in row {i} of {data} is not an int!") 
-                bad_count += 1
-                continue
+            # Disabled for looping, stability is now high enough that this is spam
+            if self.options_dict["silent"] == False:
+                 print(f"Freq {freq_byte} data collected")
 
-            try:
-                split_row[3] = float(split_row[3]) # Check for temp1
-            except:
-                # print(f"Error Time value in row {i} of {data} is not a float!")
-                bad_count += 1
-                continue
 
-            try:
-                split_row[4] = float(split_row[4]) # Check for temp2
-            except:
-                # print(f"Error Time value in row {i} of {data} is not a float!")
-                bad_count += 1
-                continue
-            
-            # Appending cleaned rows to data list
-            data_clean.append(split_row)
+            # Appending each data set to a list of data_sets
+            sweep_data.append(self.raw_block(data_list))
+            self.sweep_data = sweep_data
+
+        return sweep_data
+
+
+    def adaptive_sweep(self, coarse_step = None, refine_width = None):
+        """
+        Coarse-to-fine alternative to linear_sweep. Only the points near the 
+        resonance matter for the curve fits, so instead of dwelling on every 
+        point of self.frequency_range this
+        1.) samples every coarse_step Hz across the frequency interval
+        2.) finds the frequency with the largest sin fit amplitude
+        3.) samples every point of self.frequency_range within refine_width/2
+            of that peak which was not already sampled in the coarse pass
+
+        All frequencies are taken from self.frequency_range, so the result is
+        a subset of the linear sweep sorted by frequency. Outside the 
+        refinement window the spacing is coarse_step instead of step_size.
+        The fine points are returned as raw blocks like linear_sweep, the 
+        coarse points as the FrequencyBlocks they were formatted into to find
+        the peak, which data_formatter() takes as they are.
+
+        Parameters:
+            coarse_step = defaults to options_dict["coarse_step"]
+            refine_width = defaults to options_dict["refine_width"]
+        """
+        if coarse_step == None:
+            coarse_step = self.options_dict["coarse_step"]
+        if refine_width == None:
+            refine_width = self.options_dict["refine_width"]
+
+        # Coarse pass on every n-th point of the frequency range, always 
+        # including both ends of the interval
+        stride = max(1, int(round(coarse_step/self.step_size)))
+        coarse_ind = list(range(0, len(self.frequency_range), stride))
+        if coarse_ind[-1] != len(self.frequency_range) - 1:
+            coarse_ind.append(len(self.frequency_range) - 1)
+
+        coarse_data = self.sample_frequencies([self.frequency_byte_list[i] for i in coarse_ind])
+
+        # Locating the peak of the coarse pass. The coarse blocks are kept 
+        # formatted (None where every row failed) and data_formatter passes 
+        # them through, so they are only parsed once
+        coarse_blocks = [self.block_formatter(data_list) for data_list in coarse_data]
+        formatted_data = [block for block in coarse_blocks if block is not None]
+        if len(formatted_data) == 0:
+            self.sweep_data = formatted_data
+            return formatted_data
+        A_fit, phase, rms = self.Batched_Sin_fit([data[1] for data in formatted_data],
+                                                 [data[2] for data in formatted_data],
+                                                 [data[0] for data in formatted_data])
+        peak_freq = formatted_data[int(np.nanargmax(A_fit))][0]
+
+        # Fine pass over the points of the window which haven't been sampled
+        in_window = np.abs(self.frequency_range - peak_freq) <= refine_width/2 + self.step_size/1E3
+        fine_ind = [i for i in np.flatnonzero(in_window) if i not in coarse_ind]
+
+        if self.options_dict["silent"] == False:
+            print(f"Coarse peak at {peak_freq:.2f} Hz, refining {len(fine_ind)} points")
+
+        fine_data = self.sample_frequencies([self.frequency_byte_list[i] for i in fine_ind])
+
+        # Merging both passes in order of frequency. Blocks dropped by 
+        # sample_frequencies are not expected, but would misalign the indices
+        if len(coarse_blocks) == len(coarse_ind) and len(fine_data) == len(fine_ind):
+            order = np.argsort(coarse_ind + fine_ind, kind = "stable")
+            sweep_data = [(coarse_blocks + fine_data)[i] for i in order]
+        else:
+            sweep_data = coarse_blocks + fine_data
+        sweep_data = [data for data in sweep_data if data is not None]
+
+        self.sweep_data = sweep_data
+
+        return sweep_data
+
+
+    def tracking_sweep(self):
+        """
+        Resonance tracking alternative to linear_sweep. Samples only the points
+        of self.frequency_range within tracking_width/2 of self.tracking_center,
+        which update_tracking_window() moves to the last accepted resonant 
+        frequency after every sweep. The full interval is swept while no 
+        resonance has been found yet. A window has no tails off the peak, so 
+        sweep_fits() Lorentz fits it with the background of the last full 
+        sweep (self.lorentz_background).
+        """
+        sweep_data = self.sample_frequencies(self.tracking_byte_list())
+
+        return sweep_data
+
+
+    def tracking_byte_list(self):
+        """Encoded frequencies of the current tracking window"""
+        return [self.frequency_byte_list[i] for i in self.tracking_window()]
+
+
+    def tracking_window(self):
+        """Returns the indices of self.frequency_range inside the current 
+        tracking window (at least 5 points, all points if there is no window)"""
+        if self.tracking_center == None or self.tracking_width == None:
+            return np.arange(len(self.frequency_range))
+
+        distance = np.abs(self.frequency_range - self.tracking_center)
+        window_ind = np.flatnonzero(distance <= self.tracking_width/2 + self.step_size/1E3)
+        if len(window_ind) < 5:
+            window_ind = np.sort(np.argsort(distance, kind = "stable")[:5])
+
+        return window_ind
 
-        # Provides printed warning for bad rows.
-        if bad_count > 0:
-            print(f"For loop {self.loop_count} Frequency {data_clean[0][0]} had {bad_count} rows removed for failing data filtering")
-        return data_clean, bad_count  # EB added else statement
 
+    def update_tracking_window(self, A_sol_list):
+        """
+        Moves the tracking window after a sweep. On success the window is 
+        centered on the new resonant frequency (parabolic fit, else lorentz fit,
+        else the amplitude peak when both fits are off) and reset to
+        options_dict["tracking_width"]. The window is doubled when
+        1.) a fit was performed but failed or landed outside the window
+        2.) the amplitude peak is at the edge of the window (the resonance is 
+            moving out of it), in which case it is also recentered on that edge
+        """
+        frequency = A_sol_list[0]
+        full_width = self.frequency_range[-1] - self.frequency_range[0]
+        width = self.tracking_width if self.tracking_width != None else full_width
+
+        if len(frequency) == 0:
+            self.tracking_width = min(2*width, full_width)
+            return
+
+        peak_ind = int(np.nanargmax(A_sol_list[1]))
+        peak_freq = frequency[peak_ind]
+
+        # Most recent resonant frequency of this sweep
+        res_freq = None
+        if self.options_dict["parabolic_fit"] == True and len(self.parabolic_res_freq) > 0:
+            res_freq = self.parabolic_res_freq[-1]
+        if res_freq == None and self.options_dict["lorentz_fit"] == True and len(self.lorentz_res_freq) > 0:
+            res_freq = self.lorentz_res_freq[-1]
+        if self.options_dict["parabolic_fit"] == False and self.options_dict["lorentz_fit"] == False:
+            res_freq = peak_freq
+
+        at_edge = ((peak_ind == 0 and frequency[0] > self.frequency_range[0]) or
+                   (peak_ind == len(frequency) - 1 and frequency[-1] < self.frequency_range[-1]))
+        in_window = res_freq != None and frequency[0] <= res_freq <= frequency[-1]
+
+        if at_edge == True or in_window == False:
+            self.tracking_width = min(2*width, full_width)
+            if at_edge == True or self.tracking_center == None:
+                self.tracking_center = peak_freq
+            error = f"Resonance lost for loop {self.loop_count}, tracking window widened to {self.tracking_width:.2f} Hz around {self.tracking_center:.2f} Hz"
+            print(error)
+            self.error_log.append(error)
+        else:
+            self.tracking_center = res_freq
+            self.tracking_width = self.options_dict["tracking_width"]
 
-    #---------------------------------------------------------------------------
-    # Composite Functions (Functions composed of basic functions or of greater
-    #                       complexity)
-    def linear_sweep(self):
-        """Samples the frequency values at the points determined by the start,
-        stop, and step values.
-        
-        The function writes the values to the Jiggler, reads the returned samples
-        storing them as lists of strings, then stores each list of strings as a
-        list of lists of data
-        
-        I.E [sample_1_data, sample_2_data, sample_3_data,...] where each sample
-        is a list of strings of the length of the sample size"""
 
-        # Initializing the list of data lists
-        sweep_data = []
+    def pipelined_sweep(self, freq_byte_list = None, queue_size = None):
+        """
+        Sweep where acquisition and processing overlap. A reader thread owns 
+        the serial port and writes/reads each frequency in turn, handing the 
+        raw block over a bounded queue to the worker (the calling thread), 
+        which formats and fits each block while the next one is acquired. The
+        only work left once the last block lands is that block's own fit.
 
-        # Iterating through each frequency we wish to sample for
-        for freq_byte in self.frequency_byte_list:
-            self.write_data(freq_byte)
-            data_list = self.read_data()
+        Queue depth and per-stage latency are stored in self.pipeline_stats.
 
-            # When data_list == none then there was a float conversion error,
-            # Currently the code skips to the next frequency and logs an error.
-            if data_list == None:
-                continue
-            
-            # Disabled for looping, stability is now high enough that this is spam
-            if self.options_dict["silent"] == False:
-                 print(f"Freq {freq_byte} data collected")
+        Parameters:
+            freq_byte_list = encoded frequencies to sweep, defaults to 
+                self.frequency_byte_list
+            queue_size = defaults to options_dict["pipeline_queue_size"]
 
+        Returns:
+            A_sol_list in the same format as Amplitude_solver(), which is also
+            stored in self.solution_list. self.sweep_data and 
+            self.formatted_data are filled in as for a linear sweep.
+        """
+        if freq_byte_list == None:
+            freq_byte_list = self.frequency_byte_list
+        if queue_size == None:
+            queue_size = self.options_dict["pipeline_queue_size"]
+
+        stats = PipelineStats(queue_size)
+        self.pipeline_stats = stats
+        block_queue = queue.Queue(maxsize = queue_size)
+        stop = threading.Event()
+        reader_errors = []
+
+        def reader():
+            try:
+                for freq_byte in freq_byte_list:
+                    if stop.is_set():
+                        break
+                    read_start = time.perf_counter()
+                    self.write_data(freq_byte)
+                    data_list = self.read_data()
+                    read_end = time.perf_counter()
+                    stats.read_latency.append(read_end - read_start)
+
+                    block_queue.put((data_list, read_end, self.stream_fit))
+                    stats.queue_depth.append(block_queue.qsize())
+
+                    if self.options_dict["silent"] == False:
+                        print(f"Freq {freq_byte} data collected")
+            except Exception as e:
+                reader_errors.append(e)
+            finally:
+                block_queue.put(None)
+
+        reader_thread = threading.Thread(target = reader, name = "Jiggler reader", daemon = True)
+        reader_thread.start()
 
-            # Appending each data set to a list of data_sets
-            sweep_data.append(data_list)
-            self.sweep_data = sweep_data
+        sweep_data = []
+        formatted_data = []
+        block_solutions = []
+        last_read_end = time.perf_counter()
+        try:
+            while True:
+                item = block_queue.get()
+                if item == None:
+                    break
+                data_list, last_read_end, stream_fit = item
+                process_start = time.perf_counter()
+                stats.queue_wait.append(process_start - last_read_end)
+
+                sweep_data.append(self.raw_block(data_list))
+                self.sweep_data = sweep_data
+
+                data = self.block_formatter(data_list)
+                if data != None:
+                    formatted_data.append(data)
+                    block_solutions.append(self.block_amplitudes(data, stream_fit))
+
+                stats.process_latency.append(time.perf_counter() - process_start)
+        finally:
+            # Letting the reader finish if the worker stopped early
+            stop.set()
+            while reader_thread.is_alive():
+                try:
+                    block_queue.get(timeout = 0.1)
+                except queue.Empty:
+                    pass
+            reader_thread.join()
+
+        if len(reader_errors) > 0:
+            raise reader_errors[0]
+
+        # Assembling the solution arrays in the Amplitude_solver format
+        A_sol_list = SweepResult.from_block_solutions(block_solutions)
+
+        self.formatted_data = formatted_data
+        self.solution_list = A_sol_list
+        self.sin_fit_phase = A_sol_list.phase
+        self.sin_fit_rms = A_sol_list.rms
+        stats.tail_latency = time.perf_counter() - last_read_end
 
-        return sweep_data
+        return A_sol_list
 
 
-    def data_importer(self, input_directory = None):
+    def data_importer(self, input_directory = None, workers = None):
         """
         Imports all csv files found in the input_directory folder and exports their 
         data as a list of lists.
 
+        Files are parsed by a pool of worker processes, and with 
+        options_dict["import_cache"] = True the parsed data is cached in the
+        output directory (see import_cache_file) so unchanged files are only
+        parsed once. The input directory is only read.
+
         Parameters:
             input_directory = a filepath where the files to import are found.
-            output_directory = desired output folder path. 
+            workers = number of worker processes, defaults to 
+                      options_dict["import_workers"] (None = one per CPU)
 
         Returns:
             A_sol_list = a list of sublists where each sublist is of the 
                                 format returned by A_solver
             fnames = a alphanumerically sorted list of filenames
+
+        The same data is stored stacked as self.imported_array, a 
+        (n_sweeps, 6, n_freq) array padded with NaN where sweeps have fewer 
+        frequencies, with the frequency count of each sweep in 
+        self.imported_counts. The A_sol_lists are views of this array.
         """
-        # Resetting self.midsample_times for import
+        # Resetting self.midsample_times and self.import_times for import
         self.midsample_times = []
+        self.import_times = []
 
         # Defaults to the value in the options_dict if no input directory is specified
         if input_directory == None:
             input_directory = self.options_dict["input_directory"]
 
+        if workers == None:
+            workers = self.options_dict["import_workers"] or os.cpu_count() or 1
+
         # Retrieving all .csv filenames and sorting them
-        fnames = sorted(glob.glob(input_directory + '\*.csv'))
+        fnames = sorted(glob.glob(os.path.join(input_directory, '*.csv')))
+
+        # Taking unchanged files from the cache
+        cache = None
+        if self.options_dict["import_cache"] == True:
+            cache = ImportCache(self.import_cache_file(input_directory))
+
+        arrays = []
+        keys = []
+        missing = []
+        for i, fname in enumerate(fnames):
+            keys.append(ImportCache.key(fname))
+            arrays.append(cache.get(fname, keys[-1]) if cache != None else None)
+            if arrays[-1] is None:
+                missing.append(i)
+
+        # Parsing the rest, the pool is only worth starting for a few files per worker
+        missing_fnames = [fnames[i] for i in missing]
+        if workers > 1 and len(missing) >= 4*workers:
+            with ProcessPoolExecutor(workers) as pool:
+                parsed = list(pool.map(_read_sweep_array, missing_fnames,
+                                       chunksize = max(1, len(missing)//(4*workers))))
+        else:
+            parsed = [_read_sweep_array(fname) for fname in missing_fnames]
 
-        # Iterating through each file and collecting the start times and solution data
-        midsample_times_list = []
-        A_sol_list_list = []
-        for fname in fnames:
-            print(f"Importing file {os.path.basename(fname)}")
+        for i, array in zip(missing, parsed):
+            arrays[i] = array
+            if cache != None:
+                cache.put(fnames[i], keys[i], array)
+        if cache != None:
+            cache.save(fnames)
 
-            # Parsing sample_start time from filename and appending to a list
+        print(f"Imported {len(fnames)} files from {input_directory} "
+              f"({len(missing)} parsed, {len(fnames) - len(missing)} from cache)")
+
+        # Parsing sample_start time from filenames (see midsample_names)
+        for fname in fnames:
             base_name = os.path.basename(fname)
-            midsample_times = base_name[:base_name.find(".")]
-            midsample_times_list.append(midsample_times)
+            midsample_times = os.path.splitext(base_name)[0]
             self.midsample_times.append(midsample_times)
 
             # The import_times list is padded with Nones to follow the self.times_list format
             self.import_times.append([None, midsample_times, None])
 
-            # Reading in data using pandas
-            df = pd.read_csv(fname, index_col = 0)
-            df_T = df.T
-            formatted_df = df_T.rename(columns = {0 : "Frequency", 1 : "A_fit", 2 : "A_avg", 3 : "A_max", 4: "Temp1_avg", 5: "Temp2_avg"})
+        self.set_imported_data(arrays)
+        if len(arrays) > 0:
+            self.export_df = pd.DataFrame(arrays[-1][:4].T, columns = IMPORT_COLUMNS[:4])
+
+        return self.imported_data, self.import_times
+
+
+    def set_imported_data(self, arrays):
+        """Stores a list of (6, n_freq) sweep arrays as self.imported_array and 
+        self.imported_counts, and in self.imported_data as SweepResults 
+        viewing self.imported_array"""
+        self.imported_array, self.imported_counts = _stack_sweeps(arrays)
+        self.imported_data = [SweepResult(sweep[:, :count]) for sweep, count in
+                              zip(self.imported_array, self.imported_counts)]
 
-            # converting columns into arrays
-            freq_array = formatted_df["Frequency"].values
-            A_fit_array = formatted_df["A_fit"].values
-            A_avg_array = formatted_df["A_avg"].values
-            A_max_array = formatted_df["A_max"].values
-            temp1_array = formatted_df["Temp1_avg"].values
-            temp2_array = formatted_df["Temp2_avg"].values
 
-            # Storing arrays as a list in the style of the original data generation
-            A_sol_list = [freq_array, A_fit_array, A_avg_array, A_max_array, temp1_array, temp2_array]
-            A_sol_list_list.append(A_sol_list)
+    def store_importer(self, start = None, end = None, path = None):
+        """
+        Imports the sweeps with start <= mid-sample time <= end from a RunStore,
+        returning them in the same format as data_importer() so the results 
+        can be passed to import_plotter(). start and end are datetimes or 
+        '%Y_%m_%d %H_%M_%S' strings, None leaves that end of the range open.
+
+        path defaults to the store quick_plot writes to (see open_run_store).
+        """
+        store = self.open_run_store() if path == None else RunStore(path)
+        times, A_sol_list_list = store.read(start, end)
 
-        self.imported_data = A_sol_list_list
-        self.export_df = formatted_df.iloc[:, 0:4]
+        self.midsample_times = []
+        self.import_times = []
+        for midsample_time in midsample_names(times):
+            self.midsample_times.append(midsample_time)
+            self.import_times.append([None, midsample_time, None])
 
+        self.set_imported_data([np.array(A_sol_list) for A_sol_list in A_sol_list_list])
         return self.imported_data, self.import_times
 
         """
@@ -490,114 +2977,159 @@ class Jiggler():
     """
 
 
-    def data_formatter(self, sweep_data = None):
+    @timed("data_formatter")
+    def data_formatter(self, sweep_data = None, return_bad_count = False):
+        """Formats every block of sweep_data with block_formatter(), returns 
+        the list of FrequencyBlocks (and with return_bad_count = True the 
+        number of rows removed by filtering)"""
 
         # If no data is manually supplied uses data stored in the class
         if sweep_data == None:
             sweep_data = self.sweep_data
 
         formatted_data = []
+        bad_count = 0
         for data_list in sweep_data:
+            # Blocks which were already formatted (adaptive_sweep)
+            if isinstance(data_list, FrequencyBlock):
+                data = data_list
+            else:
+                data, block_bad_count = self.block_formatter(data_list, return_bad_count = True)
+                bad_count += block_bad_count
 
-            # Filtering bad data
-            clean_data_list, bad_count = self.data_filter(data_list)
-
-            # Initializing dummy list
-            data = []
-            # Retrieving Values and converting to float/arrays
-            freq_value = float(clean_data_list[0][0])
+            # Skipping blocks where every row failed filtering
+            if data == None:
+                continue
 
-            # Retrieving Time converting to 64 bit integers
-            time_raw = (np.array([row[1] for row in clean_data_list]).astype('int64'))
-            time_vals = time_raw / 1E6 # Unit conversion to seconds
-            """
-            NOTE V1.01 and earlier contains a script for handling MICROS overflows.
-            If the microcontroller firmware is updated no to longer reset between samples
-            you will need to re-institute the code below)
-            """
-            # time_raw = np.array([row[1] for row in clean_data_list]).astype('int64')
-            # if time_raw[-1] < time_raw[0]:
-            #     min = time_raw.min()
-            #     min_ind = np.where(time_raw == min)
-            #     time_final = time_raw[min_ind[0][0]:]+ARDUINO_MICROS_OVERFLOW_VAL
-            #     time_vals = np.concatenate((time_raw[:min_ind[0][0]], time_final))
-            #     time_vals = time_vals /1E6
-            # else:
-            #     time_vals = time_raw / 1E6
-
-            # Retrieving Angle Values
-            angle_vals = np.array([row[2] for row in clean_data_list]).astype(float)
-
-            #Retrieving temp values of RTD#1
-            temp_vals1 = np.array([row[3] for row in clean_data_list]).astype(float)
-
-            #Retrieving temp values from RTD#2
-            temp_vals2 = np.array([row[4] for row in clean_data_list]).astype(float)
-
-            data.append(freq_value), data.append(time_vals), data.append(angle_vals), data.append(temp_vals1), data.append(temp_vals2)
             formatted_data.append(data)
 
             # Saving current iteration of formatted data as a class property
             self.formatted_data = formatted_data
 
+        if return_bad_count == True:
+            return formatted_data, bad_count
         return formatted_data
 
 
+    def block_formatter(self, data_list, return_bad_count = False):
+        """Filters and formats the data of a single frequency, returns a 
+        FrequencyBlock (which also reads as [freq, time_vals, angle_vals, 
+        temp_vals1, temp_vals2]) or None when every row failed filtering. With
+        return_bad_count = True also returns the number of rows removed by 
+        filtering."""
+
+        # Filtering bad data
+        block, rejected, bad_count = self.data_parser(data_list)
+
+        # Skipping blocks where every row failed filtering
+        if len(block) == 0:
+            error = f"For loop {self.loop_count} a frequency block had no valid rows and was skipped"
+            print(error)
+            self.error_log.append(error)
+            return (None, bad_count) if return_bad_count == True else None
+
+        # Retrieving Values and converting to float/arrays
+        freq_value = float(block["freq"][0])
+
+        # Retrieving Time as 64 bit integers
+        time_vals = block["micros"] / 1E6 # Unit conversion to seconds
+        """
+        NOTE V1.01 and earlier contains a script for handling MICROS overflows.
+        If the microcontroller firmware is updated no to longer reset between samples
+        you will need to re-institute the code below)
+        """
+        # time_raw = np.array([row[1] for row in clean_data_list]).astype('int64')
+        # if time_raw[-1] < time_raw[0]:
+        #     min = time_raw.min()
+        #     min_ind = np.where(time_raw == min)
+        #     time_final = time_raw[min_ind[0][0]:]+ARDUINO_MICROS_OVERFLOW_VAL
+        #     time_vals = np.concatenate((time_raw[:min_ind[0][0]], time_final))
+        #     time_vals = time_vals /1E6
+        # else:
+        #     time_vals = time_raw / 1E6
+
+        # Retrieving Angle Values
+        angle_vals = block["angle"].astype(float)
+
+        #Retrieving temp values of RTD#1 and RTD#2 (views of the parsed rows)
+        data = FrequencyBlock(freq_value, time_vals, angle_vals, block["temp1"], block["temp2"])
+
+        # Dropping the settling transient
+        if self.options_dict["trim_settling"] == True:
+            start, settling_time, settled = self.settling_index(time_vals, angle_vals, freq_value)
+            if settled == False:
+                # Still settling at the half block cap, trimmed up to the cap
+                self.metrics.count("unsettled_blocks")
+            self.settling_times.append([freq_value, settling_time, start])
+            self.metrics.observe("settling_time", settling_time)
+            data = data.trimmed(start)
+
+        if return_bad_count == True:
+            return data, bad_count
+        return data
+
+
+    def block_amplitudes(self, data, stream_fit = None):
+        """Applies the amplitude and temperature functions to the formatted data
+        of a single frequency. Returns [freq, A_fit, A_avg, A_max, temp1_avg, 
+        temp2_avg, phase, rms] with amplitudes in tenths of a degree.
+        
+        stream_fit = SinFitAccumulator of the block filled in while reading, 
+            used instead of refitting when it holds the same samples"""
+        freq_value, time_vals, angle_vals, temp1_vals, temp2_vals = data
+
+        if (stream_fit != None and stream_fit.frequency == freq_value and 
+                stream_fit.n == len(time_vals)):
+            A_fit, phase, rms = stream_fit.solve()
+        else:
+            A_fit, phase, rms = (value[0] for value in 
+                                 self.Batched_Sin_fit([time_vals], [angle_vals], [freq_value]))
+
+        return [freq_value, A_fit, self.Average_Amplitude(angle_vals),
+                self.Amplitude_max(angle_vals), self.Average_Temp(temp1_vals),
+                self.Average_Temp(temp2_vals), phase, rms]
+
+
+    @timed("Amplitude_solver")
     def Amplitude_solver(self, formatted_data = None):
         """Takes the data from formatted data, and applies all three methods for 
-        calculating Amplitude"""
+        calculating Amplitude. formatted_data is a list of FrequencyBlocks (or
+        [freq, time_vals, angle_vals, temp1, temp2] lists).
+        
+        Returns a SweepResult, which also reads as the A_sol_list
+        [freq, A_fit, A_avg, A_max, temp1, temp2]"""
 
         # If no data is manually supplied to functions uses data stored in class
         # property from the most recent data_formatter call
         if formatted_data == None:
             formatted_data = self.formatted_data
 
-        # Initializing data lists
-        freq_list = []
-        A_fit_list = []
-        A_avg_list = []
-        A_max_list = []
-        temp1_avg_list = []
-        temp2_avg_list = []
-    
-        for data in formatted_data:
-            # Slicing data from data list
-            freq_value = data[0]
-            time_vals = data[1]
-            angle_vals = data[2]
-            temp1_vals = data[3]
-            temp2_vals = data[4]
-
-            # Applying Amplitude solving functions
-            A_fit = self.Nicks_Sin_fit(time_vals, angle_vals, freq_value)
-            A_avg = self.Average_Amplitude(angle_vals)
-            A_max = self.Amplitude_max(angle_vals)
-            temp1_avg = self.Average_Temp(temp1_vals)
-            temp2_avg = self.Average_Temp(temp2_vals)
-
-
-            # Saving solutions into new lists
-            freq_list.append(freq_value)
-            A_fit_list.append(A_fit)
-            A_avg_list.append(A_avg)
-            A_max_list.append(A_max)
-            temp1_avg_list.append(temp1_avg)
-            temp2_avg_list.append(temp2_avg)
-
-
-        # Converting solution lists to arrays, converting angle units to degrees 
-        # rather than tenths of a degree
-        freq_array = np.array(freq_list)
-        A_fit_array = np.array(A_fit_list)/10
-        A_avg_array = np.array(A_avg_list)/10
-        A_max_array = np.array(A_max_list)/10
-        temp1_array = np.array(temp1_avg_list)
-        temp2_array = np.array(temp2_avg_list)
-        
-       
-        
+        formatted_data = [data if isinstance(data, FrequencyBlock) else FrequencyBlock(*data)
+                          for data in formatted_data]
+
+        # Solutions are written straight into the rows of one (6, n_freq) 
+        # array, see SweepResult
+        values = np.empty((6, len(formatted_data)))
+        for i, data in enumerate(formatted_data):
+            # Applying Amplitude solving functions (the sin fit is done for
+            # all frequencies at once below)
+            values[0, i] = data.freq
+            values[2, i] = self.Average_Amplitude(data.angle)
+            values[3, i] = self.Amplitude_max(data.angle)
+            values[4, i] = self.Average_Temp(data.temp1)
+            values[5, i] = self.Average_Temp(data.temp2)
+
+        # Batched sin fit of every frequency in the sweep
+        values[1], self.sin_fit_phase, self.sin_fit_rms = self.Batched_Sin_fit(
+                                        [data.time for data in formatted_data],
+                                        [data.angle for data in formatted_data],
+                                        values[0])
+
+        # Converting angle units to degrees rather than tenths of a degree
+        values[1:4] /= 10
+
         # Returning Solution arrays as a single solution list
-        A_sol_list = [freq_array, A_fit_array, A_avg_array, A_max_array, temp1_array, temp2_array]
+        A_sol_list = SweepResult(values, self.sin_fit_phase, self.sin_fit_rms)
 
         # Saving A_Sol_list to object properties
         self.solution_list = A_sol_list
@@ -610,14 +3142,16 @@ class Jiggler():
     """Primary Operation Functions:"""
     #    Functions which perform an entire common operation of the instrument
     #    Typically with mostly default settings
+    @timed("Jiggler_sweep")
     def Jiggler_sweep(self):
         """
         This function performs a linearly spaced sweep of the frequency range
         given during initialization for the step size given during initialization.
 
         It is a composition of the functions:
-        reset_instrument()
+        connect()
         linear_sweep()
+        reset_instrument()
         data_formatter()
         Amplitude_solver()
         polyfit()
@@ -635,67 +3169,224 @@ class Jiggler():
             start_time = start time of the sweep in '%Y_%m_%d %H_%M_%S' format
             end_time = end time of the sweep in '%Y_%m_%d %H_%M_%S' format
         """
-        # Intializing serial.Serial object with parameters from self.serial_dict
-        self.serial = serial.Serial(
-                    self.serial_dict["port"], self.serial_dict["baudrate"],
-                    self.serial_dict["bytesize"], self.serial_dict["parity"], 
-                    self.serial_dict["stopbits"], self.serial_dict["timeout"],
-                    self.serial_dict["xonxoff"], self.serial_dict["rtscts"],
-                    self.serial_dict["write_timeout"], self.serial_dict["dsrdtr"],
-                    self.serial_dict["inter_byte_timeout"], self.serial_dict["exclusive"]
-                                    )
-
-        # Delay to give the Arduino time to initialize
-        time.sleep(2)
+        # Reusing the open serial session, it is only (re)opened the first time
+        # or after a failure, in which case connect() waits for the Arduino
+        self.connect()
+        self.settling_times = []
 
         # Storing start time of sweep
         start_time = datetime.today()
 
-        """Perform Initial linear sweep of the frequency range"""
-        sweep_data = self.linear_sweep()
+        """Perform Initial linear (or tracking/adaptive) sweep of the frequency range"""
+        pipelined = (self.options_dict["pipelined_sweep"] == True and 
+                     self.options_dict["adaptive_sweep"] == False)
+        if pipelined == True:
+            # Data is formatted and fit during the sweep
+            if self.options_dict["tracking_sweep"] == True:
+                sweep = lambda: self.pipelined_sweep(self.tracking_byte_list())
+            else:
+                sweep = self.pipelined_sweep
+        elif self.options_dict["tracking_sweep"] == True:
+            sweep = self.tracking_sweep
+        elif self.options_dict["adaptive_sweep"] == True:
+            sweep = self.adaptive_sweep
+        else:
+            sweep = self.linear_sweep
+
+        try:
+            sweep_data = sweep()
+        except (serial.SerialException, OSError) as e:
+            # Reconnecting and repeating the sweep once
+            error = f"Serial error during sweep ({e}), reconnecting"
+            print(error)
+            self.error_log.append(error)
+            self.serial = self.session.reconnect(self.frequency_byte_list[0])
+            start_time = datetime.today()
+            sweep_data = sweep()
 
         # Storing end time of sweep
         end_time = datetime.today()
 
-        # Time at midpoint of sample
-        mid_time = (start_time + (start_time-end_time)/2).strftime('%Y_%m_%d %H_%M_%S')
-
         # Sending reset command to Arduino
-        time.sleep(1.5)
         self.reset_instrument()
 
-        """Formatting Collected Data"""
-        formatted_data = self.data_formatter(sweep_data)
+        if pipelined == True:
+            A_sol_list = sweep_data
+        else:
+            """Formatting Collected Data"""
+            formatted_data = self.data_formatter(sweep_data)
+
+            """Calculating Amplitude values from measured data"""
+            A_sol_list = self.Amplitude_solver(formatted_data)
 
-        """Calculating Amplitude values from measured data"""
-        A_sol_list = self.Amplitude_solver(formatted_data)
+        return self.finish_sweep(A_sol_list, start_time, end_time)
+
+
+    def finish_sweep(self, A_sol_list, start_time, end_time):
+        """
+        Steps which follow every sweep once its amplitudes are known, shared by
+        Jiggler_sweep, iter_sweep and the JigglerDriver: the curve fits, moving
+        the tracking window and adding [start_time, mid_time, end_time] to 
+        self.time_list. Returns that time_list entry.
+        """
+        # Time at midpoint of sample
+        mid_time = (start_time + (end_time - start_time)/2).strftime('%Y_%m_%d %H_%M_%S')
 
         """Curve fits"""
+        self.sweep_fits(A_sol_list, mid_time)
+
+        # Moving the tracking window for the next sweep
+        if self.options_dict["tracking_sweep"] == True:
+            self.update_tracking_window(A_sol_list)
+
+        # Adding start and end time to the list
+        self.time_list.append([start_time, mid_time, end_time])
+        return self.time_list[-1]
+
+
+    def sweep_summary(self, n_records, bad_count):
+        """SweepSummary of the last sweep finished by finish_sweep()"""
+        start_time, mid_time, end_time = self.time_list[-1]
+        parabolic_res_freq = self.parabolic_res_freq[-1] if self.options_dict["parabolic_fit"] == True else None
+        lorentz_res_freq = self.lorentz_res_freq[-1] if self.options_dict["lorentz_fit"] == True else None
+        return SweepSummary(self.solution_list, start_time, mid_time, end_time, parabolic_res_freq,
+                            lorentz_res_freq, n_records, bad_count)
+
+
+    def finish_loop_sweep(self):
+        """Per-sweep steps of the loops (Jiggler_loop, fixed_rate_loop and the 
+        JigglerDriver) after finish_sweep(): saving the midpoint time, 
+        plotting and exporting, the metrics file and the history"""
+        self.midsample_times.append(self.time_list[-1][1])
+        self.quick_plot()
+        self.dump_metrics()
+        self.record_history()
+
+
+    def sweep_fits(self, A_sol_list, mid_time):
+        """Applies the curve fits enabled in options_dict to a sweep, appending
+        the resonant frequencies (None for failed fits) to 
+        self.parabolic_res_freq and self.lorentz_res_freq"""
         if self.options_dict["parabolic_fit"] == True:
-            self.parabolic_fit_params = self.parabolic_fit(A_sol_list)
+            self.parabolic_fit_params = self.parabolic_fit(A_sol_list, 
+                                        peak_width = self.options_dict["parabolic_peak_width"])
 
             # Filtering out failed fits
             if (self.parabolic_fit_params[0] < 200) and ((self.parabolic_fit_params[0] > 50)):
                 self.parabolic_res_freq.append(self.parabolic_fit_params[0])
             else:
                 self.parabolic_res_freq.append(None)
+                self.metrics.count("parabolic_fit_failures")
                 print(f"Parabolic_fit_failed for data {mid_time}")
 
         if self.options_dict["lorentz_fit"] == True:
-            self.lorentz_fit_params = self.lorentz_fit(A_sol_list)
+            # A tracking window is mostly peak, so it is fit against the 
+            # background of the last full sweep instead of its own tails
+            background = None
+            full_span = self.frequency_range[-1] - self.frequency_range[0]
+            if len(A_sol_list[0]) > 0 and A_sol_list[0][-1] - A_sol_list[0][0] < full_span - self.step_size/2:
+                background = self.lorentz_background
+            self.lorentz_fit_params = self.lorentz_fit(A_sol_list, **self.lorentz_parameters(),
+                                        warm_start = self.options_dict["lorentz_warm_start"],
+                                        background = background)
             # Filtering out failed fits
             if (self.lorentz_fit_params[0] < 200) and ((self.lorentz_fit_params[0] > 50)):
                 self.lorentz_res_freq.append(self.lorentz_fit_params[0])
             else:
                 self.lorentz_res_freq.append(None)
+                self.metrics.count("lorentz_fit_failures")
                 print(f"Lorentz_fit_failed for data {mid_time}")
 
 
-        # Adding start and end time to the list
-        self.time_list.append([start_time, mid_time, end_time])
-        time_list = self.time_list[-1]
+    def iter_sweep(self, freq_byte_list = None):
+        """
+        Generator version of Jiggler_sweep. Each frequency block is written, 
+        read, filtered and fitted in turn and yielded as an immutable 
+        FrequencyRecord as soon as it is done, so live views can update during
+        the sweep. Once every frequency has been read the sweep is fitted as in
+        Jiggler_sweep and a SweepSummary is yielded last.
+
+        Closing the generator early (eg. breaking out of the for loop, or 
+        calling .close()) sends the reset command and ends the sweep without 
+        fitting it or touching the sweep attributes.
+
+        On completion self.solution_list, self.formatted_data, the resonance 
+        lists and self.time_list are updated as by Jiggler_sweep, so 
+        quick_plot() can follow as usual. Adaptive sweeps, which need the 
+        coarse pass before choosing frequencies, are not supported.
+
+        Usage:
+            for record in Jig.iter_sweep():
+                if isinstance(record, SweepSummary):
+                    ...
+                else:
+                    print(record.freq, record.A_fit)
+
+        Parameters:
+            freq_byte_list = encoded frequencies to sweep, defaults to the 
+                tracking window when options_dict["tracking_sweep"] is set and
+                to self.frequency_byte_list otherwise
+        """
+        if freq_byte_list == None:
+            if self.options_dict["tracking_sweep"] == True:
+                freq_byte_list = self.tracking_byte_list()
+            else:
+                freq_byte_list = self.frequency_byte_list
+
+        self.connect()
+        self.settling_times = []
+        start_time = datetime.today()
+
+        formatted_data = []
+        block_solutions = []
+        total_bad = 0
+        try:
+            for freq_byte in freq_byte_list:
+                block_start = datetime.today()
+                try:
+                    self.write_data(freq_byte)
+                    data_list = self.read_data()
+                except (serial.SerialException, OSError) as e:
+                    # Reconnecting and repeating this frequency once
+                    error = f"Serial error during sweep ({e}), reconnecting"
+                    print(error)
+                    self.error_log.append(error)
+                    self.serial = self.session.reconnect(self.frequency_byte_list[0])
+                    self.write_data(freq_byte)
+                    data_list = self.read_data()
+                stream_fit = self.stream_fit
+
+                # Float conversion error, skipping to the next frequency
+                if data_list == None:
+                    continue
+
+                data, bad_count = self.block_formatter(data_list, return_bad_count = True)
+                total_bad += bad_count
+                if data == None:
+                    continue
+                solution = self.block_amplitudes(data, stream_fit)
+                formatted_data.append(data)
+                block_solutions.append(solution)
+
+                freq_value, A_fit, A_avg, A_max, temp1, temp2, phase, rms = map(float, solution)
+                yield FrequencyRecord(len(block_solutions) - 1, freq_value, A_fit/10, A_avg/10,
+                                      A_max/10, temp1, temp2, phase, rms, len(data[1]),
+                                      bad_count, block_start, datetime.today())
+        finally:
+            # Stopping the Arduino, also when the consumer stopped early
+            self.reset_instrument()
 
-        return time_list
+        end_time = datetime.today()
+
+        # Assembling the solution arrays in the Amplitude_solver format
+        A_sol_list = SweepResult.from_block_solutions(block_solutions)
+        self.formatted_data = formatted_data
+        self.solution_list = A_sol_list
+        self.sin_fit_phase = A_sol_list.phase
+        self.sin_fit_rms = A_sol_list.rms
+
+        self.finish_sweep(A_sol_list, start_time, end_time)
+        yield self.sweep_summary(len(block_solutions), total_bad)
 
 
     def Jiggler_loop(self, duration, time_between_samples = 240):
@@ -703,6 +3394,17 @@ class Jiggler():
         range storing the resonant frequency each sweep and producing a graph 
         and .csv file with the data after each measurement. This function is 
         essentially a loop of the Jiggler_sweep() functions.
+
+        With options_dict["tracking_sweep"] = True each sweep after the first 
+        only covers a window around the previous resonant frequency.
+
+        With options_dict["background_render"] = True the figures are rendered
+        by a RenderService process while the loop carries on, the loop waits 
+        for the last figures once it completes, or stops it if the loop is 
+        interrupted.
+
+        With options_dict["fixed_rate_loop"] = True the sweeps start every
+        time_between_samples seconds instead, see fixed_rate_loop().
         
         Parameters:
             duration = length of time the instrument will be in operation
@@ -713,35 +3415,105 @@ class Jiggler():
                                 list of the accumulated resosnant frequency values
             """
 
+        if self.options_dict["fixed_rate_loop"] == True:
+            return self.fixed_rate_loop(duration, time_between_samples)
+
         # Start and stop times for the timer
         start = time.time()
         stop = time.time()
 
         self.midsample_times = []
-        # Looping until the duration is reached
-        while ((stop - start) <= duration):
-            
-            # Increasing loop counter
-            self.loop_count += 1
+        # The render service is stopped however the loop ends (eg. Ctrl+C)
+        try:
+            # Looping until the duration is reached
+            while ((stop - start) <= duration):
+                
+                # Increasing loop counter
+                self.loop_count += 1
+
+                # Sweeping, saving midpoint times and plotting
+                time_list = self.Jiggler_sweep()
+                self.finish_loop_sweep()
+
+                # Resting
+                time.sleep(time_between_samples)
+                stop = time.time()
+        finally:
+            self.stop_render_service()
+        print(f"Loop Complete at {stop}")
 
-            # Sweeping
-            time_list = self.Jiggler_sweep()
 
-            # Saving Midpoint times
-            self.midsample_times.append(self.time_list[-1][1])
+    def fixed_rate_loop(self, duration, period = 240, skip_missed = None, align = None):
+        """
+        Jiggler_loop on a fixed cadence, a sweep (and its plot) starts every
+        period seconds for duration seconds, whatever the sweeps take. The 
+        wait before each slot is worked out from a monotonic clock, so time
+        spent sweeping and plotting is subtracted and the slots do not drift.
 
-            # plotting
-            self.quick_plot()
+        A sweep that is still running when the next slot is due is an overrun
+        and is logged to self.error_log. With skip_missed = True the loop then
+        waits for the next slot which has not started yet, otherwise the next
+        sweep starts straight away (and is late).
 
-            # Resting
-            time.sleep(time_between_samples)
-            stop = time.time()
+        Parameters:
+            duration = length of time the instrument will be in operation
+            period = time between the starts of two sweeps in seconds
+            skip_missed = defaults to options_dict["skip_missed_slots"]
+            align = True starts the slots on multiples of period of the wall 
+                    clock, defaults to options_dict["align_loop_to_clock"]
+
+        Every sweep is recorded in self.schedule_log as a dictionary of
+            slot = slot number counted from the start of the loop
+            scheduled, started = scheduled and actual start (datetimes)
+            late = started - scheduled in seconds
+            work = time the sweep and plot took in seconds
+            overrun = True if the sweep ran into the next slot
+            skipped = number of slots skipped after this sweep
+        """
+        if skip_missed == None:
+            skip_missed = self.options_dict["skip_missed_slots"]
+        if align == None:
+            align = self.options_dict["align_loop_to_clock"]
 
-        print(f"Loop Complete at {stop}")
+        schedule = FixedRateSchedule(period, skip_missed, align)
+        self.midsample_times = []
+        self.schedule_log = []
+        try:
+            while schedule.due(duration):
+                time.sleep(schedule.wait())
+
+                # Increasing loop counter
+                self.loop_count += 1
+                schedule.start()
+
+                # Sweeping, saving midpoint times and plotting
+                self.Jiggler_sweep()
+                self.finish_loop_sweep()
+
+                self.finish_slot(schedule)
+        finally:
+            self.stop_render_service()
+        print(f"Loop Complete at {time.time()}")
+
+
+    def finish_slot(self, schedule, name = None):
+        """Ends the current slot of a FixedRateSchedule, adding its record to
+        self.schedule_log and logging overruns to self.error_log. name 
+        prefixes the message (eg. the instrument name of a JigglerDriver)."""
+        record = schedule.finish()
+        self.schedule_log.append(record)
+        if record["overrun"] == True:
+            prefix = f"{name} " if name != None else ""
+            error = (f"{prefix}SWEEP {self.loop_count} OVERRAN its {schedule.period} s slot by "
+                     f"{record['late'] + record['work'] - schedule.period:.1f} s")
+            print(error)
+            self.error_log.append(error)
+        return record
 
 
     #---------------------------------------------------------------------------
     """Exporting Functions"""
+    @timed("quick_plot")
     def quick_plot(self, A_sol_list = None, time_list = None, x_lims = None, y_lims = None, export = None):
         """
         Plots the data returned by Jiggler_sweep() as an amplitude vs frequency 
@@ -763,7 +3535,9 @@ class Jiggler():
 
         Returns:
             Exported figures of the data, and the calculated amplitudes to the 
-            output folder.
+            output folder. With options_dict["background_render"] = True the 
+            figure is only queued for self.render_service and written shortly
+            afterwards (or dropped if the render process falls behind).
 
         """
         
@@ -776,17 +3550,6 @@ class Jiggler():
         if export == None:
             export = self.options_dict["export_data"]
 
-        # Creating figure and axis objects
-        fig, ax = plt.subplots()
-
-        """Plotting Amplitude data"""
-        if self.options_dict["A_fit"] == True:
-            plt.plot(A_sol_list[0], A_sol_list[1], '.b', label = "Sin Fit")
-        if self.options_dict["A_avg"] == True:
-            plt.plot(A_sol_list[0], A_sol_list[2], '.k', label = "Adjusted Average")
-        if self.options_dict["A_max"] == True:
-            plt.plot(A_sol_list[0], A_sol_list[3], '.g', label = "Amax")
-
         """Plotting curve fits"""
         # if self.options_dict["parabolic_fit"] == True:
         #     # Plotting Parabolic cap
@@ -825,37 +3588,21 @@ class Jiggler():
         #                     length_includes_head = True, head_starts_at_zero = True, zorder = 11)
 
 
-        # Configuring dynamic Labels
-        plt.xlabel("Frequency (Hz)")
-        plt.ylabel("Amplitude (degrees)")
-        plt.title(f"{time_list[1]}")
-        plt.grid(True)
-        plt.legend(loc="upper left")
-
-        # Setting x and y limits (This is a disaster clean this up!)
-        if x_lims == None: # Checking if local xlim variable is none
+        # Setting x and y limits, local limits take priority over the 
+        # options_dict ones and the x axis falls back on the frequency range
+        if x_lims == None:
             x_lims = self.options_dict["x_lims"]
-            if x_lims != None: # Checking if global dict variable is none
-                plt.xlim(x_lims[0], x_lims[1])
-            else: # if both are none use freq range
+            if x_lims == None:
                 x_lims = [self.frequency_range[0], self.frequency_range[-1]]
-                plt.xlim(x_lims[0], x_lims[1])
-        else: # if local is not none plot local
-            plt.xlim(x_lims[0], x_lims[1])
 
         if y_lims == None:
             y_lims = self.options_dict["y_lims"]
-            if y_lims != None:
-                plt.ylim(y_lims[0], y_lims[1])
-        else:
-            plt.ylim(y_lims[0], y_lims[1])
 
 
         """Saving Figure"""
+        data_path = self.options_dict["output_directory"] + r"\data"
+        fig_path = self.options_dict["output_directory"] + r"\figures"
         if self.options_dict["export_figure"] == True:
-            data_path = self.options_dict["output_directory"] + r"\data"
-            fig_path = self.options_dict["output_directory"] + r"\figures"
-
             # Checking if output folder exists, if not, a new folder is created
             if os.path.exists(self.options_dict["output_directory"]) == False:
                 os.mkdir(self.options_dict["output_directory"])
@@ -866,16 +3613,23 @@ class Jiggler():
             if os.path.exists(fig_path) == False:
                 os.mkdir(fig_path)
 
-            # Exporting Figure with desired filename
-            plt.savefig(f"{fig_path}\\{time_list[1]}.pdf")
-
-        # Clearing Figure from memory
-        plt.close("all")
-        plt.clf()
+            # Exporting Figure with desired filename, either here or in the
+            # background render process
+            fig_file = self.figure_file(time_list[1])
+            curves = {"A_fit" : self.options_dict["A_fit"], "A_avg" : self.options_dict["A_avg"],
+                      "A_max" : self.options_dict["A_max"]}
+            if self.options_dict["background_render"] == True:
+                if self.render_service == None:
+                    self.render_service = RenderService(self.options_dict["render_queue_size"])
+                self.render_service.submit(A_sol_list, time_list[1], fig_file, x_lims, y_lims, **curves)
+                status = "QUEUED"
+            else:
+                render_sweep_figure(A_sol_list, time_list[1], fig_file, x_lims, y_lims, **curves)
+                status = "GENERATED"
 
-        # Printing Completion statement
-        if self.options_dict["silent"] == False:
-            print(f"\n\n !!!   GRAPH GENERATED for file {time_list[1]} !!! \n\n")
+            # Printing Completion statement
+            if self.options_dict["silent"] == False:
+                print(f"\n\n !!!   GRAPH {status} for file {time_list[1]} !!! \n\n")
 
         # Exporting Column Format dataframe with Pfit data
         if self.options_dict["Sweep_Column_DF_export"] == True:
@@ -908,8 +3662,122 @@ class Jiggler():
 
         # Exporting data and saving figure
         if export == True:
-            df = pd.DataFrame(self.solution_list)
-            df.to_csv(f"{data_path}\{time_list[1]}.csv")
+            if self.options_dict["export_format"] == "store":
+                self.store_sweep(A_sol_list, time_list)
+            else:
+                start = time.perf_counter()
+                df = pd.DataFrame(self.solution_list)
+                df.to_csv(f"{data_path}\{time_list[1]}.csv")
+                self.metrics.observe("csv_export", time.perf_counter() - start)
+
+
+    def figure_file(self, name):
+        """Path of the figure quick_plot saves for the sweep called name"""
+        return self.options_dict["output_directory"] + f"\\figures\\{name}.pdf"
+
+
+    def open_run_store(self):
+        """Returns self.run_store, opening the RunStore in 
+        output_directory/run_store the first time"""
+        if self.run_store == None:
+            self.run_store = RunStore(os.path.join(self.options_dict["output_directory"], "run_store"))
+        return self.run_store
+
+
+    def open_history(self):
+        """Returns self.history, creating the RingBuffer of HISTORY_DTYPE 
+        records (spilling to output_directory/history/sweeps.bin) the first
+        time. A spill file of an earlier version is converted first."""
+        if self.history == None:
+            history_directory = os.path.join(self.options_dict["output_directory"], "history")
+            spill_file = os.path.join(history_directory, "sweeps.bin")
+            _upgrade_time_records(spill_file, HISTORY_DTYPE, ["mid_time"],
+                                  os.path.join(history_directory, "version"), HISTORY_VERSION)
+            self.history = RingBuffer(HISTORY_DTYPE, self.options_dict["history_window"], spill_file)
+        return self.history
+
+
+    def sweep_mid_time(self, time_list):
+        """Mid-sample time of a time_list entry [start_time, mid_time, end_time]
+        as a datetime to the millisecond, the mid_time string only has whole
+        seconds. Entries without start and end times (imports) fall back on
+        the string."""
+        start_time, mid_time, end_time = time_list
+        if start_time != None and end_time != None:
+            return start_time + (end_time - start_time)/2
+        return mid_time
+
+
+    def record_history(self):
+        """
+        Called by the loops after each sweep when options_dict["history_window"]
+        is set. Appends the sweep to self.history and cuts the per-sweep lists
+        down to the last history_window entries, error_log entries cut are 
+        appended to output_directory/history/error_log.txt first.
+        """
+        window = self.options_dict["history_window"]
+        if window == None:
+            return
+        history = self.open_history()
+
+        start_time, mid_time, end_time = self.time_list[-1]
+        mid_time = self.sweep_mid_time(self.time_list[-1])
+        def last(values, enabled):
+            value = values[-1] if enabled == True and len(values) > 0 else None
+            return np.nan if value == None else float(value)
+        temps = [float(np.mean(values)) if len(values) > 0 else np.nan 
+                 for values in self.solution_list[4:6]] if len(self.solution_list) >= 6 else [np.nan, np.nan]
+        history.append((self.loop_count, np.datetime64(start_time, "ms"), _to_datetime64(mid_time),
+                        np.datetime64(end_time, "ms"),
+                        last(self.parabolic_res_freq, self.options_dict["parabolic_fit"]),
+                        last(self.lorentz_res_freq, self.options_dict["lorentz_fit"]),
+                        last(self.res_freq_amp, self.options_dict["parabolic_fit"]), *temps))
+
+        if len(self.error_log) > window:
+            with open(os.path.join(os.path.dirname(history.spill_file), "error_log.txt"), "a") as f:
+                f.writelines(f"{error}\n" for error in self.error_log[:-window])
+            del self.error_log[:-window]
+        for values in [self.time_list, self.midsample_times, self.parabolic_res_freq,
+                       self.lorentz_res_freq, self.res_freq_amp, self.schedule_log]:
+            del values[:-window]
+
+
+    def history_frame(self):
+        """Every sweep recorded in self.history (including the spilled ones)
+        as a DataFrame"""
+        return pd.DataFrame(self.open_history().to_array())
+
+
+    @timed("store_export")
+    def store_sweep(self, A_sol_list = None, time_list = None):
+        """
+        Appends a sweep to the run store along with the latest parabolic and
+        Lorentz fit results (failed fits are stored as NaN). Defaults to the 
+        last sweep and its time_list entry [start_time, mid_time, end_time].
+        The sweep is stored at the midpoint of start_time and end_time, to 
+        the millisecond, or at the mid_time string when they are None.
+        """
+        if A_sol_list == None:
+            A_sol_list = self.solution_list
+        if time_list == None:
+            time_list = self.time_list[-1]
+
+        mid_time = self.sweep_mid_time(time_list)
+
+        parabolic_res_freq = None
+        res_amp = None
+        if self.options_dict["parabolic_fit"] == True and len(self.parabolic_fit_params) > 0:
+            if 50 < self.parabolic_fit_params[0] < 200:
+                parabolic_res_freq = self.parabolic_fit_params[0]
+                res_amp = self.res_freq_amp[-1]
+
+        lorentz_res_freq = None
+        if self.options_dict["lorentz_fit"] == True and len(self.lorentz_fit_params) > 0:
+            if 50 < self.lorentz_fit_params[0] < 200:
+                lorentz_res_freq = self.lorentz_fit_params[0]
+
+        return self.open_run_store().append(mid_time, A_sol_list, parabolic_res_freq,
+                                            lorentz_res_freq, res_amp)
     
     # def Average_Temp(self, temp):
     #     """
@@ -924,53 +3792,228 @@ class Jiggler():
         This function takes the output from data_importer and uses the imported
         data to dynamically generate graphs.
 
+        The fit results come from fit_sweep(), so with options_dict["fit_cache"]
+        = True only new or changed sweeps are refit, and their figures are 
+        only redrawn when they changed or do not exist yet. The resonance 
+        lists (parabolic_res_freq, lorentz_res_freq, res_freq_amp, temp1, 
+        temp2) are rebuilt on every call, so calling it again gives the same
+        result.
+
         You can change the settings by changing the options in Jiggler.options_dict
         """
         # Checking for manual data input, if no data is given uses the data stored
         # in Jiggler.imported_data from the last call of Jiggler.data_importer()
-        if imported_data_list == None:
+        if imported_data_list is None:
             imported_data_list = self.imported_data
         
         if midpoint_time_list == None:
             midpoint_time_list = self.import_times
 
+        # Starting the resonance time series from scratch
+        self.parabolic_res_freq = []
+        self.lorentz_res_freq = []
+        self.res_freq_amp = []
+        self.temp1 = []
+        self.temp2 = []
+
+        # Fitting all new sweeps at once, the loop below then finds them cached
+        batch_fit = set()
+        if self.options_dict["fit_cache"] == True and self.options_dict["Sweep_Column_DF_export"] == False:
+            batch_fit = self.batch_fit_sweeps(imported_data_list)
+
         # Iterating through each imported amplitude data
-        resonant_frequency_list = []
+        refit_count = 0
         for i, A_sol_list in enumerate(imported_data_list):
-            # Calculating Step size for dynamic Parabolic fit
-            step_size = A_sol_list[0][1] - A_sol_list[0][0] 
+            fit, cached = self.fit_sweep(A_sol_list)
+            if cached == True and len(batch_fit) > 0 and self.fit_key(A_sol_list) in batch_fit:
+                cached = False
+            refit_count += (cached == False)
 
-            # Applying Parabolic Curve Fit
             if self.options_dict["parabolic_fit"] == True:
-                self.parabolic_fit_params = self.parabolic_fit(A_sol_list,
-                                                 step_size = step_size)
-                # Filtering bad data
-                if (self.parabolic_fit_params[0] < 200) and ((self.parabolic_fit_params[0] > 50)):
-                    # Storing resonant frequency found by parabolic fit
-                    self.parabolic_res_freq.append(self.parabolic_fit_params[0])
-                else:
-                    self.parabolic_res_freq.append(None)
-
-            # Applying Lorentzian Curve Fit
+                self.parabolic_res_freq.append(fit["parabolic_res_freq"])
+                self.res_freq_amp.append(fit["res_amp"])
             if self.options_dict["lorentz_fit"] == True:
-                self.lorentz_fit_params = self.lorentz_fit(A_sol_list)
+                self.lorentz_res_freq.append(fit["lorentz_res_freq"])
 
-                # Filtering bad data
-                if (self.lorentz_fit_params[0] < 200) and ((self.lorentz_fit_params[0] > 50)):
-                    # Storing resonant frequency found by Lorentz fit
-                    self.lorentz_res_freq.append(self.lorentz_fit_params[0])
-                else:
-                    self.lorentz_res_freq.append(None)
+            # Figures of unchanged sweeps are only drawn if they are missing
+            if cached == False or os.path.exists(self.figure_file(midpoint_time_list[i][1])) == False:
+                self.quick_plot(A_sol_list = A_sol_list, time_list = midpoint_time_list[i], 
+                                x_lims = [A_sol_list[0][0], A_sol_list[0][-1]], 
+                                y_lims = self.options_dict["y_lims"], export = False)
+            self.temp1.append(fit["temp1"])
+            self.temp2.append(fit["temp2"])
 
-            self.quick_plot(A_sol_list = A_sol_list, time_list = midpoint_time_list[i], 
-                            x_lims = [A_sol_list[0][0], A_sol_list[0][-1]], 
-                            y_lims = self.options_dict["y_lims"], export = False)
-            self.temp1.append(self.Average_Temp(A_sol_list[4]))
-            self.temp2.append(self.Average_Temp(A_sol_list[5]))
+        self.save_fit_cache()
+        print(f"Fit {len(imported_data_list)} sweeps ({refit_count} refit, "
+              f"{len(imported_data_list) - refit_count} from cache)")
 
         self.resonance_exporter()
 
 
+    def lorentz_parameters(self):
+        """Keyword arguments of lorentz_fit() set in options_dict"""
+        return {"start_tail" : self.options_dict["lorentz_start_tail"],
+                "end_tail" : self.options_dict["lorentz_end_tail"]}
+
+
+    def fit_key(self, A_sol_list):
+        """fit_cache key of a sweep: its content hash, FIT_CACHE_VERSION and a
+        hash of the enabled fits and the parameters which change their results
+        (fit_sweep and batch_fit_sweeps never warm start)"""
+        names = ["parabolic_fit", "lorentz_fit", "parabolic_peak_width", "lorentz_start_tail",
+                 "lorentz_end_tail"]
+        fits = json.dumps({name : self.options_dict[name] for name in names}, sort_keys = True)
+        fits_hash = hashlib.sha1(fits.encode()).hexdigest()[:12]
+        return f"{sweep_hash(A_sol_list)}-v{FIT_CACHE_VERSION}-{fits_hash}"
+
+
+    def batch_fit_sweeps(self, A_sol_lists, workers = None):
+        """
+        Fits every sweep of A_sol_lists which is not in self.fit_cache yet, 
+        using batch_parabolic_fit() and batch_lorentz_fit() (over workers 
+        processes, default options_dict["fit_workers"]), and stores the 
+        results in the cache in the format of fit_sweep(). Returns the set of
+        fit_cache keys that were fit.
+        """
+        if self.fit_cache == None:
+            self.load_fit_cache()
+        if workers == None:
+            workers = self.options_dict["fit_workers"]
+
+        # Sweeps which are not cached yet, each only once
+        new = {}
+        for A_sol_list in A_sol_lists:
+            key = self.fit_key(A_sol_list)
+            if key not in self.fit_cache:
+                new.setdefault(key, A_sol_list)
+        if len(new) == 0:
+            return set()
+
+        stacked, counts = _stack_sweeps([np.array(A_sol_list, dtype = float) for A_sol_list in new.values()])
+        frequency, amplitudes = stacked[:, 0], stacked[:, 1]
+        with np.errstate(invalid = "ignore"):
+            temp1 = np.nanmean(stacked[:, 4], axis = 1)
+            temp2 = np.nanmean(stacked[:, 5], axis = 1)
+
+        fits = {}
+        if self.options_dict["parabolic_fit"] == True:
+            fits["parabolic"] = batch_parabolic_fit(frequency, amplitudes,
+                                                    peak_width = self.options_dict["parabolic_peak_width"])
+        if self.options_dict["lorentz_fit"] == True:
+            fits["lorentz"] = batch_lorentz_fit(frequency, amplitudes, workers = workers,
+                                                start_tail = self.options_dict["lorentz_start_tail"],
+                                                end_tail = self.options_dict["lorentz_end_tail"])
+
+        def accepted(res_freq):
+            # Filtering bad data as the single sweep fits do
+            return float(res_freq) if 50 < res_freq < 200 else None
+
+        for i, key in enumerate(new):
+            fit = {"parabolic_res_freq" : None, "res_amp" : None, "lorentz_res_freq" : None,
+                   "temp1" : float(temp1[i]), "temp2" : float(temp2[i])}
+            if "parabolic" in fits:
+                fit["parabolic_res_freq"] = accepted(fits["parabolic"]["res_freq"][i])
+                res_amp = fits["parabolic"]["res_amp"][i]
+                fit["res_amp"] = float(res_amp) if np.isfinite(res_amp) else None
+            if "lorentz" in fits:
+                fit["lorentz_res_freq"] = accepted(fits["lorentz"]["res_freq"][i])
+            self.fit_cache[key] = fit
+
+        return set(new)
+
+
+    def fit_cache_file(self):
+        return os.path.join(self.options_dict["output_directory"], ".jiggler_fit_cache.json")
+
+
+    def import_cache_file(self, input_directory):
+        """ImportCache file of input_directory, kept in the output directory
+        (the raw data folder may be read only or shared) and named after a 
+        hash of the folder's absolute path"""
+        source = os.path.normcase(os.path.abspath(input_directory))
+        name = os.path.basename(source.rstrip("\\/")) or "root"
+        source_hash = hashlib.sha1(source.encode()).hexdigest()[:12]
+        return os.path.join(self.options_dict["output_directory"], "import_cache",
+                            f"{name}-{source_hash}.npz")
+
+
+    def fit_sweep(self, A_sol_list):
+        """
+        Parabolic and Lorentz fits of one imported sweep, returns 
+        (fit, cached) where fit is a dictionary of the resonant frequencies 
+        found by the enabled fits (None if failed or disabled), the parabolic 
+        peak amplitude and the average temperatures.
+
+        Results are memoized in self.fit_cache, keyed by sweep_hash() and the 
+        enabled fits, and cached is True when the fits did not have to run.
+        When a fit runs its full result is also stored in 
+        self.parabolic_fit_params / self.lorentz_fit_params as before.
+        """
+        fits = (self.options_dict["parabolic_fit"], self.options_dict["lorentz_fit"])
+        key = self.fit_key(A_sol_list)
+
+        if self.options_dict["fit_cache"] == True:
+            if self.fit_cache == None:
+                self.load_fit_cache()
+            # The column export needs the full parabolic fit of every sweep
+            if key in self.fit_cache and self.options_dict["Sweep_Column_DF_export"] == False:
+                return self.fit_cache[key], True
+
+        fit = {"parabolic_res_freq" : None, "res_amp" : None, "lorentz_res_freq" : None,
+               "temp1" : float(self.Average_Temp(A_sol_list[4])),
+               "temp2" : float(self.Average_Temp(A_sol_list[5]))}
+
+        # Applying Parabolic Curve Fit
+        if fits[0] == True:
+            # Calculating Step size for dynamic Parabolic fit
+            step_size = A_sol_list[0][1] - A_sol_list[0][0] 
+            self.parabolic_fit_params = self.parabolic_fit(A_sol_list, step_size = step_size,
+                                        peak_width = self.options_dict["parabolic_peak_width"])
+            fit["res_amp"] = float(self.res_freq_amp.pop())
+
+            # Filtering bad data
+            if (self.parabolic_fit_params[0] < 200) and ((self.parabolic_fit_params[0] > 50)):
+                fit["parabolic_res_freq"] = float(self.parabolic_fit_params[0])
+
+        # Applying Lorentzian Curve Fit
+        if fits[1] == True:
+            self.lorentz_fit_params = self.lorentz_fit(A_sol_list, **self.lorentz_parameters())
+
+            # Filtering bad data
+            if (self.lorentz_fit_params[0] < 200) and ((self.lorentz_fit_params[0] > 50)):
+                fit["lorentz_res_freq"] = float(self.lorentz_fit_params[0])
+
+        if self.options_dict["fit_cache"] == True:
+            self.fit_cache[key] = fit
+        return fit, False
+
+
+    def load_fit_cache(self):
+        """Loads the fit results saved in the output directory into self.fit_cache"""
+        self.fit_cache = {}
+        if os.path.exists(self.fit_cache_file()):
+            try:
+                with open(self.fit_cache_file()) as f:
+                    self.fit_cache = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"Ignoring unreadable fit cache {self.fit_cache_file()} ({e})")
+        return self.fit_cache
+
+
+    def save_fit_cache(self):
+        """Writes self.fit_cache to the output directory"""
+        if self.options_dict["fit_cache"] == False or self.fit_cache == None:
+            return
+        os.makedirs(self.options_dict["output_directory"], exist_ok = True)
+        temp_file = self.fit_cache_file() + ".tmp"
+        try:
+            with open(temp_file, "w") as f:
+                json.dump(self.fit_cache, f)
+            os.replace(temp_file, self.fit_cache_file())
+        except OSError as e:
+            print(f"Could not save fit cache {self.fit_cache_file()} ({e})")
+
+
     def resonance_exporter(self):
         # Making a list of res_freq_methods
         res_freq_lists = [self.lorentz_res_freq, self.parabolic_res_freq]
@@ -983,7 +4026,7 @@ class Jiggler():
         dt_list = []
         dt_labels = []
         for dt_string in self.midsample_times:
-            dt = datetime.strptime(dt_string, '%Y_%m_%d %H_%M_%S')
+            dt = parse_midsample_time(dt_string)
             dt_list.append(dt)
             dt_labels.append(dt.strftime('%H_%M_%S'))
 
@@ -1205,6 +4248,179 @@ class Jiggler():
             return A
 
 
+    def Batched_Sin_fit(self, time, angle, frequency):
+        """
+        Batched version of Nicks_Sin_fit. Fits the offset, cos and sin 
+        coefficients of every frequency in a sweep at once by solving the 
+        stacked 3x3 normal equations, instead of one design matrix and one
+        matrix inverse per frequency.
+
+        Parameters:
+            time: either a list of 1d arrays of time values (one per frequency,
+                lengths may differ) or a 2d array padded with NaN
+            angle: same layout as time
+            frequency: 1d array of the driving frequency of each row
+
+        Returns:
+            A: 1d array of amplitudes, identical to Nicks_Sin_fit for each row
+            phase: 1d array of phases, the fit is offset + A*cos(2*pi*f*t + phase)
+            rms: 1d array of the RMS of the fit residuals
+            Rows with less than 3 valid samples are returned as NaN.
+        """
+        frequency = np.asarray(frequency, dtype = float)
+        time = _pad_ragged(time)
+        angle = _pad_ragged(angle)
+
+        # Padding is masked out by zeroing it in the design matrix columns, 
+        # skipped entirely when every row has the same length
+        valid = ~(np.isnan(time) | np.isnan(angle))
+        padded = not valid.all()
+        if padded:
+            weights = valid.astype(float)
+            time = np.where(valid, time, 0)
+            angle = np.where(valid, angle, 0)
+            n = weights.sum(axis = 1)
+        else:
+            n = np.full(len(time), float(time.shape[1]))
+
+        omega_t = (2*np.pi*frequency)[:, np.newaxis]*time
+        cos_t = np.cos(omega_t)
+        sin_t = np.sin(omega_t)
+
+        if padded:
+            cos_t *= weights
+            sin_t *= weights
+
+        # Stacked XT_X and XT_b for X = [1, cos, sin]
+        S_c = cos_t.sum(axis = 1)
+        S_s = sin_t.sum(axis = 1)
+        S_cs = np.einsum("ij,ij->i", cos_t, sin_t)
+        XT_X = np.stack([np.stack([n, S_c, S_s], axis = -1),
+                         np.stack([S_c, np.einsum("ij,ij->i", cos_t, cos_t), S_cs], axis = -1),
+                         np.stack([S_s, S_cs, np.einsum("ij,ij->i", sin_t, sin_t)], axis = -1)],
+                         axis = 1)
+
+        # XT_b is taken for the mean-centered angle, which keeps the residual 
+        # sum of squares below accurate. Centering only shifts the offset term.
+        mean = angle.sum(axis = 1)/np.maximum(n, 1)
+        XT_b = np.stack([np.zeros(len(n)), 
+                         np.einsum("ij,ij->i", cos_t, angle) - mean*S_c,
+                         np.einsum("ij,ij->i", sin_t, angle) - mean*S_s], axis = -1)
+        b_b = np.einsum("ij,ij->i", angle, angle) - n*mean**2
+
+        # Rows which can't be fit are solved against the identity and discarded
+        too_short = n < 3
+        XT_X[too_short] = np.eye(3)
+        try:
+            a = np.linalg.solve(XT_X, XT_b[..., np.newaxis])[..., 0]
+        except np.linalg.LinAlgError:
+            a = np.matmul(np.linalg.pinv(XT_X), XT_b[..., np.newaxis])[..., 0]
+
+        # Calculating Amplitude and phase
+        A = np.sqrt(a[:, 1]**2 + a[:, 2]**2)
+        phase = np.arctan2(-a[:, 2], a[:, 1])
+
+        # Residual sum of squares from the normal equations, b.b - a.XT_b
+        SSR = b_b - np.einsum("ij,ij->i", a, XT_b)
+        rms = np.sqrt(np.maximum(SSR, 0)/np.maximum(n, 1))
+
+        A[too_short] = np.nan
+        phase[too_short] = np.nan
+        rms[too_short] = np.nan
+
+        return A, phase, rms
+
+
+    def settling_index(self, time, angle, frequency, window = None, tolerance = None):
+        """
+        Finds where a frequency block reaches steady state. The block is cut 
+        into windows of options_dict["settling_window"] samples and each 
+        window is sin fit (one Batched_Sin_fit call). The steady state 
+        amplitude and residual rms are the medians of the last half of the 
+        windows. A window is settled when its amplitude is within 
+        options_dict["settling_tolerance"] (relative) or 3 standard errors of 
+        the steady amplitude, and its residual rms (which the transient at 
+        the natural frequency inflates) is no more than 3 standard errors 
+        above the steady rms. The block is settled from the first window 
+        after the last unsettled one, at most half the block is trimmed.
+
+        If the last half itself is not steady the transient outlasts the 
+        block and its medians can't be used as the reference. The settling 
+        time is then extrapolated from the decay of the transient: the 
+        deviation of every window from the last one (the distance between 
+        their fit phasors, plus the excess of the residual rms over the 
+        quietest window) decays as exp(-t/tau), and a line fit to its log 
+        gives the time at which it falls below the tolerance. The trim is 
+        capped at half the block and the block is returned as unsettled.
+
+        Parameters:
+            time, angle = 1d arrays of a block as returned by block_formatter
+            frequency = drive frequency of the block
+            window, tolerance = default to the options_dict values
+
+        Returns:
+            (index of the first kept sample, settling time (s), settled)
+            settled is False when the transient outlasts the half block cap,
+            the settling time is then the extrapolated estimate, which can 
+            be longer than the block. A block too short to tell is returned
+            as (0, 0.0, True).
+        """
+        if window == None:
+            window = self.options_dict["settling_window"]
+        if tolerance == None:
+            tolerance = self.options_dict["settling_tolerance"]
+
+        n_windows = len(time)//window
+        if n_windows < 4:
+            return 0, 0.0, True
+
+        length = n_windows*window
+        A, phase, rms = self.Batched_Sin_fit(np.reshape(time[:length], (n_windows, window)),
+                                             np.reshape(angle[:length], (n_windows, window)),
+                                             np.full(n_windows, frequency))
+        steady = slice(n_windows//2, None)
+        A_ref = np.median(A[steady])
+        rms_ref = np.median(rms[steady])
+
+        # Standard error of a window's amplitude and rms from the noise
+        A_error = rms_ref*np.sqrt(2/window)
+        rms_error = rms_ref/np.sqrt(2*window)
+
+        settled = ((np.abs(A - A_ref) <= np.maximum(tolerance*A_ref, 3*A_error)) & 
+                   (rms <= rms_ref + 3*rms_error))
+        cap = (n_windows//2)*window
+        if settled[steady].all() == True:
+            unsettled = np.flatnonzero(~settled[:n_windows//2])
+            if len(unsettled) == 0:
+                return 0, 0.0, True
+            start = int((unsettled[-1] + 1)*window)
+            return start, float(time[start] - time[0]), True
+
+        # Transient outlasts the block, referenced to the last window instead
+        phasor = A*np.exp(1j*phase)
+        rms_floor = np.min(rms)
+        deviation = np.sqrt(np.abs(phasor - phasor[-1])**2 + 
+                            2*np.maximum(rms**2 - rms_floor**2, 0))
+        threshold = max(tolerance*A[-1], 3*rms_floor*np.sqrt(2/window))
+        centers = np.reshape(time[:length], (n_windows, window)).mean(axis = 1) - time[0]
+
+        # Log-linear fit of the windows clearly above the noise
+        fitted = np.flatnonzero(deviation[:-1] > threshold)
+        slope = 0
+        if len(fitted) >= 3:
+            slope, intercept = np.polyfit(centers[fitted], np.log(deviation[fitted]), 1)
+        if slope < 0:
+            settling_time = max((np.log(threshold) - intercept)/slope, 0.0)
+        else:
+            # No decay to extrapolate, end of the last window above the tolerance
+            above = np.flatnonzero(deviation > threshold)
+            last = above[-1] + 1 if len(above) > 0 else 0
+            settling_time = float(time[min(last*window, len(time) - 1)] - time[0])
+
+        start = min(int(np.searchsorted(time - time[0], settling_time)), cap)
+        return start, float(settling_time), start < cap
+
+
     def Average_Amplitude(self, angle):
         """
         Returns the average of the absolute value of the normed angle data as a float
@@ -1250,6 +4466,7 @@ class Jiggler():
 
     """Curve Fitting Functions"""
     #---------------------------------------------------------------------------
+    @timed("parabolic_fit")
     def parabolic_fit(self, A_sol_list, peak_width = 10, step_size = None):
         """First we need to dynamically find the xdata and ydata values for the 
         peak from the data"""
@@ -1323,84 +4540,67 @@ class Jiggler():
         self.res_freq_amp.append(resonant_amplitude)
 
 
-        return [resonant_freq, x_coords, y_fit]
-
-
-    def lorentz_fit(self, A_sol_list, start_tail = 5, end_tail = 5, peak_width = 15):
-        
-        """Defining Lorentz Function"""
-        def CF_lorentz_curve(x, x0, gamma, z):
-            """
-            x0 = location parameter, specifies location of the peak of the distribution
-            gamma/y = scale parameter, specifies the half-width at half-max
-                        2y would be FWHM
-            """
-            y = gamma
+        return FitResult("parabolic", resonant_freq, x_coords, y_fit, res_amp = resonant_amplitude)
 
-            lorentz = z * ((y**2) / ((x-x0)**2 + y**2))
-            return lorentz
 
+    @timed("lorentz_fit")
+    def lorentz_fit(self, A_sol_list, start_tail = 5, end_tail = 5, peak_width = 15,
+                    warm_start = False, background = None):
+        """
+        Fits lorentz_curve to the background subtracted sin fit amplitudes.
+        The background is taken from the tails of the sweep unless given, the
+        background of the last fit which estimated it is kept in 
+        self.lorentz_background.
+
+        The fit starts from lorentz_initial_guess(), or with warm_start = True
+        from the last successful fit (self.lorentz_warm_params) if its peak 
+        lies within the data, and is bounded to a peak inside the swept 
+        interval with a width between a tenth of a step and the interval and 
+        a positive height. Fits which end with the peak on the interval edge
+        count as failed. Convergence is recorded in self.lorentz_stats.
 
-        # """Dynamically estimating the start and end of the peak from the data"""
+        Returns:
+            FitResult, read as [resonant_frequency, xdata, ydata, FWHM, 
+            height_FWHM] where xdata and ydata are the fitted curve, all 0 if 
+            the fit failed
+        """
         # # Retrieve Amplitude (yvals) and frequency (xvals) values
-        ydata = A_sol_list[1]
-        xdata = A_sol_list[0]
-
-        # # Find the frequencies of the 5 largest amplitude values, take the mean 
-        # # as the estimate for the location of the center of the peak of the 
-        # # dataset.
-        # y_index_sorted = np.argsort(np.array(ydata))
-        # x_sorted = xdata[y_index_sorted]
-        # length = len(x_sorted)
-
-        # freq_of_A5_largest = []
-        # for i in range(length-5, length):
-        #     freq_of_A5_largest.append(x_sorted[i])
-
-        # # Taking the mean as estimated peak frequency
-        # freq_of_A5_largest_array = np.array(freq_of_A5_largest)
-        # estimated_peak_freq = np.mean(freq_of_A5_largest_array)
-
-        # """All x values +-  (1/2*peak_width) hz from the estimated peak_freq
-        # are used for the curve fitting"""
-        # x0 = estimated_peak_freq
-        # HWHM = peak_width/2
-
-        # where = np.where((xdata>(x0-HWHM)) & (xdata<(x0+HWHM)))
-        # xfit = xdata[where]
-        # yfit = ydata[where]
-        # print(HWHM)
-        # print(nf)
+        ydata = np.asarray(A_sol_list[1], dtype = float)
+        xdata = np.asarray(A_sol_list[0], dtype = float)
         
         #TEMP
         xfit = xdata
         yfit = ydata
 
-        """Estimating background noise"""
-        avg_start_noise = np.mean(ydata[0:start_tail])
-        avg_end_noise = np.mean(ydata[-end_tail: -1])
-        nf = (avg_start_noise+avg_end_noise)/2 # noise factor
-        # print(nf)
-        # print(f"len x is {len(xfit)} array is {xfit}")
-        # print(f"len x is {len(xother)} array is {xother}")
-        # print(f"len y is {len(yfit)} array is {yfit}")
+        # Starting from the previous fit when warm starting
+        p0 = self.lorentz_warm_params if warm_start == True else None
 
-        # Calculating least squares fitting of an optimized lorentz curve, 
-        # subtracting background noise from the amplitude values.
-        try:
-            popt, pcov = curve_fit(CF_lorentz_curve, xfit, yfit-nf)
-        except:
+        self.lorentz_stats.calls += 1
+        start = time.perf_counter()
+        popt, nf, info = fit_lorentz_peak(xfit, yfit, start_tail, end_tail, p0, background)
+        self.lorentz_stats.elapsed.append(time.perf_counter() - start)
+
+        if popt is None:
+            self.lorentz_stats.failures += 1
             print("Lorentz fit failed for current file")
-            return [0, 0, 0, 0, 0]
+            return FitResult("lorentz", 0, 0, 0, FWHM = 0, height_FWHM = 0)
+
+        self.lorentz_stats.warm_starts += info["warm"]
+        self.lorentz_stats.nfev.append(info["nfev"])
+        self.lorentz_stats.rms.append(info["rms"])
+        self.lorentz_warm_params = popt
+        if background is None:
+            self.lorentz_background = nf
 
         # Defining output values
         resonant_frequency = popt[0] # This is the center of  the peak
         FWHM = 2*popt[1] # 2x gamma value from lorentz curve is FWHM
         xdata = np.linspace(xfit[0],xfit[-1], 1000)
-        ydata = CF_lorentz_curve(xdata, *popt) + nf # Adding back noise for fit
+        ydata = lorentz_curve(xdata, *popt) + nf # Adding back noise for fit
         height_FWHM = ((np.max(ydata)-nf)/2) + nf
 
-        return resonant_frequency, xdata, ydata, FWHM, height_FWHM
+        return FitResult("lorentz", resonant_frequency, xdata, ydata, FWHM = FWHM, 
+                         height_FWHM = height_FWHM)
 
 
     # Unfinished Peak Search Function
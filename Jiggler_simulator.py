@@ -0,0 +1,271 @@
+import numpy as np # Mathmatical library
+import time
+
+from Jiggler_funcs_V1_02_with_temp import SerialSession
+
+"""
+Software stand-in for the Jiggler's Arduino so sweeps and loops can be run,
+benchmarked and load tested without the instrument connected.
+
+SimulatedSerial speaks the same protocol as the firmware:
+    - each write() is one command, a frequency in ascii ("113.2")
+    - frequencies below 50 are stop commands
+    - each frequency command is answered with sample_size lines of
+      "freq,micros,angle,temp1,temp2\r\n"
+
+Usage:
+    Jig = Jiggler(com_port = "SIM", f_interval = [110,118], step_size = 0.2)
+    attach_simulator(Jig, res_freq = 114.3, noise = 1.0)
+    Jig.Jiggler_sweep()
+"""
+
+class SimulatedSerial():
+    """
+    Drop-in replacement for serial.Serial driven by a damped (driven harmonic)
+    oscillator model. Accepts the serial.Serial keyword arguments used in
+    serial_defaults, only port, baudrate and timeout are used.
+
+    Simulation parameters:
+        res_freq = resonant frequency in Hz at the start of the simulation
+        Q = quality factor of the oscillator (res_freq/FWHM)
+        peak_amplitude = amplitude at resonance in tenths of a degree
+        angle_offset = resting angle in tenths of a degree
+        noise = standard deviation of the angle noise in tenths of a degree
+        settling = True adds the decaying free response after each frequency
+            change, as the real oscillator needs time to settle
+        sample_size = number of lines sent per frequency command
+        sample_period = time between samples in seconds (micros column)
+        temp1, temp2 = starting temperatures in degrees C
+        temp_drift = temperature drift in degrees C per hour
+        temp_noise = standard deviation of the temperature readings
+        res_freq_drift = drift of the resonant frequency in Hz per hour
+        truncate_prob = probability of a line being cut short
+        garble_prob = probability of a line having random bytes inserted
+        realtime = True throttles the output to baudrate/10 bytes per second,
+            False makes every block available immediately
+        boot_time = seconds after opening during which commands are ignored,
+            like the Arduino resetting when the port opens
+        seed = seed for the random generator
+    """
+    def __init__(self, port = "SIM", baudrate = 9600, timeout = 2, res_freq = 114.0,
+                 Q = 70, peak_amplitude = 100, angle_offset = 0, noise = 1.0,
+                 settling = True, sample_size = 1500, sample_period = 700/1E6,
+                 temp1 = 25.0, temp2 = 24.0, temp_drift = 0.0, temp_noise = 0.02,
+                 res_freq_drift = 0.0, truncate_prob = 0.0, garble_prob = 0.0,
+                 realtime = True, boot_time = 0.0, seed = 0, **serial_kwargs):
+        self.port = port
+        self.baudrate = baudrate
+        self.timeout = timeout
+        self.res_freq = res_freq
+        self.Q = Q
+        self.peak_amplitude = peak_amplitude
+        self.angle_offset = angle_offset
+        self.noise = noise
+        self.settling = settling
+        self.sample_size = sample_size
+        self.sample_period = sample_period
+        self.temp1 = temp1
+        self.temp2 = temp2
+        self.temp_drift = temp_drift
+        self.temp_noise = temp_noise
+        self.res_freq_drift = res_freq_drift
+        self.truncate_prob = truncate_prob
+        self.garble_prob = garble_prob
+        self.realtime = realtime
+        self.boot_time = boot_time
+
+        self.rng = np.random.default_rng(seed)
+        self.open_time = time.perf_counter()
+        self.is_open = True
+
+        # Output stream: bytes of the current block, position read so far and
+        # the time the block started transmitting
+        self._output = b""
+        self._position = 0
+        self._output_start = self.open_time
+
+        # Counters for load testing
+        self.commands = []
+        self.bytes_sent = 0
+
+
+    """Oscillator model"""
+    #---------------------------------------------------------------------------
+    def current_res_freq(self):
+        hours = (time.perf_counter() - self.open_time)/3600
+        return self.res_freq + self.res_freq_drift*hours
+
+
+    def response(self, freq):
+        """Steady state amplitude (tenths of a degree) and phase lag of the
+        oscillator driven at freq"""
+        f0 = self.current_res_freq()
+        denominator = np.sqrt((f0**2 - freq**2)**2 + (freq*f0/self.Q)**2)
+        amplitude = self.peak_amplitude*(f0**2/self.Q)/denominator
+        phase_lag = np.arctan2(freq*f0/self.Q, f0**2 - freq**2)
+        return amplitude, phase_lag
+
+
+    def generate_block(self, freq):
+        """Returns the bytes the firmware sends for one frequency command"""
+        n = self.sample_size
+        t = np.cumsum(self.rng.uniform(0.9, 1.1, n)*self.sample_period)
+        amplitude, phase_lag = self.response(freq)
+
+        angle = amplitude*np.cos(2*np.pi*freq*t - phase_lag)
+        if self.settling == True:
+            # Free response starting from rest, decaying with the oscillator's
+            # time constant Q/(pi*f0)
+            f0 = self.current_res_freq()
+            tau = self.Q/(np.pi*f0)
+            angle -= amplitude*np.cos(-phase_lag)*np.exp(-t/tau)*np.cos(2*np.pi*f0*t)
+        angle = np.round(angle + self.angle_offset + self.rng.normal(0, self.noise, n)).astype(int)
+
+        hours = (time.perf_counter() - self.open_time)/3600
+        temp1 = self.temp1 + self.temp_drift*hours + self.rng.normal(0, self.temp_noise, n)
+        temp2 = self.temp2 + self.temp_drift*hours + self.rng.normal(0, self.temp_noise, n)
+        micros = (t*1E6).astype(np.int64)
+
+        lines = [f"{freq:.2f},{m},{a},{t1:.2f},{t2:.2f}\r\n"
+                 for m, a, t1, t2 in zip(micros.tolist(), angle.tolist(), temp1.tolist(), temp2.tolist())]
+
+        # Corrupting lines the way a noisy or overrun link does
+        if self.truncate_prob > 0:
+            for i in np.flatnonzero(self.rng.random(n) < self.truncate_prob):
+                lines[i] = lines[i][:self.rng.integers(0, max(1, len(lines[i]) - 2))] + "\r\n"
+        if self.garble_prob > 0:
+            for i in np.flatnonzero(self.rng.random(n) < self.garble_prob):
+                cut = self.rng.integers(0, max(1, len(lines[i]) - 2))
+                garbage = "".join(chr(c) for c in self.rng.integers(33, 127, 3))
+                lines[i] = lines[i][:cut] + garbage + lines[i][cut:]
+
+        return "".join(lines).encode("ascii")
+
+
+    """Output stream"""
+    #---------------------------------------------------------------------------
+    def _arrived(self):
+        """Number of bytes of the current block transmitted so far"""
+        if self.realtime == False or self.baudrate == None:
+            return len(self._output)
+        elapsed = time.perf_counter() - self._output_start
+        return min(len(self._output), int(elapsed*self.baudrate/10))
+
+
+    def _arrival_time(self, n_bytes):
+        """Time at which the first n_bytes of the current block are available"""
+        if self.realtime == False or self.baudrate == None:
+            return 0
+        return self._output_start + n_bytes*10/self.baudrate
+
+
+    def _wait_until(self, n_bytes):
+        """Blocks until n_bytes of the block have arrived or the read timeout
+        runs out, like pyserial's blocking reads"""
+        n_bytes = min(n_bytes, len(self._output))
+        target = self._arrival_time(n_bytes)
+        if self.timeout != None:
+            target = min(target, time.perf_counter() + self.timeout)
+        delay = target - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+
+
+    """pyserial interface"""
+    #---------------------------------------------------------------------------
+    @property
+    def in_waiting(self):
+        return self._arrived() - self._position
+
+
+    def write(self, data):
+        command = bytes(data)
+        self.commands.append(command)
+
+        # The Arduino is still resetting and misses the command
+        if time.perf_counter() - self.open_time < self.boot_time:
+            return len(data)
+
+        try:
+            freq = float(command.decode("ascii"))
+        except ValueError:
+            freq = None
+
+        if freq == None:
+            self._start_output(b"FLOAT ERROR\r\n")
+        elif freq < 50:
+            self._start_output(b"")
+        else:
+            self._start_output(self.generate_block(freq))
+        return len(data)
+
+
+    def _start_output(self, output):
+        self._output = output
+        self._position = 0
+        self._output_start = time.perf_counter()
+
+
+    def read(self, size = 1):
+        self._wait_until(self._position + size)
+        end = min(self._position + size, self._arrived())
+        data = self._output[self._position:end]
+        self._position = end
+        self.bytes_sent += len(data)
+        return data
+
+
+    def read_until(self, expected = b"\n", size = None):
+        # Waiting for the terminator of the next line to arrive
+        terminator = self._output.find(expected, self._position)
+        end = len(self._output) if terminator == -1 else terminator + len(expected)
+        if size != None:
+            end = min(end, self._position + size)
+        return self.read(end - self._position) if end > self._position else self.read(0)
+
+
+    def readline(self):
+        return self.read_until()
+
+
+    def reset_input_buffer(self):
+        self._position = self._arrived()
+
+
+    def reset_output_buffer(self):
+        pass
+
+
+    def flush(self):
+        pass
+
+
+    def close(self):
+        self.is_open = False
+
+
+    def __repr__(self):
+        return f"SimulatedSerial(port={self.port!r}, res_freq={self.current_res_freq():.3f})"
+
+
+def simulated_port_factory(**sim_params):
+    """Returns a port_factory for SerialSession which creates SimulatedSerial
+    ports with the given simulation parameters. sim_params take precedence
+    over the serial_dict entries (eg. baudrate)."""
+    def factory(**serial_kwargs):
+        serial_kwargs.update(sim_params)
+        return SimulatedSerial(**serial_kwargs)
+    return factory
+
+
+def attach_simulator(jig, **sim_params):
+    """
+    Points a Jiggler at a simulated port. The simulator's sample_size follows
+    jig.sample_size unless given. Returns the SerialSession, the simulated port
+    itself is jig.session.port once the first sweep has connected.
+    """
+    sim_params.setdefault("sample_size", jig.sample_size)
+    jig.close()
+    jig.session = SerialSession(jig.serial_dict, port_factory = simulated_port_factory(**sim_params),
+                                probe_interval = 0.05)
+    return jig.session